@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'app.chat'
\ No newline at end of file
+    name = 'app.chat'
+
+    def ready(self):
+        import app.chat.signals
@@ -0,0 +1,184 @@
+"""Archival of old chat messages.
+
+Messages older than ARCHIVE_AFTER_DAYS move from Message to ArchivedMessage
+in chunks of CHUNK_SIZE, walking the (created_at, id) index. Each chunk is
+one short transaction: lock the rows (skipping any a request holds), copy
+them with zlib-compressed content, delete them. Between chunks archival
+sleeps for CHUNK_PAUSE, gives up after a time budget, and the scheduled task
+only runs inside QUIET_HOURS. Peak-hour chat never waits behind it for long.
+
+Messages with attachments, or with hot replies pointing at them, stay in
+Message: deleting them would cascade to the files or null the replies. A
+later run picks up the originals once their replies have been archived.
+
+History reads stay transparent: merge_archived() adds archived rows to a
+page whenever the page reaches back past the archive cutoff. ArchivedMessage
+keeps the original ids, so cursors work across the boundary.
+"""
+import logging
+import time
+import zlib
+from datetime import timedelta
+
+from decouple import config
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import ArchivedMessage, Message, MessageAttachment
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = config('CHAT_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+CHUNK_SIZE = 500
+CHUNK_PAUSE = 0.5     # seconds between chunks
+MAX_SECONDS = 600     # time budget of one run
+LOCK_TIMEOUT = '2s'   # PostgreSQL: give up on a chunk rather than queue behind requests
+# Local hours (start-end, end exclusive) in which the scheduled task may run
+QUIET_HOURS = config('CHAT_ARCHIVE_HOURS', default='1-6')
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), 6)
+
+
+def decompress(blob):
+    return zlib.decompress(bytes(blob)).decode('utf-8')
+
+
+def archive_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def in_quiet_hours(now=None, hours=QUIET_HOURS):
+    start, end = (int(hour) for hour in hours.split('-'))
+    hour = timezone.localtime(now).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _archivable(cutoff):
+    return Message.objects.filter(created_at__lt=cutoff).exclude(
+        Exists(MessageAttachment.objects.filter(message=OuterRef('pk')))
+    ).exclude(
+        Exists(Message.objects.filter(reply_to=OuterRef('pk')))
+    )
+
+
+def _archived_copy(message):
+    return ArchivedMessage(
+        id=message.id,
+        conversation_id=message.conversation_id,
+        sender_id=message.sender_id,
+        content_compressed=compress(message.content),
+        message_type=message.message_type,
+        status=message.status,
+        created_at=message.created_at,
+        delivered_at=message.delivered_at,
+        read_at=message.read_at,
+        message_id=message.message_id,
+        reply_to_id=message.reply_to_id,
+        metadata=message.metadata
+    )
+
+
+def archive_chunk(cutoff, after=None, chunk_size=CHUNK_SIZE):
+    """Move the next chunk older than cutoff after the (created_at, id) key after.
+
+    Returns (messages moved, key to continue from or None when done).
+    """
+    queryset = _archivable(cutoff)
+    if after is not None:
+        created_at, message_id = after
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True, of=('self',))
+        chunk = list(queryset.order_by('created_at', 'id')[:chunk_size])
+        if not chunk:
+            return 0, None
+        ArchivedMessage.objects.bulk_create([_archived_copy(message) for message in chunk], ignore_conflicts=True)
+        Message.objects.filter(id__in=[message.id for message in chunk]).delete()
+
+    last = chunk[-1]
+    return len(chunk), ((last.created_at, last.id) if len(chunk) == chunk_size else None)
+
+
+def archive_old_messages(cutoff=None, chunk_size=CHUNK_SIZE, pause=CHUNK_PAUSE, max_seconds=MAX_SECONDS,
+                         sleep=time.sleep):
+    """Archive everything older than cutoff, or as much as fits in max_seconds; returns the count"""
+    cutoff = cutoff or archive_cutoff()
+    deadline = time.monotonic() + max_seconds
+    total, after = 0, None
+    while True:
+        moved, after = archive_chunk(cutoff, after, chunk_size)
+        total += moved
+        if after is None:
+            break
+        if time.monotonic() >= deadline:
+            logger.info(f"Archival stopped at its time budget after {total} messages")
+            break
+        sleep(pause)
+    if total:
+        logger.info(f"Archived {total} chat messages older than {cutoff:%Y-%m-%d}")
+    return total
+
+
+def as_message(archived):
+    """An unsaved Message carrying an archived row, for serializers and history pages"""
+    message = Message(
+        id=archived.id,
+        conversation_id=archived.conversation_id,
+        sender_id=archived.sender_id,
+        content=decompress(archived.content_compressed),
+        message_type=archived.message_type,
+        status=archived.status,
+        created_at=archived.created_at,
+        delivered_at=archived.delivered_at,
+        read_at=archived.read_at,
+        message_id=archived.message_id,
+        reply_to_id=archived.reply_to_id,
+        metadata=archived.metadata
+    )
+    message._state.adding = False
+    message.sender = archived.sender
+    # Archived messages never have attachments; skip the per-message query
+    message._prefetched_objects_cache = {'attachments': MessageAttachment.objects.none()}
+    return message
+
+
+def archived_page(conversation, keyset_filter, ordering, limit):
+    """Archived messages of conversation as Message instances"""
+    rows = ArchivedMessage.objects.filter(conversation=conversation).filter(keyset_filter).select_related(
+        'sender'
+    ).order_by(*ordering)[:limit]
+    return [as_message(row) for row in rows]
+
+
+def merge_archived(conversation, page, keyset_filter, limit, newest_first=True, after=None):
+    """page (hot Message rows, up to limit + 1) merged with the archived rows matching keyset_filter.
+
+    Archived rows are all older than the cutoff, so the archive is only read
+    when the page reaches back past it: a full newest-first page ending before
+    the cutoff, or an oldest-first page starting after a boundary older than it.
+    """
+    cutoff = archive_cutoff()
+    if newest_first and len(page) > limit and page[-1].created_at >= cutoff:
+        return page
+    if not newest_first and after is not None and after >= cutoff:
+        return page
+    ordering = ('-created_at', '-id') if newest_first else ('created_at', 'id')
+    archived = archived_page(conversation, keyset_filter, ordering, limit + 1)
+    if not archived:
+        return page
+    merged = sorted(page + archived, key=lambda m: (m.created_at, m.id), reverse=newest_first)
+    return merged[:limit + 1]
+
+
+def find_archived(conversation, message_id):
+    """The (id, created_at) of an archived message; raises ArchivedMessage.DoesNotExist"""
+    return ArchivedMessage.objects.only('id', 'created_at').get(conversation=conversation, message_id=message_id)
+
@@ -0,0 +1,303 @@
+"""Upload, processing and download of chat attachments.
+
+Large files arrive as resumable uploads: the client appends chunks at
+AttachmentUpload.offset and may resume after a dropped connection by asking
+for the offset. Each chunk is streamed straight to the partial file, and the
+finished file is renamed into place rather than copied.
+
+Once an attachment row commits, a process pool hashes the file and, for
+images, records the dimensions and writes a JPEG thumbnail, keeping that CPU
+work off web workers and out of the GIL. Files whose SHA-256 and size match an
+earlier attachment are swapped for the stored copy.
+
+Downloads go through attachment_response: a FileResponse with single-range
+support. Servers that provide wsgi.file_wrapper (gunicorn, uWSGI) send it
+with sendfile(), so the bytes never pass through Python.
+"""
+import functools
+import hashlib
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from decouple import config
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.http import FileResponse, HttpResponse
+
+from .models import MessageAttachment
+from .realtime import emit_external, conversation_room
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for hashing and thumbnails; 0 processes on the calling thread
+ATTACHMENT_WORKERS = config('CHAT_ATTACHMENT_WORKERS', default=2, cast=int)
+CHUNK_SIZE = 1024 * 1024          # suggested to clients
+MAX_CHUNK_SIZE = 8 * 1024 * 1024  # largest chunk accepted in one request
+MAX_UPLOAD_SIZE = config('CHAT_MAX_UPLOAD_SIZE', default=100 * 1024 * 1024, cast=int)
+THUMBNAIL_SIZE = (320, 320)
+READ_BLOCK = 64 * 1024
+
+_pool = None
+
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, expected):
+        super().__init__(f'Upload is at offset {expected}')
+        self.expected = expected
+
+
+def file_type_for(mime_type):
+    if mime_type.startswith('image/'):
+        return 'image'
+    elif mime_type.startswith('video/'):
+        return 'video'
+    elif mime_type.startswith('audio/'):
+        return 'audio'
+    else:
+        return 'document'
+
+
+def append_chunk(upload, stream, offset, length):
+    """Append length bytes from stream at offset; returns the new offset.
+
+    Raises UploadOffsetMismatch unless offset is where the upload stands, so a
+    client resuming after a lost response learns where to continue.
+    """
+    if offset != upload.offset:
+        raise UploadOffsetMismatch(upload.offset)
+    if length > MAX_CHUNK_SIZE or offset + length > upload.total_size:
+        raise ValueError('Chunk is too large')
+
+    path = default_storage.path(upload.partial_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, 'ab') as f:
+        f.truncate(offset)
+        while written < length:
+            block = stream.read(min(READ_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    if written != length:
+        # Drop the torn tail; the client resends from the recorded offset
+        with open(path, 'ab') as f:
+            f.truncate(offset)
+        raise ValueError('Chunk ended early')
+
+    upload.offset = offset + written
+    upload.save(update_fields=['offset', 'updated_at'])
+    return upload.offset
+
+
+class _PartialFile(File):
+    """Lets FileSystemStorage rename the finished upload into place instead of copying it"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def attach_upload(upload, message):
+    """Turn a finished upload into an attachment of message and forget the upload"""
+    path = default_storage.path(upload.partial_name)
+    attachment = MessageAttachment(
+        message=message,
+        file_name=upload.file_name,
+        file_size=upload.total_size,
+        file_type=file_type_for(upload.mime_type),
+        mime_type=upload.mime_type
+    )
+    with open(path, 'rb') as f:
+        attachment.file.save(upload.file_name, _PartialFile(f), save=False)
+    attachment.save()
+    upload.delete()
+    schedule_processing(attachment)
+    return attachment
+
+
+def inspect_file(path, mime_type, thumbnail_path):
+    """SHA-256 of the file and, for images, its size and a thumbnail at thumbnail_path.
+
+    Runs in a worker process, so it takes and returns plain values only.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(functools.partial(f.read, READ_BLOCK), b''):
+            digest.update(block)
+    result = {'content_hash': digest.hexdigest(), 'width': None, 'height': None, 'thumbnail': False}
+
+    if mime_type.startswith('image/'):
+        from PIL import Image, ImageOps
+
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            result['width'], result['height'] = image.size
+            image.thumbnail(THUMBNAIL_SIZE)
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            image.convert('RGB').save(thumbnail_path, 'JPEG', quality=80, optimize=True)
+            result['thumbnail'] = True
+    return result
+
+
+def _pool_executor():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=ATTACHMENT_WORKERS)
+    return _pool
+
+
+def _thumbnail_name():
+    return f'chat_thumbnails/{uuid.uuid4()}.jpg'
+
+
+def schedule_processing(attachment):
+    """Process attachment in the pool once the current transaction commits"""
+    transaction.on_commit(functools.partial(submit_processing, attachment.id, attachment.file.name, attachment.mime_type))
+
+
+def submit_processing(attachment_id, file_name, mime_type):
+    thumbnail_name = _thumbnail_name()
+    args = (default_storage.path(file_name), mime_type, default_storage.path(thumbnail_name))
+    if ATTACHMENT_WORKERS <= 0:
+        try:
+            result = inspect_file(*args)
+        except Exception as e:
+            result = e
+        finish_processing(attachment_id, thumbnail_name, result)
+        return
+    future = _pool_executor().submit(inspect_file, *args)
+    future.add_done_callback(functools.partial(_finish_future, attachment_id, thumbnail_name))
+
+
+def _finish_future(attachment_id, thumbnail_name, future):
+    # Runs on the pool's result thread, which has its own database connection
+    try:
+        finish_processing(attachment_id, thumbnail_name, future.exception() or future.result())
+    finally:
+        close_old_connections()
+
+
+def finish_processing(attachment_id, thumbnail_name, result):
+    """Store a worker's result (or exception) and tell the conversation the attachment is ready"""
+    from .serializers import MessageAttachmentSerializer
+
+    try:
+        attachment = MessageAttachment.objects.select_related('message').get(id=attachment_id)
+    except MessageAttachment.DoesNotExist:
+        # Deleted while processing
+        if isinstance(result, dict) and result['thumbnail']:
+            default_storage.delete(thumbnail_name)
+        return
+
+    if isinstance(result, Exception):
+        logger.warning(f"Processing attachment {attachment_id} failed: {result}")
+        attachment.processing_status = 'failed'
+        attachment.save(update_fields=['processing_status'])
+        return
+
+    attachment.content_hash = result['content_hash']
+    attachment.width = result['width']
+    attachment.height = result['height']
+    if result['thumbnail']:
+        attachment.thumbnail.name = thumbnail_name
+
+    duplicate = MessageAttachment.objects.filter(
+        content_hash=attachment.content_hash,
+        file_size=attachment.file_size,
+        processing_status='ready'
+    ).exclude(id=attachment.id).exclude(file=attachment.file.name).order_by('id').first()
+    if duplicate is not None:
+        default_storage.delete(attachment.file.name)
+        attachment.file.name = duplicate.file.name
+        if duplicate.thumbnail:
+            if result['thumbnail']:
+                default_storage.delete(thumbnail_name)
+            attachment.thumbnail.name = duplicate.thumbnail.name
+
+    attachment.processing_status = 'ready'
+    attachment.save(update_fields=['content_hash', 'width', 'height', 'thumbnail', 'file', 'processing_status'])
+    emit_external('attachment_ready', {
+        'conversation_id': attachment.message.conversation_id,
+        'message_id': attachment.message_id,
+        'attachment': MessageAttachmentSerializer(attachment).data
+    }, room=conversation_room(attachment.message.conversation_id))
+
+
+class _RangeFile:
+    """Reads at most length bytes of f from its current position.
+
+    fileno() stays available so wsgi.file_wrapper can sendfile() the range;
+    servers bound that by Content-Length.
+    """
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range Range header, None to send everything.
+
+    Raises ValueError for a range that cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def attachment_response(attachment, range_header=None):
+    """The attachment's file, or the requested byte range of it"""
+    f = attachment.file.open('rb')
+    size = attachment.file.size
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    filename = attachment.file_name
+    if byte_range is None:
+        response = FileResponse(f, content_type=attachment.mime_type, filename=filename)
+    else:
+        start, end = byte_range
+        f.seek(start)
+        response = FileResponse(
+            _RangeFile(f, end - start + 1), status=206, content_type=attachment.mime_type, filename=filename
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,117 @@
+"""Socket connection registries for the chat servers.
+
+LocalConnectionRegistry keeps connections in process memory and is enough
+for a single chat process. It indexes them both ways (sid -> user_id and
+user_id -> set of sids) so presence checks, connection limits and disconnects
+never scan every socket; the eventlet server uses its synchronous track and
+untrack methods directly. RedisConnectionRegistry shares them between chat
+nodes: each user has a sorted set of sids scored by expiry time, which the
+node owning the socket refreshes on every heartbeat. When a node dies its
+sids simply age out instead of counting against the user forever.
+"""
+import time
+
+CONNECTION_TTL = 90  # seconds; heartbeats run every CONNECTION_TTL / 3
+
+
+class LocalConnectionRegistry:
+    """The sockets held by this process, indexed by sid and by user"""
+
+    def __init__(self):
+        self.sids = {}
+        self.user_sids = {}
+
+    def user_for(self, sid):
+        return self.sids.get(sid)
+
+    def local_sids(self, user_id):
+        return self.user_sids.get(user_id, set())
+
+    def local_users(self):
+        return self.user_sids.keys()
+
+    def track(self, sid, user_id):
+        """Record sid for user_id; returns the user's connections in this process"""
+        self.sids[sid] = user_id
+        sids = self.user_sids.setdefault(user_id, set())
+        sids.add(sid)
+        return len(sids)
+
+    def untrack(self, sid):
+        """Forget sid; returns (user_id, the user's remaining connections in this process)"""
+        user_id = self.sids.pop(sid, None)
+        if user_id is None:
+            return None, 0
+        sids = self.user_sids.get(user_id, set())
+        sids.discard(sid)
+        if not sids:
+            self.user_sids.pop(user_id, None)
+        return user_id, len(sids)
+
+    async def count(self, user_id):
+        """Live connections of user_id"""
+        return len(self.local_sids(user_id))
+
+    async def is_online(self, user_id):
+        return await self.count(user_id) > 0
+
+    async def add(self, sid, user_id):
+        return self.track(sid, user_id)
+
+    async def remove(self, sid):
+        """Forget sid; returns (user_id, remaining connections of that user)"""
+        return self.untrack(sid)
+
+    async def refresh(self):
+        pass
+
+
+class RedisConnectionRegistry(LocalConnectionRegistry):
+    """Cluster-wide registry on top of the local one"""
+
+    def __init__(self, redis_client, ttl=CONNECTION_TTL):
+        super().__init__()
+        self.redis = redis_client
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id):
+        return f'chat:connections:{user_id}'
+
+    async def count(self, user_id):
+        return await self.redis.zcount(self.key(user_id), time.time(), '+inf')
+
+    async def add(self, sid, user_id):
+        self.track(sid, user_id)
+        key = self.key(user_id)
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zadd(key, {sid: now + self.ttl})
+            pipe.expire(key, self.ttl)
+            pipe.zcard(key)
+            *_, total = await pipe.execute()
+        return total
+
+    async def remove(self, sid):
+        user_id, _ = self.untrack(sid)
+        if user_id is None:
+            return None, 0
+        key = self.key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(key, sid)
+            pipe.zremrangebyscore(key, '-inf', time.time())
+            pipe.zcard(key)
+            *_, remaining = await pipe.execute()
+        return user_id, remaining
+
+    async def refresh(self):
+        """Push the expiry of every local socket forward in one round trip"""
+        if not self.sids:
+            return
+        expires = time.time() + self.ttl
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for sid, user_id in self.sids.items():
+                pipe.zadd(self.key(user_id), {sid: expires})
+                pipe.expire(self.key(user_id), self.ttl)
+            await pipe.execute()
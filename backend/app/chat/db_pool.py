@@ -0,0 +1,159 @@
+"""Bounded database access for the chat servers.
+
+Socket handlers never run ORM calls on the event loop (chat_server_async.py)
+or the eventlet hub (chat_server.py). Blocking database work goes to a pool
+of CHAT_DB_THREADS worker threads instead. Django keeps one connection per
+thread, and each worker reuses its connection for CONN_MAX_AGE; around every
+call close_old_connections() retires connections that are too old or broken.
+A chat process therefore holds at most CHAT_DB_THREADS Postgres connections,
+however many sockets it serves. Work beyond that waits for a free worker
+rather than opening another connection.
+
+ThreadDBPool serves asyncio through a ThreadPoolExecutor. GreenDBPool serves
+eventlet through eventlet.tpool, which blocks only the calling greenlet.
+
+Both pools record how long work waits for a worker and how busy the workers
+are. The chat servers log snapshot() every METRICS_INTERVAL and mirror it to
+the DB_METRICS_KEY:<node> hash in Redis.
+"""
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+from django.db import close_old_connections
+
+DB_THREADS = config('CHAT_DB_THREADS', default=8, cast=int)
+DB_METRICS_KEY = 'chat:db_pool'
+METRICS_INTERVAL = 30  # seconds between snapshots in the chat servers
+METRICS_TTL = 3 * METRICS_INTERVAL  # a stopped node's hash lapses on its own
+WAIT_SAMPLES = 1000    # wait times kept per snapshot window
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class DBPoolMetrics:
+    """Counters updated from the worker threads; snapshot() also starts a new window"""
+
+    def __init__(self, size, clock=time.perf_counter):
+        self.size = size
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failures = 0
+        self.busy = 0
+        self.max_busy = 0
+        self.waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self.busy_seconds = 0.0
+        self.window_started = clock()
+
+    def submit(self):
+        with self.lock:
+            self.submitted += 1
+
+    def start(self, waited):
+        with self.lock:
+            self.busy += 1
+            self.max_busy = max(self.max_busy, self.busy)
+            self.waits.append(waited)
+
+    def finish(self, seconds, failed):
+        with self.lock:
+            self.busy -= 1
+            self.completed += 1
+            self.failures += failed
+            self.busy_seconds += seconds
+
+    def snapshot(self):
+        with self.lock:
+            now = self.clock()
+            elapsed = max(now - self.window_started, 1e-9)
+            waits = sorted(self.waits)
+            snapshot = {
+                'size': self.size,
+                'busy': self.busy,
+                'max_busy': self.max_busy,
+                'queued': self.submitted - self.completed - self.busy,
+                'tasks': self.completed,
+                'failures': self.failures,
+                # Share of worker time spent on completed work since the last snapshot
+                'utilization': round(min(1.0, self.busy_seconds / (self.size * elapsed)), 3),
+                'wait_ms_p50': round(_percentile(waits, 50) * 1000, 3) if waits else 0.0,
+                'wait_ms_p99': round(_percentile(waits, 99) * 1000, 3) if waits else 0.0,
+                'wait_ms_max': round(waits[-1] * 1000, 3) if waits else 0.0
+            }
+            self.waits.clear()
+            self.busy_seconds = 0.0
+            self.max_busy = self.busy
+            self.window_started = now
+        return snapshot
+
+
+class DBPool:
+    def __init__(self, size=DB_THREADS):
+        self.size = size
+        self.metrics = DBPoolMetrics(size)
+
+    def _work(self, func, args, kwargs):
+        """func wrapped to run on a worker: timed, with connection upkeep before and after"""
+        metrics = self.metrics
+        metrics.submit()
+        submitted = metrics.clock()
+
+        def work():
+            started = metrics.clock()
+            metrics.start(started - submitted)
+            failed = True
+            close_old_connections()
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                close_old_connections()
+                metrics.finish(metrics.clock() - started, failed)
+        return work
+
+    def snapshot(self):
+        return self.metrics.snapshot()
+
+
+class ThreadDBPool(DBPool):
+    """For the asyncio server: await pool.run(func, ...)"""
+
+    def __init__(self, size=DB_THREADS):
+        super().__init__(size)
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='chat-db')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._work(func, args, kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class GreenDBPool(DBPool):
+    """For the eventlet server: pool.run(func, ...) blocks the calling greenlet only"""
+
+    def __init__(self, size=DB_THREADS):
+        super().__init__(size)
+        from eventlet import tpool
+        # Takes effect when tpool starts its threads on first use
+        tpool.set_num_threads(size)
+        self.tpool = tpool
+
+    def run(self, func, *args, **kwargs):
+        return self.tpool.execute(self._work(func, args, kwargs))
+
+    def shutdown(self):
+        self.tpool.killall()
+
+
+def metrics_key(node):
+    return f'{DB_METRICS_KEY}:{node}'
@@ -0,0 +1,92 @@
+"""Keyset pagination over a conversation's message history.
+
+Pages are addressed by the (created_at, id) of their boundary message instead
+of a page number, so every page is an index range scan on
+(conversation, -created_at) with no COUNT(*) and no OFFSET: page 500 costs
+the same as page 1. messages_after serves clients catching up after a
+reconnect, starting from the last message they saw. Both read through to
+ArchivedMessage once they reach past the archive cutoff.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+from .archive import find_archived, merge_archived
+from .models import ArchivedMessage, Message
+
+PAGE_SIZE = 50
+SYNC_LIMIT = 200
+
+
+def encode_cursor(message):
+    raw = f'{message.created_at.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError when it is malformed"""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {e}') from None
+
+
+def _messages(conversation):
+    return Message.objects.filter(conversation=conversation).select_related('sender').prefetch_related('attachments')
+
+
+def page_before(conversation, cursor=None, limit=PAGE_SIZE):
+    """The limit messages older than cursor (newest page without one), oldest first.
+
+    Pages reaching past the archive cutoff include archived messages.
+    Returns (messages, next_cursor); next_cursor is None on the oldest page.
+    """
+    keyset = Q()
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        keyset = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+    page = list(_messages(conversation).filter(keyset).order_by('-created_at', '-id')[:limit + 1])
+    page = merge_archived(conversation, page, keyset, limit)
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return list(reversed(page[:limit])), next_cursor
+
+
+def messages_after(conversation, message_id, limit=SYNC_LIMIT):
+    """Messages newer than the one with message_id, oldest first; returns (messages, has_more).
+
+    Raises Message.DoesNotExist when message_id is not in the conversation
+    (hot or archived).
+    """
+    try:
+        boundary = Message.objects.only('id', 'created_at').get(conversation=conversation, message_id=message_id)
+    except Message.DoesNotExist:
+        try:
+            boundary = find_archived(conversation, message_id)
+        except ArchivedMessage.DoesNotExist:
+            raise Message.DoesNotExist(f'No message {message_id} in conversation') from None
+    keyset = Q(created_at__gt=boundary.created_at) | Q(created_at=boundary.created_at, id__gt=boundary.id)
+    page = list(_messages(conversation).filter(keyset).order_by('created_at', 'id')[:limit + 1])
+    page = merge_archived(conversation, page, keyset, limit, newest_first=False, after=boundary.created_at)
+    return page[:limit], len(page) > limit
+
+
+def sync_payload(conversation_id, message_id, limit=SYNC_LIMIT):
+    """The messages_synced event body for a client that last saw message_id.
+
+    reset is True when message_id is unknown (e.g. deleted); the client should
+    then reload the newest page instead.
+    """
+    from .serializers import MessageSerializer
+
+    try:
+        messages, has_more = messages_after(conversation_id, message_id, limit)
+    except Message.DoesNotExist:
+        return {'conversation_id': conversation_id, 'messages': [], 'has_more': False, 'reset': True}
+    return {
+        'conversation_id': conversation_id,
+        'messages': MessageSerializer(messages, many=True).data,
+        'has_more': has_more,
+        'reset': False
+    }
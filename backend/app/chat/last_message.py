@@ -0,0 +1,120 @@
+"""Coalesced Conversation.last_message_at updates.
+
+Message.save records the newest message time per conversation in a Redis
+sorted set (ZADD GT keeps the maximum) instead of updating the conversation
+row, so busy conversations no longer serialize on that row. flush() moves
+pending values to the database with one bulk UPDATE that only ever moves
+last_message_at forward, so a late flush cannot overwrite a newer time. It
+runs on a timer in the chat servers, as a Celery task, and before
+conversation lists are read, so their ordering never lags.
+
+Redis is required wherever more than one process saves messages. Without it,
+pending values stay in the memory of the process that saved the message and
+only that process's flushes apply them: the chat servers flush theirs every
+FLUSH_INTERVAL, a web worker only on its next conversation list, and the
+Celery task never sees them.
+"""
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.db.models import Case, DateTimeField, Q, Value, When
+
+from partyoria.redis_store import get_redis, mark_unavailable
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'chat:pending_last_message_at'
+FLUSH_INTERVAL = 5  # seconds, for the chat server's flush loop
+BATCH_SIZE = 500
+
+_local_pending = {}
+_local_lock = threading.Lock()
+_warned_local = False
+
+
+def _to_score(value):
+    # Integer microseconds stay exact in a Redis double
+    return int(value.timestamp() * 1_000_000)
+
+
+def _from_score(score):
+    return datetime.fromtimestamp(int(score) / 1_000_000, tz=dt_timezone.utc)
+
+
+def _record_local(pending):
+    global _warned_local
+    if not _warned_local:
+        _warned_local = True
+        logger.warning("Redis unavailable: last_message_at updates are held in this process until it flushes")
+    with _local_lock:
+        for conversation_id, value in pending.items():
+            current = _local_pending.get(conversation_id)
+            if current is None or current < value:
+                _local_pending[conversation_id] = value
+
+
+def record(conversation_id, value):
+    """Remember that conversation_id received a message at value"""
+    client = get_redis()
+    if client is not None:
+        try:
+            client.zadd(PENDING_KEY, {conversation_id: _to_score(value)}, gt=True)
+            return
+        except redis.RedisError:
+            mark_unavailable()
+    _record_local({conversation_id: value})
+
+
+def _drain():
+    with _local_lock:
+        pending = dict(_local_pending)
+        _local_pending.clear()
+
+    client = get_redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.zrange(PENDING_KEY, 0, -1, withscores=True)
+            pipe.delete(PENDING_KEY)
+            rows, _ = pipe.execute()
+        except redis.RedisError:
+            mark_unavailable()
+            rows = []
+        for member, score in rows:
+            conversation_id, value = int(member), _from_score(score)
+            if conversation_id not in pending or pending[conversation_id] < value:
+                pending[conversation_id] = value
+    return pending
+
+
+def _apply(items):
+    """One UPDATE for a batch; rows that already hold a newer time are left alone"""
+    newest = Case(
+        *[When(id=conversation_id, then=Value(value)) for conversation_id, value in items],
+        output_field=DateTimeField()
+    )
+    return Conversation.objects.filter(
+        Q(last_message_at__isnull=True) | Q(last_message_at__lt=newest),
+        id__in=[conversation_id for conversation_id, _ in items]
+    ).update(last_message_at=newest)
+
+
+def flush():
+    """Write pending values to the database; returns the number of conversations updated"""
+    pending = _drain()
+    if not pending:
+        return 0
+    items = list(pending.items())
+    updated = 0
+    try:
+        for start in range(0, len(items), BATCH_SIZE):
+            updated += _apply(items[start:start + BATCH_SIZE])
+    except Exception:
+        # Keep the values for the next flush rather than losing them
+        for conversation_id, value in items:
+            record(conversation_id, value)
+        raise
+    return updated
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from app.chat.archive import (
+    CHUNK_SIZE, CHUNK_PAUSE, MAX_SECONDS, QUIET_HOURS, archive_cutoff, archive_old_messages, in_quiet_hours
+)
+
+class Command(BaseCommand):
+    help = 'Move old chat messages to the compressed archive table in throttled chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--pause', type=float, default=CHUNK_PAUSE, help='seconds between chunks')
+        parser.add_argument('--max-seconds', type=float, default=MAX_SECONDS)
+        parser.add_argument('--force', action='store_true', help=f'run outside the archival hours ({QUIET_HOURS})')
+
+    def handle(self, *args, **options):
+        if not options['force'] and not in_quiet_hours():
+            self.stdout.write(self.style.WARNING(f'Outside archival hours ({QUIET_HOURS}); use --force to run anyway'))
+            return
+
+        cutoff = archive_cutoff()
+        count = archive_old_messages(
+            cutoff, chunk_size=options['chunk_size'], pause=options['pause'], max_seconds=options['max_seconds']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} messages older than {cutoff:%Y-%m-%d}'))
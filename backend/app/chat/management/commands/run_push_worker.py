@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.chat.push import PushWorker, load_provider, BATCH_SIZE
+from partyoria.redis_store import get_redis
+
+class Command(BaseCommand):
+    help = 'Deliver queued chat push notifications in coalesced batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--provider', help='dotted path of the push provider class (default: CHAT_PUSH_PROVIDER)')
+
+    def handle(self, *args, **options):
+        client = get_redis()
+        if client is None:
+            raise CommandError('Redis is not reachable at REDIS_URL')
+
+        provider = load_provider(options['provider'])
+        worker = PushWorker(client, provider, batch_size=options['batch_size'])
+        self.stdout.write(f'Delivering pushes through {type(provider).__name__}')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS(f'Stopped: {worker.metrics.as_dict()}'))
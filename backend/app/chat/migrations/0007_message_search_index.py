@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from app.chat.search import install
+    install(schema_editor)
+
+
+def remove_search_index(apps, schema_editor):
+    from app.chat.search import uninstall
+    uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_remove_conversation_chat_conver_vendor__60b925_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, remove_search_index),
+    ]
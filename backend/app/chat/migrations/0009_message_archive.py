@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0008_attachment_processing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content_compressed', models.BinaryField()),
+                ('message_type', models.CharField(default='text', max_length=20)),
+                ('status', models.CharField(default='sent', max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('message_id', models.CharField(max_length=50, unique=True)),
+                ('reply_to_id', models.BigIntegerField(blank=True, null=True)),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created_at', 'id'], name='chat_messag_created_902809_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chat.conversation'),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='sender',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['conversation', '-created_at', '-id'], name='chat_archiv_convers_dcb29a_idx'),
+        ),
+    ]
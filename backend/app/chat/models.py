@@ -1,9 +1,31 @@
-from django.db import models
+from django.db import models, connection
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import uuid
 import os
 
+class ConversationQuerySet(models.QuerySet):
+    def for_inbox(self, user):
+        """user's conversations annotated with last_message_pk and unread_messages.
+
+        Both are correlated subqueries on the (conversation, created_at) and
+        (conversation, status) indexes, so the list costs one query however
+        many conversations or messages there are.
+        """
+        latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id').values('id')[:1]
+        unread = Message.objects.filter(
+            conversation=OuterRef('pk'), status__in=['sent', 'delivered']
+        ).exclude(sender=user).order_by().values('conversation').annotate(total=Count('id')).values('total')
+        return self.filter(Q(vendor=user) | Q(customer=user)).select_related(
+            'vendor', 'customer', 'context'
+        ).annotate(
+            last_message_pk=Subquery(latest),
+            unread_messages=Coalesce(Subquery(unread), 0)
+        )
+
+
 class Conversation(models.Model):
     vendor = models.ForeignKey('authentication.CustomUser', on_delete=models.CASCADE, related_name='vendor_conversations')
     customer = models.ForeignKey('authentication.CustomUser', on_delete=models.CASCADE, related_name='customer_conversations')
@@ -12,6 +34,8 @@ class Conversation(models.Model):
     is_active = models.BooleanField(default=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
 
+    objects = ConversationQuerySet.as_manager()
+
     class Meta:
         unique_together = ('vendor', 'customer')
         indexes = [
@@ -27,6 +51,20 @@ class Conversation(models.Model):
         other_user = self.get_other_user(user)
         return self.messages.filter(sender=other_user, status__in=['sent', 'delivered']).count()
 
+    def mark_read_by(self, user):
+        """Mark the other participant's unread messages read in one statement; returns their ids"""
+        sender_id = self.customer_id if user.id == self.vendor_id else self.vendor_id
+        read_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {connection.ops.quote_name(Message._meta.db_table)} "
+                "SET status = 'read', read_at = %s "
+                "WHERE conversation_id = %s AND sender_id = %s AND status IN ('sent', 'delivered') "
+                "RETURNING id",
+                [read_at, self.id, sender_id]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
     def __str__(self):
         return f"Conv: {self.vendor.username} <-> {self.customer.username}"
 
@@ -52,7 +90,8 @@ class Message(models.Model):
     content = models.TextField(max_length=1000, blank=True)
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='text')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='sending')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind saves keep the time the message was broadcast with
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     delivered_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
     message_id = models.CharField(max_length=50, unique=True, default='')
@@ -67,14 +106,19 @@ class Message(models.Model):
             models.Index(fields=['conversation', 'status']),
             models.Index(fields=['message_id']),
             models.Index(fields=['message_type']),
+            # Archival walks old messages in (created_at, id) order
+            models.Index(fields=['created_at', 'id']),
         ]
 
     def save(self, *args, **kwargs):
+        from .last_message import record as record_last_message
         if not self.message_id:
             self.message_id = str(uuid.uuid4())
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        self.conversation.last_message_at = self.created_at
-        self.conversation.save(update_fields=['last_message_at'])
+        # Coalesced into periodic bulk updates instead of a second write per message
+        if adding:
+            record_last_message(self.conversation_id, self.created_at)
 
     def mark_delivered(self):
         if self.status == 'sent':
@@ -91,6 +135,33 @@ class Message(models.Model):
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
 
+class ArchivedMessage(models.Model):
+    """A message moved out of Message by app.chat.archive, with its content zlib-compressed.
+
+    Keeps the original primary key so history cursors stay valid across the archive boundary.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey('authentication.CustomUser', on_delete=models.CASCADE)
+    content_compressed = models.BinaryField()
+    message_type = models.CharField(max_length=20, default='text')
+    status = models.CharField(max_length=20, default='sent')
+    created_at = models.DateTimeField()
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    message_id = models.CharField(max_length=50, unique=True)
+    reply_to_id = models.BigIntegerField(null=True, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', '-created_at', '-id']),
+        ]
+
+    def __str__(self):
+        return f"Archived {self.message_id}"
+
 def upload_path(instance, filename):
     return f'chat_files/{instance.message.conversation.id}/{uuid.uuid4()}{os.path.splitext(filename)[1]}'
 
@@ -102,6 +173,12 @@ class MessageAttachment(models.Model):
         ('audio', 'Audio')
     ]
     
+    PROCESSING_STATUS = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed')
+    ]
+    
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
     file = models.FileField(upload_to=upload_path)
     file_name = models.CharField(max_length=255)
@@ -109,11 +186,37 @@ class MessageAttachment(models.Model):
     file_type = models.CharField(max_length=20, choices=FILE_TYPES)
     mime_type = models.CharField(max_length=100)
     thumbnail = models.ImageField(upload_to='chat_thumbnails/', null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.file_name} - {self.message.id}"
 
+class AttachmentUpload(models.Model):
+    """A resumable upload; chunks are appended to a partial file until offset reaches total_size"""
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey('authentication.CustomUser', on_delete=models.CASCADE, related_name='chat_uploads')
+    file_name = models.CharField(max_length=255)
+    mime_type = models.CharField(max_length=100)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_name(self):
+        return f'chat_uploads/{self.upload_id}.part'
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.total_size
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.total_size})"
+
 class ConversationContext(models.Model):
     conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='context')
     event_id = models.IntegerField(null=True, blank=True)
@@ -0,0 +1,168 @@
+"""Who is online, shared by the chat servers, Celery tasks and the REST API.
+
+One sorted set, PRESENCE_KEY, maps user id to the time of their last
+heartbeat. Chat servers heartbeat every connected user each
+PRESENCE_TTL / 3 seconds (and clients may send a heartbeat event), so a user
+is online while their score is newer than PRESENCE_TTL. That holds across
+chat nodes and lapses on its own when a node dies. The last socket to close
+moves the user from the set to the LAST_SEEN_KEY hash.
+
+Lookups for any number of users are one ZMSCORE + HMGET round trip.
+"""
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+
+from partyoria.redis_store import get_redis, mark_unavailable
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_KEY = 'chat:presence'
+LAST_SEEN_KEY = 'chat:last_seen'
+PRESENCE_TTL = 90            # seconds without a heartbeat before a user counts as offline
+STALE_AFTER = 24 * 60 * 60   # heartbeats older than this are moved out of PRESENCE_KEY
+MAX_LOOKUP = 500             # user ids per who_is_online call
+
+
+def _queue_heartbeat(pipe, user_ids, now):
+    pipe.zadd(PRESENCE_KEY, {str(user_id): now for user_id in user_ids})
+
+
+def _queue_offline(pipe, user_id, now):
+    pipe.zrem(PRESENCE_KEY, str(user_id))
+    pipe.hset(LAST_SEEN_KEY, str(user_id), repr(now))
+
+
+def _queue_lookup(pipe, user_ids):
+    members = [str(user_id) for user_id in user_ids]
+    pipe.zmscore(PRESENCE_KEY, members)
+    pipe.hmget(LAST_SEEN_KEY, members)
+
+
+def _statuses(user_ids, scores, last_seen, now):
+    statuses = {}
+    for user_id, score, seen in zip(user_ids, scores, last_seen):
+        online = score is not None and score > now - PRESENCE_TTL
+        # A stale score is a heartbeat from a node that went away
+        seen_at = max(filter(None, (score, float(seen) if seen else None)), default=None)
+        statuses[user_id] = {
+            'online': online,
+            'last_seen': None if online or seen_at is None else
+            datetime.fromtimestamp(seen_at, dt_timezone.utc).isoformat()
+        }
+    return statuses
+
+
+def _offline(user_ids):
+    return {user_id: {'online': False, 'last_seen': None} for user_id in user_ids}
+
+
+class PresenceService:
+    """Synchronous presence (web, Celery and eventlet processes); uses the shared client by default"""
+
+    def __init__(self, redis_client=None):
+        self._redis = redis_client
+
+    def _client(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def _execute(self, queue, *args):
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            pipe = client.pipeline(transaction=False)
+            queue(pipe, *args)
+            return pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Presence unavailable: {e}")
+            if self._redis is None:
+                mark_unavailable()
+            return None
+
+    def heartbeat(self, *user_ids):
+        if user_ids:
+            self._execute(_queue_heartbeat, user_ids, time.time())
+
+    def set_offline(self, user_id):
+        self._execute(_queue_offline, user_id, time.time())
+
+    def statuses(self, user_ids):
+        """{user_id: {'online', 'last_seen'}}; everyone is offline while Redis is down"""
+        user_ids = list(user_ids)[:MAX_LOOKUP]
+        if not user_ids:
+            return {}
+        result = self._execute(_queue_lookup, user_ids)
+        if result is None:
+            return _offline(user_ids)
+        return _statuses(user_ids, *result, time.time())
+
+    def who_is_online(self, user_ids):
+        """{user_id: bool} in one round trip"""
+        return {user_id: status['online'] for user_id, status in self.statuses(user_ids).items()}
+
+    def prune(self):
+        """Move heartbeats older than STALE_AFTER to the last-seen hash"""
+        client = self._client()
+        if client is None:
+            return
+        cutoff = time.time() - STALE_AFTER
+        stale = client.zrangebyscore(PRESENCE_KEY, '-inf', cutoff, withscores=True)
+        if stale:
+            pipe = client.pipeline(transaction=False)
+            pipe.hset(LAST_SEEN_KEY, mapping={member: repr(score) for member, score in stale})
+            pipe.zrem(PRESENCE_KEY, *[member for member, _ in stale])
+            pipe.execute()
+
+
+class AsyncPresenceService:
+    """Presence for the asyncio chat server; redis_client is a redis.asyncio client or None"""
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+
+    async def _execute(self, queue, *args):
+        if self.redis is None:
+            return None
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                queue(pipe, *args)
+                return await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Presence unavailable: {e}")
+            return None
+
+    async def heartbeat(self, *user_ids):
+        if user_ids:
+            await self._execute(_queue_heartbeat, user_ids, time.time())
+
+    async def set_offline(self, user_id):
+        await self._execute(_queue_offline, user_id, time.time())
+
+    async def statuses(self, user_ids):
+        user_ids = list(user_ids)[:MAX_LOOKUP]
+        if not user_ids:
+            return {}
+        result = await self._execute(_queue_lookup, user_ids)
+        if result is None:
+            return _offline(user_ids)
+        return _statuses(user_ids, *result, time.time())
+
+    async def who_is_online(self, user_ids):
+        return {user_id: status['online'] for user_id, status in (await self.statuses(user_ids)).items()}
+
+    async def prune(self):
+        if self.redis is None:
+            return
+        cutoff = time.time() - STALE_AFTER
+        stale = await self.redis.zrangebyscore(PRESENCE_KEY, '-inf', cutoff, withscores=True)
+        if stale:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(LAST_SEEN_KEY, mapping={member: repr(score) for member, score in stale})
+                pipe.zrem(PRESENCE_KEY, *[member for member, _ in stale])
+                await pipe.execute()
+
+
+presence = PresenceService()
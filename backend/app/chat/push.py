@@ -0,0 +1,205 @@
+"""Delivery of push notifications for chat messages sent to offline users.
+
+The chat servers and Celery tasks LPUSH JSON entries (realtime.push_payload)
+onto PUSH_QUEUE. PushWorker drains it in batches: one BRPOP waits for work,
+then RPOP with a count takes the rest of the batch in the same round trip.
+Entries for the same recipient and conversation collapse into one push
+("3 new messages from alice"), so a burst of messages becomes one
+notification per conversation on the user's phone.
+
+Pushes go to a provider named by CHAT_PUSH_PROVIDER. FilePushProvider
+appends them to a JSON-lines file and LoopbackPushProvider keeps them in
+memory; a provider for FCM or APNs implements the same send(pushes).
+
+Every batch logs its size, delivery latency and the queue depth left behind,
+and the running totals are mirrored to the PUSH_METRICS_KEY hash.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+from decouple import config
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PUSH_QUEUE = 'push_queue'
+PUSH_METRICS_KEY = 'push_queue:metrics'
+BATCH_SIZE = 200
+BLOCK_TIMEOUT = 1  # seconds BRPOP waits for the first entry of a batch
+RETRY_DELAY = 5    # seconds to wait after a provider failure
+
+
+class Push:
+    __slots__ = ('user_id', 'conversation_id', 'title', 'body', 'count', 'data')
+
+    def __init__(self, user_id, conversation_id, title, body, count, data):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.title = title
+        self.body = body
+        self.count = count
+        self.data = data
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def coalesce(entries):
+    """One Push per (user, conversation) in entries, in order of their first entry"""
+    groups = {}
+    for entry in entries:
+        key = (entry['user_id'], entry.get('conversation_id'))
+        groups.setdefault(key, []).append(entry)
+
+    pushes = []
+    for (user_id, conversation_id), group in groups.items():
+        latest = group[-1]
+        senders = {entry.get('sender_username') for entry in group}
+        if len(group) == 1:
+            title = latest['message']
+        elif len(senders) == 1 and latest.get('sender_username'):
+            title = f"{len(group)} new messages from {latest['sender_username']}"
+        else:
+            title = f"{len(group)} new messages"
+        pushes.append(Push(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            title=title,
+            body=latest.get('preview', ''),
+            count=len(group),
+            data={'conversation_id': conversation_id, 'message_id': latest.get('message_id')}
+        ))
+    return pushes
+
+
+class LoopbackPushProvider:
+    """Keeps pushes in memory; for tests and local runs"""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, pushes):
+        with self.lock:
+            self.sent.extend(pushes)
+
+
+class FilePushProvider:
+    """Appends one JSON line per push to CHAT_PUSH_OUTBOX (default logs/push_outbox.jsonl)"""
+
+    def __init__(self, path=None):
+        self.path = path or config('CHAT_PUSH_OUTBOX', default=os.path.join(settings.BASE_DIR, 'logs', 'push_outbox.jsonl'))
+
+    def send(self, pushes):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for push in pushes:
+                f.write(json.dumps(push.as_dict()) + '\n')
+
+
+def load_provider(path=None):
+    path = path or config('CHAT_PUSH_PROVIDER', default='app.chat.push.FilePushProvider')
+    return import_string(path)()
+
+
+class PushMetrics:
+    """Running totals plus the last batch, logged per batch and mirrored to Redis"""
+
+    def __init__(self):
+        self.batches = 0
+        self.entries = 0
+        self.pushes = 0
+        self.failures = 0
+        self.last_batch_ms = 0.0
+        self.max_batch_ms = 0.0
+        self.queue_depth = 0
+
+    def record(self, entries, pushes, seconds, queue_depth):
+        self.batches += 1
+        self.entries += entries
+        self.pushes += pushes
+        self.last_batch_ms = seconds * 1000
+        self.max_batch_ms = max(self.max_batch_ms, self.last_batch_ms)
+        self.queue_depth = queue_depth
+
+    def as_dict(self):
+        return {
+            'batches': self.batches,
+            'entries': self.entries,
+            'pushes': self.pushes,
+            'failures': self.failures,
+            'last_batch_ms': round(self.last_batch_ms, 3),
+            'max_batch_ms': round(self.max_batch_ms, 3),
+            'queue_depth': self.queue_depth
+        }
+
+
+class PushWorker:
+    """Drains PUSH_QUEUE through a provider; redis_client is a synchronous client"""
+
+    def __init__(self, redis_client, provider, queue=PUSH_QUEUE, batch_size=BATCH_SIZE, block_timeout=BLOCK_TIMEOUT):
+        self.redis = redis_client
+        self.provider = provider
+        self.queue = queue
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.metrics = PushMetrics()
+        self.running = True
+
+    def take_batch(self):
+        """Oldest entries first: wait for one, then take up to batch_size - 1 more without waiting"""
+        first = self.redis.brpop([self.queue], timeout=self.block_timeout)
+        if first is None:
+            return []
+        raw = [first[1]]
+        if self.batch_size > 1:
+            raw.extend(self.redis.rpop(self.queue, self.batch_size - 1) or [])
+        return raw
+
+    def step(self):
+        """Deliver one batch; returns the number of pushes sent"""
+        raw = self.take_batch()
+        if not raw:
+            return 0
+        started = time.perf_counter()
+
+        entries = []
+        for item in raw:
+            try:
+                entries.append(json.loads(item))
+            except (TypeError, ValueError):
+                logger.warning(f"Dropping malformed push entry: {item!r}")
+        pushes = coalesce(entries)
+        try:
+            if pushes:
+                self.provider.send(pushes)
+        except Exception:
+            # Back onto the consuming end so they go out first next time
+            self.redis.rpush(self.queue, *reversed(raw))
+            self.metrics.failures += 1
+            raise
+
+        queue_depth = self.redis.llen(self.queue)
+        self.metrics.record(len(entries), len(pushes), time.perf_counter() - started, queue_depth)
+        logger.info(
+            f"Push batch: {len(entries)} entries -> {len(pushes)} pushes in "
+            f"{self.metrics.last_batch_ms:.1f} ms, {queue_depth} queued"
+        )
+        self.redis.hset(PUSH_METRICS_KEY, mapping=self.metrics.as_dict())
+        return len(pushes)
+
+    def run(self, sleep=time.sleep):
+        while self.running:
+            try:
+                self.step()
+            except redis.RedisError as e:
+                logger.warning(f"Push worker lost Redis: {e}")
+                sleep(RETRY_DELAY)
+            except Exception as e:
+                logger.error(f"Push delivery failed: {e}")
+                sleep(RETRY_DELAY)
@@ -0,0 +1,267 @@
+"""Helpers shared by the Socket.IO chat servers (chat_server.py and chat_server_async.py).
+
+Everything here is synchronous; the asyncio server runs the ORM helpers on
+its bounded database executor.
+
+emit_external() lets web and worker processes emit to sockets. With
+CHAT_CLUSTER=1 it publishes through the cluster's Redis client manager.
+Otherwise there is one chat server, whose Socket.IO server has no client
+manager, so the emit is queued on EXTERNAL_EMIT_QUEUE in Redis and that
+server drains the queue every EXTERNAL_EMIT_POLL seconds.
+"""
+import json
+import logging
+
+import jwt
+import redis
+import socketio
+from decouple import config
+from django.conf import settings
+
+from authentication.models import CustomUser
+from partyoria.rate_limiting import RateLimit
+from partyoria.redis_store import get_redis, mark_unavailable
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS_PER_USER = 2
+MAX_MESSAGE_LENGTH = 1000
+RATE_LIMIT_MESSAGES = config('CHAT_RATE_LIMIT_MESSAGES', default=10, cast=int)  # per RATE_LIMIT_WINDOW seconds
+RATE_LIMIT_WINDOW = 60
+
+# Token bucket per user: the sustained rate, refilled continuously
+MESSAGE_LIMIT = RateLimit('chat_message', RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW)
+# Typing starts per user; checked in process memory so keystrokes never wait on Redis
+TYPING_LIMIT = RateLimit('chat_typing', rate=1, period=1, burst=5)
+
+# Emits queued for a chat server without a client manager
+EXTERNAL_EMIT_QUEUE = 'chat:external_emits'
+EXTERNAL_EMIT_POLL = 0.2    # seconds between drains in the chat servers
+EXTERNAL_EMIT_BATCH = 500   # emits taken per drain
+EXTERNAL_EMIT_MAX = 10000   # older entries are dropped while no chat server drains
+EXTERNAL_EMIT_TTL = 300     # seconds; a queue nobody drains lapses
+
+# Write-only Socket.IO manager used by emit_external in cluster mode
+_external_manager = None
+
+
+def user_room(user_id):
+    return f'user_{user_id}'
+
+
+def conversation_room(conversation_id):
+    return f'conv_{conversation_id}'
+
+
+def extract_token(environ, auth):
+    """Read the token from the auth payload, the query string or the Authorization header"""
+    if auth and isinstance(auth, dict) and auth.get('token'):
+        return auth['token']
+
+    query_string = environ.get('QUERY_STRING', '')
+    if 'token=' in query_string:
+        return query_string.split('token=')[1].split('&')[0]
+
+    return environ.get('HTTP_AUTHORIZATION') or None
+
+
+def authenticate_user(token):
+    """Authenticate user from JWT token"""
+    try:
+        if not token:
+            return None
+
+        # Remove 'Bearer ' prefix if present
+        if token.startswith('Bearer '):
+            token = token[7:]
+
+        # Decode JWT to check payload first
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+            logger.info(f"JWT payload: {payload}")
+
+            # Get user_id from JWT
+            user_id = payload.get('user_id')
+            if user_id:
+                try:
+                    user = CustomUser.objects.get(id=user_id)
+                    logger.info(f"JWT auth successful for user {user.username} (ID: {user.id}, Type: {user.user_type})")
+                    return user
+                except CustomUser.DoesNotExist:
+                    logger.warning(f"User not found for user_id: {user_id}")
+
+            logger.warning(f"No valid user found in JWT payload: {payload}")
+
+        except jwt.ExpiredSignatureError:
+            logger.warning("JWT token expired")
+        except jwt.InvalidTokenError as e:
+            logger.warning(f"JWT invalid: {e}")
+        except Exception as e:
+            logger.warning(f"JWT decode error: {e}")
+
+        # Fallback to token auth
+        from rest_framework.authtoken.models import Token
+        try:
+            token_obj = Token.objects.get(key=token)
+            logger.info(f"Token auth successful for user {token_obj.user.username} (ID: {token_obj.user.id})")
+            return token_obj.user
+        except Token.DoesNotExist:
+            logger.warning("Token not found in database")
+        except Exception as e:
+            logger.warning(f"Token auth error: {e}")
+
+        return None
+    except Exception as e:
+        logger.error(f"Auth error: {e}")
+        return None
+
+
+def load_participant(conversation_id, user_id):
+    """Return (conversation, user), or (conversation, None) when the user is not part of it"""
+    conversation = Conversation.objects.select_related('vendor', 'customer').get(id=conversation_id)
+    user = CustomUser.objects.get(id=user_id)
+    if user not in [conversation.vendor, conversation.customer]:
+        return conversation, None
+    return conversation, user
+
+
+def mark_conversation_read(conversation, user):
+    """Mark the other participant's unread messages as read; returns the messages_read event body or None"""
+    message_ids = conversation.mark_read_by(user)
+    if not message_ids:
+        return None
+    return read_receipt(conversation.id, user.id, message_ids)
+
+
+def read_receipt(conversation_id, reader_id, message_ids):
+    """One messages_read event for a batch: everything up to up_to_id from the other side is read"""
+    return {
+        'conversation_id': conversation_id,
+        'reader_id': reader_id,
+        'up_to_id': max(message_ids),
+        'count': len(message_ids)
+    }
+
+
+def delivery_receipt(conversation_id, recipient_id, message_ids):
+    """One messages_delivered event for a batch: everything up to up_to_id reached recipient_id"""
+    return {
+        'conversation_id': conversation_id,
+        'recipient_id': recipient_id,
+        'up_to_id': max(message_ids),
+        'count': len(message_ids)
+    }
+
+
+def emit_external(event, data, room):
+    """Emit from outside the chat servers (e.g. REST views); False when Redis is unavailable"""
+    global _external_manager
+    if config('CHAT_CLUSTER', default=False, cast=bool):
+        try:
+            if _external_manager is None:
+                _external_manager = socketio.RedisManager(
+                    config('REDIS_URL', default='redis://localhost:6379/0'), write_only=True
+                )
+            _external_manager.emit(event, data, room=room)
+            return True
+        except Exception as e:
+            logger.warning(f"External emit of {event} failed: {e}")
+            return False
+
+    client = get_redis()
+    if client is None:
+        return False
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.rpush(EXTERNAL_EMIT_QUEUE, json.dumps({'event': event, 'data': data, 'room': room}, default=str))
+        pipe.ltrim(EXTERNAL_EMIT_QUEUE, -EXTERNAL_EMIT_MAX, -1)
+        pipe.expire(EXTERNAL_EMIT_QUEUE, EXTERNAL_EMIT_TTL)
+        pipe.execute()
+        return True
+    except redis.RedisError as e:
+        mark_unavailable()
+        logger.warning(f"External emit of {event} failed: {e}")
+        return False
+
+
+def queued_emits(rows):
+    """(event, data, room) for EXTERNAL_EMIT_QUEUE entries a chat server took"""
+    emits = []
+    for row in rows:
+        entry = json.loads(row)
+        emits.append((entry['event'], entry['data'], entry['room']))
+    return emits
+
+
+def push_to_user(user_id, event, data):
+    """Emit to every open socket of user_id (their personal room), on whichever node holds it"""
+    return emit_external(event, data, user_room(user_id))
+
+
+def notification_payload(notification):
+    """The notification event body"""
+    return {
+        'id': str(notification.id),
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'priority': notification.priority,
+        'action_url': notification.action_url,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None
+    }
+
+
+def user_profile(user):
+    """The user fields the socket servers need, cached per connection"""
+    return {'id': user.id, 'username': user.username, 'user_type': user.user_type}
+
+
+def create_message(conversation_id, sender_id, content, defer_notification=False):
+    """Insert a sent text message without loading the conversation or the sender"""
+    message = Message(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        content=content,
+        status='sent'
+    )
+    message.defer_notification = defer_notification
+    message.save()
+    return message
+
+
+def notify_message(message_id):
+    """In-app notification for a message saved with defer_notification"""
+    from notifications.signals import notify_new_message
+    message = Message.objects.select_related(
+        'sender', 'conversation__vendor', 'conversation__customer'
+    ).get(id=message_id)
+    notify_new_message(message)
+
+
+def message_payload(message, sender, conversation_id, temp_id=None):
+    """The new_message event body; sender is a user_profile dict"""
+    return {
+        'id': message.id,
+        'message_id': message.message_id,
+        'conversation_id': conversation_id,
+        'sender_id': sender['id'],
+        'sender_username': sender['username'],
+        'sender_type': sender['user_type'],
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'status': message.status,
+        'temp_id': temp_id
+    }
+
+
+def push_payload(sender, recipient_id, conversation_id, content='', message_id=None):
+    """The push_queue entry for a participant who is offline (see app.chat.push)"""
+    return {
+        'user_id': recipient_id,
+        'message': f"New message from {sender['username']}",
+        'conversation_id': conversation_id,
+        'sender_username': sender['username'],
+        'preview': content[:100],
+        'message_id': message_id
+    }
@@ -0,0 +1,86 @@
+"""Batched delivery receipts for the chat servers.
+
+Clients send ack_delivered with the highest message id they have received in
+a conversation. DeliveryAcks keeps only the highest id per (conversation,
+reader) in process memory, so an ack costs a dict lookup. Every FLUSH_INTERVAL
+the server drains them into mark_delivered(): one UPDATE ... RETURNING moves
+every covered 'sent' message to 'delivered' for up to BATCH_SIZE
+conversations at once, and the returned rows become one messages_delivered
+receipt per (conversation, sender). However many messages and acks arrive,
+the database sees one statement per flush and each sender at most one
+receipt per conversation per interval.
+"""
+import threading
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Message
+from .realtime import delivery_receipt
+
+FLUSH_INTERVAL = 1.0  # seconds, for the chat servers' flush loops
+BATCH_SIZE = 200      # (conversation, reader) pairs per UPDATE
+
+
+class DeliveryAcks:
+    """The highest acknowledged message id per (conversation, reader) since the last drain"""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def ack(self, conversation_id, reader_id, sender_id, up_to_id):
+        key = (conversation_id, reader_id)
+        with self.lock:
+            current = self.pending.get(key)
+            if current is None or current[1] < up_to_id:
+                self.pending[key] = (sender_id, up_to_id)
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, pending):
+        """Put back acks a failed flush could not apply"""
+        for (conversation_id, reader_id), (sender_id, up_to_id) in pending.items():
+            self.ack(conversation_id, reader_id, sender_id, up_to_id)
+
+    def __len__(self):
+        return len(self.pending)
+
+
+def mark_delivered(pending):
+    """Apply drained acks; returns (sender_id, messages_delivered event body) per receipt"""
+    if not pending:
+        return []
+    delivered_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    table = connection.ops.quote_name(Message._meta.db_table)
+    items = list(pending.items())
+    rows = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), BATCH_SIZE):
+            chunk = items[start:start + BATCH_SIZE]
+            params = [delivered_at]
+            for (conversation_id, reader_id), (sender_id, up_to_id) in chunk:
+                params.extend([conversation_id, sender_id, up_to_id])
+            predicate = ' OR '.join(['(conversation_id = %s AND sender_id = %s AND id <= %s)'] * len(chunk))
+            cursor.execute(
+                f"UPDATE {table} SET status = 'delivered', delivered_at = %s "
+                f"WHERE status = 'sent' AND ({predicate}) "
+                "RETURNING conversation_id, sender_id, id",
+                params
+            )
+            rows.extend(cursor.fetchall())
+
+    readers = {
+        (conversation_id, sender_id): reader_id
+        for (conversation_id, reader_id), (sender_id, _) in pending.items()
+    }
+    delivered = {}
+    for conversation_id, sender_id, message_id in rows:
+        delivered.setdefault((conversation_id, sender_id), []).append(message_id)
+    return [
+        (sender_id, delivery_receipt(conversation_id, readers[(conversation_id, sender_id)], message_ids))
+        for (conversation_id, sender_id), message_ids in delivered.items()
+    ]
@@ -0,0 +1,166 @@
+"""Full-text search over chat messages.
+
+Message.content is indexed so a search is an index lookup instead of an
+ILIKE scan of every message the user can see:
+
+- PostgreSQL: a GIN index on to_tsvector(SEARCH_CONFIG, content). Queries use
+  the same expression so the planner picks the index; ts_rank orders the hits
+  and ts_headline cuts the snippets.
+- SQLite (tests, local runs): an FTS5 table over chat_message kept in step by
+  triggers; bm25() ranks and snippet() highlights.
+
+Both indexes follow inserts, edits and deletes inside the database, so
+write-behind batches and bulk_create are covered too. Other backends fall
+back to a substring match.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Conversation, Message
+
+SEARCH_CONFIG = 'english'
+INDEX_NAME = 'chat_message_content_fts'
+FTS_TABLE = 'chat_message_fts'
+RESULT_LIMIT = 50
+SNIPPET_WORDS = 12
+
+# Snippets are cut in the database from raw content; the markers are swapped
+# for <mark> tags after the text has been HTML-escaped
+_START, _STOP = '\x02', '\x03'
+
+
+def _message_table():
+    return Message._meta.db_table
+
+
+def _search_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(SearchVector('content', config=SEARCH_CONFIG), name=INDEX_NAME)
+
+
+def _sqlite_statements():
+    table = _message_table()
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON {table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+        # Index the messages written before the table existed
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def install(schema_editor):
+    """Create the search index for schema_editor's database (safe to repeat)"""
+    conn = schema_editor.connection
+    if conn.vendor == 'postgresql':
+        with conn.cursor() as cursor:
+            existing = conn.introspection.get_constraints(cursor, _message_table())
+        if INDEX_NAME not in existing:
+            schema_editor.add_index(Message, _search_index())
+    elif conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            for statement in _sqlite_statements():
+                cursor.execute(statement)
+
+
+def uninstall(schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}')
+    elif conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def highlight(snippet):
+    """HTML-safe snippet with matches wrapped in <mark>"""
+    return html.escape(snippet).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _fts5_query(query):
+    """Words of query as an FTS5 expression: all must match, the last one as a prefix"""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _user_conversations(user):
+    return Conversation.objects.filter(Q(vendor=user) | Q(customer=user))
+
+
+def _messages():
+    return Message.objects.select_related(
+        'sender', 'conversation__vendor', 'conversation__customer'
+    ).prefetch_related('attachments')
+
+
+def _search_postgresql(user, query, limit):
+    from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+    # Must match _search_index() exactly for the GIN index to be used
+    vector = SearchVector('content', config=SEARCH_CONFIG)
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    messages = _messages().annotate(document=vector).filter(
+        document=search_query,
+        conversation__in=_user_conversations(user)
+    ).annotate(
+        rank=SearchRank(vector, search_query),
+        snippet=SearchHeadline(
+            'content', search_query, config=SEARCH_CONFIG,
+            start_sel=_START, stop_sel=_STOP, max_words=SNIPPET_WORDS * 2, min_words=SNIPPET_WORDS // 2
+        )
+    ).order_by('-rank', '-created_at')[:limit]
+    return [(message, message.snippet, message.rank) for message in messages]
+
+
+def _search_sqlite(user, query, limit):
+    expression = _fts5_query(query)
+    if not expression:
+        return []
+    sql = (
+        f"SELECT m.id, bm25({FTS_TABLE}), "
+        f"snippet({FTS_TABLE}, 0, %s, %s, '…', %s) "
+        f"FROM {FTS_TABLE} JOIN {_message_table()} m ON m.id = {FTS_TABLE}.rowid "
+        f"JOIN {Conversation._meta.db_table} c ON c.id = m.conversation_id "
+        f"WHERE {FTS_TABLE} MATCH %s AND (c.vendor_id = %s OR c.customer_id = %s) "
+        f"ORDER BY bm25({FTS_TABLE}), m.created_at DESC LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_START, _STOP, SNIPPET_WORDS, expression, user.id, user.id, limit])
+        hits = cursor.fetchall()
+    messages = _messages().in_bulk([message_id for message_id, _, _ in hits])
+    # bm25 is lower-is-better; flip it so rank reads the same on both backends
+    return [(messages[message_id], snippet, -score) for message_id, score, snippet in hits if message_id in messages]
+
+
+def _search_fallback(user, query, limit):
+    messages = _messages().filter(
+        conversation__in=_user_conversations(user),
+        content__icontains=query
+    ).order_by('-created_at')[:limit]
+    return [(message, message.content, 0.0) for message in messages]
+
+
+def search_messages(user, query, limit=RESULT_LIMIT):
+    """Best-matching messages in user's conversations as (message, snippet, rank), best first"""
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(user, query, limit)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(user, query, limit)
+    return _search_fallback(user, query, limit)
@@ -32,7 +32,9 @@ class UserSerializer(serializers.ModelSerializer):
 class MessageAttachmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = MessageAttachment
-        fields = ['id', 'file', 'file_name', 'file_size', 'file_type', 'mime_type', 'thumbnail']
+        fields = ['id', 'file', 'file_name', 'file_size', 'file_type', 'mime_type', 'thumbnail',
+                 'width', 'height', 'processing_status']
+        read_only_fields = ['thumbnail', 'width', 'height', 'processing_status']
 
 class MessageSerializer(serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
@@ -44,7 +46,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'message_id', 'conversation', 'sender', 'sender_username', 'sender_type',
                  'content', 'message_type', 'status', 'created_at', 'delivered_at', 'read_at',
                  'reply_to', 'metadata', 'attachments']
-        read_only_fields = ['id', 'message_id', 'created_at', 'sender_username', 'sender_type', 'delivered_at', 'read_at']
+        read_only_fields = ['id', 'message_id', 'sender', 'created_at', 'sender_username', 'sender_type', 'delivered_at', 'read_at']
 
 class ConversationContextSerializer(serializers.ModelSerializer):
     class Meta:
@@ -52,6 +54,20 @@ class ConversationContextSerializer(serializers.ModelSerializer):
         fields = ['event_id', 'event_title', 'event_date', 'event_budget', 'booking_status',
                  'service_category', 'requirements', 'metadata']
 
+class ConversationListSerializer(serializers.ListSerializer):
+    """Loads the last message of every conversation on the page with one query"""
+    
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, 'all') else data)
+        annotated = [conv for conv in conversations if hasattr(conv, 'last_message_pk')]
+        message_ids = [conv.last_message_pk for conv in annotated if conv.last_message_pk]
+        messages = {}
+        if message_ids:
+            messages = Message.objects.select_related('sender').prefetch_related('attachments').in_bulk(message_ids)
+        for conv in annotated:
+            conv.cached_last_message = messages.get(conv.last_message_pk)
+        return super().to_representation(conversations)
+
 class ConversationSerializer(serializers.ModelSerializer):
     vendor = UserSerializer(read_only=True)
     customer = UserSerializer(read_only=True)
@@ -64,14 +80,21 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ['id', 'vendor', 'customer', 'created_at', 'updated_at', 'is_active', 
                  'last_message', 'unread_count', 'context']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = ConversationListSerializer
     
     def get_last_message(self, obj):
-        last_message = obj.messages.order_by('-created_at').first()
+        if hasattr(obj, 'cached_last_message'):
+            last_message = obj.cached_last_message
+        else:
+            last_message = obj.messages.select_related('sender').order_by('-created_at').first()
         if last_message:
             return MessageSerializer(last_message).data
         return None
     
     def get_unread_count(self, obj):
+        # Conversation.objects.for_inbox annotates the count for the requesting user
+        if hasattr(obj, 'unread_messages'):
+            return obj.unread_messages
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             user = request.user
@@ -0,0 +1,67 @@
+"""Keep running chat servers in step with the database.
+
+Changed users and conversations make the servers drop session data they
+cached; new in-app notifications are pushed to the recipients' sockets.
+"""
+import json
+import logging
+
+import redis
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from notifications.services import notifications_created
+from partyoria.redis_store import get_redis, mark_unavailable
+from .models import Conversation
+from .realtime import push_to_user, notification_payload
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'chat:invalidate'
+
+
+def publish_invalidation(kind, object_id):
+    """Publish once the surrounding transaction commits; chat servers subscribe to the channel"""
+    def publish():
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.publish(INVALIDATION_CHANNEL, json.dumps({'kind': kind, 'id': object_id}))
+        except redis.RedisError as e:
+            mark_unavailable()
+            logger.warning(f"Could not publish chat invalidation for {kind} {object_id}: {e}")
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_save, sender='authentication.CustomUser')
+def invalidate_user(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which chat sessions do not cache
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    publish_invalidation('user', instance.id)
+
+
+@receiver(post_save, sender=Conversation)
+def invalidate_conversation(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_message_at'}):
+        return
+    publish_invalidation('conversation', instance.id)
+
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_deleted_conversation(sender, instance, **kwargs):
+    publish_invalidation('conversation', instance.id)
+
+
+@receiver(notifications_created)
+def push_notifications(sender, notifications, **kwargs):
+    payloads = [(notification.recipient_id, notification_payload(notification)) for notification in notifications]
+
+    def push():
+        for recipient_id, payload in payloads:
+            push_to_user(recipient_id, 'notification', payload)
+
+    transaction.on_commit(push)
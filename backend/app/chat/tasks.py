@@ -4,16 +4,16 @@ except ImportError:
     def shared_task(func):
         return func
 from django.contrib.auth import get_user_model
+from partyoria.redis_store import get_redis
 from .models import Message
+from .presence import presence
+from .push import PUSH_QUEUE
+from .realtime import push_payload
+import json
 import logging
-try:
-    import redis
-except ImportError:
-    redis = None
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
-redis_client = redis.Redis(host='localhost', port=6379, db=1) if redis else None
 
 @shared_task
 def send_push_notification(message_id):
@@ -28,35 +28,19 @@ def send_push_notification(message_id):
         else:
             recipient = conversation.vendor
 
-        # Check if recipient is online via Redis presence
-        is_online = redis_client.exists(f"presence:{recipient.id}")
-        
-        if not is_online:
+        # Only push when the recipient has no live chat session
+        if not presence.who_is_online([recipient.id])[recipient.id]:
             # Send push notification only if user is offline
             logger.info(f"Sending push notification to {recipient.username} for message {message.id}")
             
-            # Store notification in Redis for delivery when user comes online
-            notification_data = {
-                'message_id': message.id,
-                'sender_username': message.sender.username,
-                'content': message.content[:100],
-                'conversation_id': conversation.id,
-                'created_at': message.created_at.isoformat(),
-            }
-            
-            redis_client.lpush(f"notifications:{recipient.id}", str(notification_data))
-            redis_client.expire(f"notifications:{recipient.id}", 86400)  # 24 hours
-            
-            # Example: integrate with FCM, APNs, etc.
-            # from firebase_admin import messaging
-            # push_message = messaging.Message(
-            #     notification=messaging.Notification(
-            #         title=f"New message from {message.sender.username}",
-            #         body=message.content[:100],
-            #     ),
-            #     token=recipient.fcm_token,  # Assuming user has fcm_token field
-            # )
-            # messaging.send(push_message)
+            # Delivered in batches by the push worker (manage.py run_push_worker)
+            client = get_redis()
+            if client is not None:
+                entry = push_payload(
+                    {'username': message.sender.username}, recipient.id, conversation.id,
+                    message.content, message.message_id
+                )
+                client.lpush(PUSH_QUEUE, json.dumps(entry))
         else:
             logger.debug(f"User {recipient.username} is online, skipping push notification")
 
@@ -65,20 +49,22 @@ def send_push_notification(message_id):
     except Exception as e:
         logger.error(f"Error sending push notification: {e}")
 
+@shared_task
+def flush_last_message_at():
+    """Write coalesced Conversation.last_message_at updates (schedule every few seconds)"""
+    from .last_message import flush
+    updated = flush()
+    if updated:
+        logger.debug(f"Flushed last_message_at for {updated} conversations")
+    return updated
+
 @shared_task
 def cleanup_old_messages():
-    """Clean up old messages and notifications"""
-    from django.utils import timezone
-    from datetime import timedelta
-    
-    # Archive messages older than 1 year
-    cutoff_date = timezone.now() - timedelta(days=365)
-    old_messages = Message.objects.filter(created_at__lt=cutoff_date)
-    count = old_messages.count()
-    
-    if count > 0:
-        logger.info(f"Archiving {count} old messages")
-        # In production, move to archive table instead of delete
-        # old_messages.delete()
-    
-    return f"Processed {count} old messages"
\ No newline at end of file
+    """Move messages older than CHAT_ARCHIVE_AFTER_DAYS to the archive (schedule hourly)"""
+    from .archive import archive_old_messages, in_quiet_hours
+
+    # Only during off-peak hours, in throttled chunks
+    if not in_quiet_hours():
+        return "Outside archival hours"
+    count = archive_old_messages()
+    return f"Archived {count} old messages"
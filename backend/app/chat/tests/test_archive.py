@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..archive import archive_old_messages, archive_cutoff, decompress, in_quiet_hours
+from ..models import ArchivedMessage, Conversation, Message, MessageAttachment
+
+User = get_user_model()
+
+
+class MessageArchiveTestCase(TestCase):
+    def setUp(self):
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+
+        old = timezone.now() - timedelta(days=400)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.customer, content=f'Old message {i} ' * 5,
+                    message_id=f'old-{i}', status='read')
+            for i in range(120)
+        ])
+        for i, message in enumerate(Message.objects.filter(message_id__startswith='old-').order_by('id')):
+            Message.objects.filter(id=message.id).update(created_at=old + timedelta(minutes=i))
+        self.recent = [
+            Message.objects.create(conversation=self.conversation, sender=self.vendor, content=f'Recent {i}')
+            for i in range(10)
+        ]
+        self.with_file = Message.objects.get(message_id='old-5')
+        MessageAttachment.objects.create(
+            message=self.with_file, file='chat_files/x.pdf', file_name='x.pdf', file_size=1,
+            file_type='document', mime_type='application/pdf'
+        )
+        self.replied_to = Message.objects.get(message_id='old-7')
+        Message.objects.filter(id=self.recent[0].id).update(reply_to=self.replied_to)
+
+    def archive(self, **kwargs):
+        sleeps = []
+        kwargs.setdefault('pause', 0)
+        count = archive_old_messages(chunk_size=50, sleep=sleeps.append, **kwargs)
+        return count, sleeps
+
+    def test_old_messages_move_in_chunks_with_compressed_content(self):
+        count, sleeps = self.archive()
+
+        self.assertEqual(count, 118)
+        self.assertEqual(len(sleeps), 2)
+        self.assertEqual(
+            set(Message.objects.filter(created_at__lt=archive_cutoff()).values_list('message_id', flat=True)),
+            {'old-5', 'old-7'}
+        )
+        archived = ArchivedMessage.objects.get(message_id='old-3')
+        self.assertEqual(decompress(archived.content_compressed), 'Old message 3 ' * 5)
+        self.assertLess(len(archived.content_compressed), len('Old message 3 ' * 5))
+        self.assertEqual(archived.status, 'read')
+
+        # Running again finds nothing new
+        self.assertEqual(self.archive()[0], 0)
+
+    def test_time_budget_stops_between_chunks(self):
+        count, sleeps = self.archive(max_seconds=0)
+
+        self.assertEqual(count, 50)
+        self.assertEqual(sleeps, [])
+
+    def test_history_reads_through_the_archive(self):
+        expected = list(
+            Message.objects.filter(conversation=self.conversation).order_by('created_at', 'id').values_list('id', flat=True)
+        )
+        self.archive()
+        client = APIClient()
+        client.force_authenticate(user=self.vendor)
+
+        pages, cursor = [], None
+        while True:
+            response = client.get(
+                f'/api/chat/conversations/{self.conversation.id}/messages/', {'before': cursor} if cursor else {}
+            )
+            pages.insert(0, [message['id'] for message in response.data['results']])
+            cursor = response.data['next_cursor']
+            if not response.data['has_next']:
+                break
+
+        self.assertEqual([message_id for page in pages for message_id in page], expected)
+
+        response = client.get(
+            f'/api/chat/conversations/{self.conversation.id}/messages/since/', {'after': 'old-117'}
+        )
+        self.assertEqual(
+            [m['message_id'] for m in response.data['messages']],
+            ['old-118', 'old-119'] + [m.message_id for m in self.recent]
+        )
+
+    def test_recent_pages_do_not_touch_the_archive(self):
+        self.archive()
+        client = APIClient()
+        client.force_authenticate(user=self.vendor)
+
+        with patch('app.chat.archive.archived_page') as archived_page:
+            client.get(f'/api/chat/conversations/{self.conversation.id}/messages/', {'limit': 5})
+            Message.objects.bulk_create([
+                Message(conversation=self.conversation, sender=self.vendor, content='x', message_id=f'new-{i}')
+                for i in range(60)
+            ])
+            client.get(f'/api/chat/conversations/{self.conversation.id}/messages/')
+
+        self.assertEqual(archived_page.call_count, 1)
+
+    def test_quiet_hours(self):
+        at = lambda hour: timezone.make_aware(datetime(2026, 1, 1, hour))
+        self.assertTrue(in_quiet_hours(at(3), '1-6'))
+        self.assertFalse(in_quiet_hours(at(6), '1-6'))
+        self.assertTrue(in_quiet_hours(at(23), '22-4'))
+        self.assertFalse(in_quiet_hours(at(12), '22-4'))
@@ -0,0 +1,150 @@
+import io
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .. import attachments
+from ..attachments import inspect_file, parse_range
+from ..models import Conversation, Message, MessageAttachment
+
+User = get_user_model()
+
+
+def png_bytes(size=(800, 600), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class AttachmentPipelineTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Process on the test thread instead of the worker pool
+        patcher = patch.object(attachments, 'ATTACHMENT_WORKERS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.vendor)
+
+    def upload(self, data, chunk_size, name='photo.png'):
+        response = self.client.post('/api/chat/attachments/uploads/', {
+            'file_name': name, 'mime_type': 'image/png', 'total_size': len(data)
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = f"/api/chat/attachments/uploads/{response.data['upload_id']}/"
+        for offset in range(0, len(data), chunk_size):
+            response = self.client.put(
+                url, data[offset:offset + chunk_size],
+                content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['complete'])
+        return url
+
+    def send_with_uploads(self, *upload_urls):
+        upload_ids = [url.rstrip('/').rsplit('/', 1)[1] for url in upload_urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/chat/messages/', {
+                'conversation': self.conversation.id, 'content': 'Photos', 'upload_ids': upload_ids
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return MessageAttachment.objects.filter(message_id=response.data['id']).get()
+
+    def test_resumable_upload_reports_offset_and_rejects_gaps(self):
+        data = png_bytes()
+        response = self.client.post('/api/chat/attachments/uploads/', {
+            'file_name': 'photo.png', 'total_size': len(data)
+        }, format='json')
+        url = f"/api/chat/attachments/uploads/{response.data['upload_id']}/"
+
+        self.client.put(url, data[:1000], content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0')
+        response = self.client.put(url, data[2000:3000], content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='2000')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], 1000)
+
+        # A client that lost the response asks where to resume
+        self.assertEqual(self.client.get(url).data['offset'], 1000)
+
+        # Other users cannot see the upload
+        self.client.force_authenticate(user=self.customer)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_uploaded_image_gets_thumbnail_dimensions_and_hash(self):
+        url = self.upload(png_bytes(), chunk_size=4096)
+
+        attachment = self.send_with_uploads(url)
+
+        self.assertEqual(attachment.processing_status, 'ready')
+        self.assertEqual((attachment.width, attachment.height), (800, 600))
+        self.assertEqual(len(attachment.content_hash), 64)
+        with Image.open(attachment.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 240))
+        self.assertEqual(attachment.file.size, len(png_bytes()))
+
+    def test_identical_files_share_storage(self):
+        first = self.send_with_uploads(self.upload(png_bytes(), chunk_size=100000))
+        second = self.send_with_uploads(self.upload(png_bytes(), chunk_size=100000, name='copy.png'))
+
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.thumbnail.name, first.thumbnail.name)
+        self.assertEqual(second.file_name, 'copy.png')
+
+    def test_download_supports_ranges(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.vendor, content='')
+        attachment = MessageAttachment(
+            message=message, file_name='notes.txt', file_size=26, file_type='document', mime_type='text/plain'
+        )
+        attachment.file.save('notes.txt', ContentFile(b'abcdefghijklmnopqrstuvwxyz'))
+        url = f'/api/chat/attachments/{attachment.id}/download/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), b'abcdefghijklmnopqrstuvwxyz')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/26')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(b''.join(response.streaming_content), b'cdef')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'xyz')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=30-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_inspect_file_runs_in_worker_process(self):
+        path = f'{self.media_root}/photo.png'
+        with open(path, 'wb') as f:
+            f.write(png_bytes((100, 400)))
+
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(inspect_file, path, 'image/png', f'{self.media_root}/thumbs/t.jpg').result()
+
+        self.assertEqual((result['width'], result['height']), (100, 400))
+        self.assertTrue(result['thumbnail'])
+
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 10))
+        self.assertIsNone(parse_range('bytes=1-2,4-5', 10))
+        self.assertEqual(parse_range('bytes=4-', 10), (4, 9))
+        self.assertEqual(parse_range('bytes=0-100', 10), (0, 9))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=10-', 10)
@@ -1,6 +1,10 @@
 import pytest
 import json
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
@@ -8,6 +12,8 @@ from rest_framework import status
 from unittest.mock import patch, MagicMock
 from ..models import Conversation, Message
 from ..serializers import ConversationSerializer, MessageSerializer
+from ..last_message import flush as flush_last_message_at, record as record_last_message
+from ..search import install as install_search_index
 
 User = get_user_model()
 
@@ -172,4 +178,160 @@ class ChatAPITestCase(TestCase):
         
         # Should still only have one conversation
         conversations = Conversation.objects.filter(vendor=self.vendor, customer=self.customer)
-        self.assertEqual(conversations.count(), 1)
\ No newline at end of file
+        self.assertEqual(conversations.count(), 1)
+
+    def test_mark_read_by_single_statement(self):
+        """Reading a conversation with many unread messages costs one UPDATE"""
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.customer, content=f'Message {i}',
+                    status='delivered' if i % 2 else 'sent', message_id=f'bulk-{i}')
+            for i in range(500)
+        ])
+        own = Message.objects.create(conversation=self.conversation, sender=self.vendor, content='Mine', status='sent')
+
+        with CaptureQueriesContext(connection) as queries:
+            message_ids = self.conversation.mark_read_by(self.vendor)
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(message_ids), 500)
+        self.assertEqual(Message.objects.filter(status='read', read_at__isnull=False).count(), 500)
+        own.refresh_from_db()
+        self.assertEqual(own.status, 'sent')
+
+    def test_last_message_at_coalesced(self):
+        """Messages no longer write the conversation row; one flush applies the newest time"""
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(3):
+                Message.objects.create(conversation=self.conversation, sender=self.vendor, content=f'Message {i}')
+
+        table = Conversation._meta.db_table
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE') and table in q['sql']])
+        self.conversation.refresh_from_db()
+        self.assertIsNone(self.conversation.last_message_at)
+
+        self.assertEqual(flush_last_message_at(), 1)
+        self.conversation.refresh_from_db()
+        latest = Message.objects.filter(conversation=self.conversation).latest('created_at')
+        self.assertEqual(self.conversation.last_message_at, latest.created_at)
+        self.assertEqual(flush_last_message_at(), 0)
+
+    def test_last_message_at_only_moves_forward(self):
+        """A flush carrying an older time leaves a newer last_message_at in place"""
+        newer = timezone.now()
+        Conversation.objects.filter(id=self.conversation.id).update(last_message_at=newer)
+        record_last_message(self.conversation.id, newer - timedelta(minutes=5))
+
+        self.assertEqual(flush_last_message_at(), 0)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_at, newer)
+
+    def test_conversation_list_ordered_by_latest_message(self):
+        """The list flushes pending updates before ordering"""
+        other_conversation = Conversation.objects.create(vendor=self.vendor, customer=self.other_user)
+        Message.objects.create(conversation=self.conversation, sender=self.customer, content='Earlier')
+        Message.objects.create(conversation=other_conversation, sender=self.other_user, content='Later')
+
+        self.client.force_authenticate(user=self.vendor)
+        response = self.client.get('/api/chat/conversations/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        conversation_ids = [conv['id'] for conv in response.data.get('results', response.data)]
+        self.assertEqual(conversation_ids, [other_conversation.id, self.conversation.id])
+
+    def test_conversation_list_queries_do_not_grow(self):
+        """Last message and unread count are annotated, not fetched per conversation"""
+        def add_conversations(count):
+            for i in range(count):
+                customer = User.objects.create_user(username=f'buyer{count}_{i}', password='pass', user_type='customer')
+                conversation = Conversation.objects.create(vendor=self.vendor, customer=customer)
+                for j in range(3):
+                    Message.objects.create(conversation=conversation, sender=customer, content=f'Hi {j}', status='sent')
+
+        def list_queries():
+            flush_last_message_at()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/chat/conversations/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries), response.data['results']
+
+        self.client.force_authenticate(user=self.vendor)
+        add_conversations(2)
+        few, _ = list_queries()
+        add_conversations(8)
+        many, results = list_queries()
+
+        self.assertEqual(few, many)
+        by_id = {conv['id']: conv for conv in results}
+        busy = Conversation.objects.exclude(id=self.conversation.id).latest('id')
+        self.assertEqual(by_id[busy.id]['unread_count'], 3)
+        self.assertEqual(by_id[busy.id]['last_message']['content'], 'Hi 2')
+        self.assertIsNone(by_id[self.conversation.id]['last_message'])
+
+    def test_message_history_pages_by_keyset(self):
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.customer, content=f'Message {i}', message_id=f'page-{i}')
+            for i in range(120)
+        ])
+        expected = list(
+            Message.objects.filter(conversation=self.conversation).order_by('created_at', 'id').values_list('id', flat=True)
+        )
+        self.client.force_authenticate(user=self.vendor)
+
+        pages, cursor = [], None
+        while True:
+            url = f'/api/chat/conversations/{self.conversation.id}/messages/'
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'before': cursor} if cursor else {})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse([q for q in queries if 'OFFSET' in q['sql'] or 'COUNT(' in q['sql']])
+            pages.insert(0, [message['id'] for message in response.data['results']])
+            cursor = response.data['next_cursor']
+            if not response.data['has_next']:
+                break
+
+        self.assertEqual([len(page) for page in pages], [20, 50, 50])
+        self.assertEqual([message_id for page in pages for message_id in page], expected)
+
+    def test_messages_since_returns_only_the_gap(self):
+        messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.customer, content=f'Message {i}')
+            for i in range(5)
+        ]
+        self.client.force_authenticate(user=self.vendor)
+        url = f'/api/chat/conversations/{self.conversation.id}/messages/since/'
+
+        response = self.client.get(url, {'after': messages[1].message_id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['id'] for m in response.data['messages']], [m.id for m in messages[2:]])
+        self.assertFalse(response.data['has_more'])
+
+        response = self.client.get(url, {'after': 'no-such-message'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(response.data['reset'])
+
+    def test_search_uses_full_text_index(self):
+        # Tests build tables without migrations, so create the index 0007 installs
+        install_search_index(connection.schema_editor(atomic=False))
+        outsider_conversation = Conversation.objects.create(vendor=self.vendor, customer=self.other_user)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.customer, content='Can you cater the <b>wedding</b> dinner?', message_id='s-1'),
+            Message(conversation=self.conversation, sender=self.vendor, content='Wedding cake, wedding flowers and weddings abroad', message_id='s-2'),
+            Message(conversation=self.conversation, sender=self.vendor, content='See you on Friday', message_id='s-3'),
+            Message(conversation=outsider_conversation, sender=self.other_user, content='Our wedding is in June', message_id='s-4'),
+        ])
+        self.client.force_authenticate(user=self.customer)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/conversations/search/', {'q': 'wedding'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries if ' LIKE ' in q['sql']])
+
+        results = response.data['results']
+        self.assertEqual([r['message']['message_id'] for r in results], ['s-2', 's-1'])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertIn('&lt;b&gt;<mark>wedding</mark>&lt;/b&gt;', results[1]['snippet'])
+
+        # Edits are picked up by the index
+        Message.objects.filter(message_id='s-3').update(content='Friday wedding rehearsal')
+        response = self.client.get('/api/chat/conversations/search/', {'q': 'rehears'})
+        self.assertEqual([r['message']['message_id'] for r in response.data['results']], ['s-3'])
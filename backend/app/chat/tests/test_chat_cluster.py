@@ -0,0 +1,132 @@
+import importlib
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import pytest
+import redis
+import socketio
+from django.db import connection, connections
+from django.test import TransactionTestCase
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..models import Conversation, Message
+
+User = get_user_model()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'Chat node on port {port} did not start')
+
+
+def run_node(port, redis_url):
+    """One clustered chat node, run in a forked child process"""
+    os.environ['CHAT_CLUSTER'] = '1'
+    os.environ['REDIS_URL'] = redis_url
+    import uvicorn
+    if 'chat_server_async' in sys.modules:
+        server = importlib.reload(sys.modules['chat_server_async'])
+    else:
+        server = importlib.import_module('chat_server_async')
+    uvicorn.run(server.app, host='127.0.0.1', port=port, log_level='warning')
+
+
+@pytest.mark.django_db(transaction=True)
+class ChatClusterTestCase(TransactionTestCase):
+    """Two chat processes sharing rooms and connections through Redis"""
+
+    def setUp(self):
+        pytest.importorskip('uvicorn')
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Chat nodes need a database shared between processes')
+
+        self.redis_url = os.environ.get('CHAT_TEST_REDIS_URL') or self.start_fake_redis()
+        self.redis = redis.Redis.from_url(self.redis_url)
+
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+
+        # Children must not share the parent's database connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        self.ports = []
+        for _ in range(2):
+            port = free_port()
+            node = context.Process(target=run_node, args=(port, self.redis_url), daemon=True)
+            node.start()
+            self.addCleanup(self.stop_node, node)
+            self.ports.append(port)
+        for port in self.ports:
+            wait_for_port(port)
+
+    def start_fake_redis(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        server = fakeredis.TcpFakeServer(('127.0.0.1', free_port()), server_type='redis')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        return 'redis://%s:%s/0' % server.server_address
+
+    def stop_node(self, node):
+        node.terminate()
+        node.join(timeout=5)
+
+    def connect(self, user, port):
+        client = socketio.SimpleClient()
+        client.connect(f'http://127.0.0.1:{port}', auth={'token': str(AccessToken.for_user(user))})
+        self.addCleanup(client.disconnect)
+        self.assertEqual(client.receive(timeout=5)[0], 'connected')
+        return client
+
+    def receive(self, client, event):
+        while True:
+            name, *args = client.receive(timeout=5)
+            if name == event:
+                return args[0] if args else None
+
+    def join(self, client):
+        client.emit('join_conversation', {'conversation_id': self.conversation.id})
+        self.receive(client, 'joined_conversation')
+
+    def test_message_reaches_client_on_other_node(self):
+        node_a, node_b = self.ports
+        vendor_client = self.connect(self.vendor, node_a)
+        customer_client = self.connect(self.customer, node_b)
+        self.join(vendor_client)
+        self.join(customer_client)
+
+        vendor_client.emit('send_message', {
+            'conversation_id': self.conversation.id,
+            'content': 'Hello from node A',
+            'temp_id': 'tmp-1'
+        })
+        payload = self.receive(customer_client, 'new_message')
+
+        self.assertEqual(payload['content'], 'Hello from node A')
+        self.assertEqual(payload['sender_id'], self.vendor.id)
+        self.assertTrue(Message.objects.filter(message_id=payload['message_id']).exists())
+
+    def test_connection_limit_is_cluster_wide(self):
+        node_a, node_b = self.ports
+        self.connect(self.vendor, node_a)
+        self.connect(self.vendor, node_b)
+
+        with self.assertRaises(socketio.exceptions.ConnectionError):
+            self.connect(self.vendor, node_a)
+        self.assertEqual(self.redis.zcard(f'chat:connections:{self.vendor.id}'), 2)
@@ -0,0 +1,59 @@
+import json
+import pytest
+from django.test import TransactionTestCase
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch
+
+import chat_server as server
+from ..models import Conversation
+from ..realtime import EXTERNAL_EMIT_QUEUE, user_room
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+class ExternalEmitTestCase(TransactionTestCase):
+    """Emits from web processes reach sockets on the eventlet server through the Redis queue"""
+
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        redis_server = fakeredis.FakeServer()
+        # The chat server and the web process each have their own client to the same Redis
+        self.redis = fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+        for patcher in (
+            patch('app.chat.realtime.get_redis', return_value=fakeredis.FakeRedis(server=redis_server)),
+            patch.object(server, 'redis_client', self.redis)
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+
+    def connect_socket(self, eio_sid, user):
+        sid = server.sio.manager.connect(eio_sid, '/')
+        server.sio.manager.enter_room(sid, '/', user_room(user.id))
+        self.addCleanup(server.sio.manager.disconnect, sid, '/')
+
+    def test_rest_notification_reaches_connected_socket(self):
+        self.connect_socket('eio-vendor', self.vendor)
+        client = APIClient()
+        client.force_authenticate(user=self.customer)
+
+        response = client.post('/api/chat/messages/', {
+            'conversation': self.conversation.id, 'content': 'Is the 14th still free?'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(self.redis.llen(EXTERNAL_EMIT_QUEUE))
+
+        with patch.object(server.sio, '_send_eio_packet') as send:
+            server.drain_external_emits()
+
+        received = [(call.args[0], json.loads(call.args[1].data[1:])) for call in send.call_args_list]
+        self.assertIn('eio-vendor', [eio_sid for eio_sid, _ in received])
+        events = [packet for eio_sid, packet in received if eio_sid == 'eio-vendor']
+        self.assertEqual([event for event, _ in events], ['notification'])
+        self.assertEqual(self.redis.llen(EXTERNAL_EMIT_QUEUE), 0)
@@ -0,0 +1,482 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import chat_server_async as server
+from ..models import Conversation, Message
+from ..connections import LocalConnectionRegistry
+from ..presence import AsyncPresenceService
+from ..realtime import TYPING_LIMIT
+from ..typing import TypingCoalescer
+from .. import wire
+from ..wire import EncodingRooms, expand_message, negotiate
+from ..write_behind import STREAM_KEY
+from notifications.models import Notification
+from partyoria.rate_limiting import LocalBuckets
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+class AsyncChatServerTestCase(TransactionTestCase):
+    """Handlers run on the event loop; ORM work runs on the database executor threads"""
+
+    def setUp(self):
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+
+        for name, fresh in (
+            ('connections', LocalConnectionRegistry()), ('typing_state', TypingCoalescer()),
+            ('local_buckets', LocalBuckets()), ('encoding_rooms', EncodingRooms())
+        ):
+            patcher = patch.object(server, name, fresh)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('emit', 'enter_room'):
+            patcher = patch.object(server.sio, name, new_callable=AsyncMock)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(server, 'redis_client', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Socket.IO keeps sessions on the engine.io socket, which unit tests do not have
+        self.sessions = {}
+
+        async def save_session(sid, session):
+            self.sessions[sid] = session
+
+        async def get_session(sid):
+            return self.sessions[sid]
+
+        for name, fake in (('save_session', save_session), ('get_session', get_session)):
+            patcher = patch.object(server.sio, name, new=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def connect(self, sid, user):
+        return asyncio.run(server.connect(sid, {}, {'token': str(AccessToken.for_user(user))}))
+
+    def join(self, sid):
+        asyncio.run(server.join_conversation(sid, {'conversation_id': self.conversation.id}))
+
+    @contextmanager
+    def inline_db(self, queries):
+        """Run ORM calls on the loop thread, collecting every statement into queries"""
+        async def run_inline(func, *args, **kwargs):
+            with CaptureQueriesContext(connections['default']) as captured:
+                result = func(*args, **kwargs)
+            queries.extend(captured.captured_queries)
+            return result
+
+        with patch.object(server, 'run_db', run_inline), patch.dict(os.environ, {'DJANGO_ALLOW_ASYNC_UNSAFE': 'true'}):
+            yield
+
+    def test_connect_with_jwt(self):
+        self.assertIsNot(self.connect('sid-1', self.vendor), False)
+
+        self.assertEqual(server.connections.sids, {'sid-1': self.vendor.id})
+        self.enter_room.assert_awaited_with('sid-1', f'user_{self.vendor.id}')
+        self.emit.assert_awaited_with(
+            'connected', {'status': 'success', 'user_id': self.vendor.id, 'encoding': 'json'}, room='sid-1'
+        )
+
+    def test_connect_rejects_invalid_token(self):
+        result = asyncio.run(server.connect('sid-1', {}, {'token': 'not-a-token'}))
+
+        self.assertIs(result, False)
+        self.assertEqual(server.connections.sids, {})
+
+    def test_send_message_persists_and_broadcasts(self):
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+
+        asyncio.run(server.send_message('sid-1', {
+            'conversation_id': self.conversation.id,
+            'content': 'Hello customer',
+            'temp_id': 'tmp-1'
+        }))
+
+        message = Message.objects.get(conversation=self.conversation)
+        self.assertEqual(message.content, 'Hello customer')
+        event, payload = self.emit.await_args.args
+        self.assertEqual(event, 'new_message')
+        self.assertEqual(self.emit.await_args.kwargs['room'], f'conv_{self.conversation.id}:json')
+        self.assertEqual(payload['message_id'], message.message_id)
+        self.assertEqual(payload['temp_id'], 'tmp-1')
+
+    def test_compact_encoding_is_negotiated_at_connect(self):
+        asyncio.run(server.connect('sid-1', {'QUERY_STRING': 'encoding=msgpack'}, {
+            'token': str(AccessToken.for_user(self.vendor))
+        }))
+        self.assertEqual(self.emit.await_args.args[1]['encoding'], 'msgpack')
+        self.join('sid-1')
+        self.enter_room.assert_awaited_with('sid-1', f'conv_{self.conversation.id}:msgpack')
+        self.connect('sid-2', self.customer)
+        self.join('sid-2')
+
+        asyncio.run(server.send_message('sid-1', {
+            'conversation_id': self.conversation.id, 'content': 'Hello customer', 'temp_id': 'tmp-1'
+        }))
+
+        broadcasts = {
+            call.kwargs['room']: call.args[1] for call in self.emit.await_args_list if call.args[0] == 'new_message'
+        }
+        compact = broadcasts[f'conv_{self.conversation.id}:msgpack']
+        full = broadcasts[f'conv_{self.conversation.id}:json']
+        self.assertIsInstance(compact, bytes)
+        self.assertLess(len(compact), len(json.dumps(full)) / 2)
+        expanded = expand_message(compact)
+        created_at = [datetime.fromisoformat(payload.pop('created_at')) for payload in (expanded, full)]
+        self.assertLess(abs(created_at[0] - created_at[1]), timedelta(milliseconds=1))
+        self.assertEqual(expanded, full)
+
+    def test_compact_body_is_skipped_until_a_socket_opts_in(self):
+        def broadcast_rooms():
+            self.emit.reset_mock()
+            asyncio.run(server.send_message('sid-1', {'conversation_id': self.conversation.id, 'content': 'Hi'}))
+            return [call.kwargs['room'] for call in self.emit.await_args_list if call.args[0] == 'new_message']
+
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+        with patch.object(wire, 'compact_message', wraps=wire.compact_message) as compact:
+            json_only = broadcast_rooms()
+            asyncio.run(server.connect('sid-2', {'QUERY_STRING': 'encoding=msgpack'}, {
+                'token': str(AccessToken.for_user(self.customer))
+            }))
+            self.join('sid-2')
+            both = broadcast_rooms()
+            asyncio.run(server.disconnect('sid-2'))
+            json_again = broadcast_rooms()
+
+        room = f'conv_{self.conversation.id}'
+        self.assertEqual(json_only, [f'{room}:json'])
+        self.assertEqual(both, [f'{room}:msgpack', f'{room}:json'])
+        self.assertEqual(json_again, [f'{room}:json'])
+        self.assertEqual(compact.call_count, 1)
+
+    def test_blocking_query_does_not_stall_loop(self):
+        """Other coroutines keep running while a slow ORM call is in flight"""
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            await server.run_db(time.sleep, 0.2)
+            task.cancel()
+            return ticks
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 5)
+
+    def test_send_message_reads_nothing_after_join(self):
+        """Sender profile and conversation access come from the session; the insert is the only statement"""
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+
+        queries = []
+        with self.inline_db(queries), patch.object(server.sio, 'start_background_task') as background:
+            asyncio.run(server.send_message('sid-1', {'conversation_id': self.conversation.id, 'content': 'Hi'}))
+
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(statements, ['INSERT'])
+
+        # The in-app notification is created after the broadcast
+        task, message_id = background.call_args.args
+        asyncio.run(task(message_id))
+        self.assertTrue(Notification.objects.filter(recipient=self.customer, notification_type='new_message').exists())
+
+    def test_invalidation_drops_cached_entries(self):
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+        self.vendor.username = 'renamed'
+        self.vendor.save()
+
+        asyncio.run(server.apply_invalidation({'kind': 'user', 'id': self.vendor.id}))
+        asyncio.run(server.apply_invalidation({'kind': 'conversation', 'id': self.conversation.id}))
+
+        self.assertEqual(self.sessions['sid-1']['conversations'], {})
+        self.join('sid-1')
+        asyncio.run(server.typing('sid-1', {'conversation_id': self.conversation.id, 'is_typing': True}))
+        self.assertEqual(self.emit.await_args.args[1]['username'], 'renamed')
+
+    def test_signals_publish_invalidations(self):
+        redis_client = MagicMock()
+        with patch('app.chat.signals.get_redis', return_value=redis_client):
+            self.conversation.is_active = False
+            self.conversation.save()
+
+        channel, body = redis_client.publish.call_args.args
+        self.assertEqual(channel, 'chat:invalidate')
+        self.assertIn(f'"id": {self.conversation.id}', body)
+
+    def test_join_sends_one_read_receipt(self):
+        messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.customer, content=f'Hi {i}', status='sent')
+            for i in range(3)
+        ]
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+
+        receipts = [call for call in self.emit.await_args_list if call.args[0] == 'messages_read']
+        self.assertEqual(len(receipts), 1)
+        self.assertEqual(receipts[0].args[1], {
+            'conversation_id': self.conversation.id,
+            'reader_id': self.vendor.id,
+            'up_to_id': messages[-1].id,
+            'count': 3
+        })
+        self.assertEqual(receipts[0].kwargs['skip_sid'], 'sid-1')
+
+    def test_write_behind_broadcasts_before_saving(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+
+        async def scenario():
+            await server.send_message('sid-1', {
+                'conversation_id': self.conversation.id, 'content': 'Hi', 'temp_id': 'tmp-1'
+            })
+            return await redis_client.xrange(STREAM_KEY)
+
+        queries = []
+        with self.inline_db(queries), patch.object(server, 'redis_client', redis_client), \
+                patch.object(server, 'persister', MagicMock()):
+            entries = asyncio.run(scenario())
+
+        self.assertEqual(queries, [])
+        self.assertFalse(Message.objects.exists())
+        event, payload = self.emit.await_args_list[-1].args
+        self.assertEqual((event, payload['status'], payload['id']), ('new_message', 'sending', None))
+        [(_, fields)] = entries
+        self.assertEqual((fields['message_id'], fields['temp_id']), (payload['message_id'], 'tmp-1'))
+
+    def test_connection_index_is_kept_per_user(self):
+        for sid, user in (('sid-1', self.vendor), ('sid-2', self.vendor), ('sid-3', self.customer)):
+            self.connect(sid, user)
+
+        self.assertEqual(server.connections.local_sids(self.vendor.id), {'sid-1', 'sid-2'})
+        self.assertEqual(asyncio.run(server.connections.remove('sid-1')), (self.vendor.id, 1))
+        self.assertEqual(asyncio.run(server.connections.remove('sid-2')), (self.vendor.id, 0))
+        self.assertEqual(set(server.connections.local_users()), {self.customer.id})
+        self.assertFalse(asyncio.run(server.connections.is_online(self.vendor.id)))
+
+    def test_new_notifications_are_pushed_to_user_room(self):
+        from notifications.services import MessageNotifications
+
+        with patch('app.chat.signals.push_to_user') as push:
+            notification = MessageNotifications.new_message(self.customer, 'vendor', 'Wedding', self.conversation.id)
+
+        user_id, event, payload = push.call_args.args
+        self.assertEqual((user_id, event, payload['id']), (self.customer.id, 'notification', str(notification.id)))
+
+    def test_typing_bursts_are_coalesced_without_queries(self):
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+        self.emit.reset_mock()
+
+        async def keystrokes():
+            for _ in range(20):
+                await server.typing('sid-1', {'conversation_id': self.conversation.id, 'is_typing': True})
+
+        queries = []
+        with self.inline_db(queries):
+            asyncio.run(keystrokes())
+
+        self.assertEqual(queries, [])
+        self.assertEqual(self.emit.await_count, 1)
+        event, payload = self.emit.await_args.args
+        self.assertEqual((event, payload['is_typing']), ('user_typing', True))
+
+    def test_typing_needs_a_joined_conversation(self):
+        other = Conversation.objects.create(vendor=self.customer, customer=User.objects.create_user(
+            username='stranger', password='pass', user_type='customer'
+        ))
+        self.connect('sid-1', self.vendor)
+        self.emit.reset_mock()
+
+        queries = []
+        with self.inline_db(queries):
+            for conversation_id in (self.conversation.id, other.id):
+                asyncio.run(server.typing('sid-1', {'conversation_id': conversation_id, 'is_typing': True}))
+
+        self.assertEqual(queries, [])
+        self.emit.assert_not_awaited()
+
+    def test_typing_starts_are_rate_limited_per_user(self):
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+
+        with patch.object(server.typing_state, 'update', return_value=[]) as update:
+            for _ in range(TYPING_LIMIT.burst + 3):
+                asyncio.run(server.typing('sid-1', {'conversation_id': self.conversation.id, 'is_typing': True}))
+            asyncio.run(server.typing('sid-1', {'conversation_id': self.conversation.id, 'is_typing': False}))
+
+        self.assertEqual(
+            [call.args[4] for call in update.call_args_list], [True] * TYPING_LIMIT.burst + [False]
+        )
+
+    def test_disconnect_switches_typing_off(self):
+        self.connect('sid-1', self.vendor)
+        self.join('sid-1')
+        asyncio.run(server.typing('sid-1', {'conversation_id': self.conversation.id, 'is_typing': True}))
+
+        asyncio.run(server.disconnect('sid-1'))
+
+        event, payload = self.emit.await_args.args
+        self.assertEqual((event, payload['is_typing']), ('user_typing', False))
+
+
+    def test_sync_messages_sends_missed_messages(self):
+        seen = Message.objects.create(conversation=self.conversation, sender=self.customer, content='Seen', status='sent')
+        missed = Message.objects.create(conversation=self.conversation, sender=self.customer, content='Missed', status='sent')
+        self.connect('sid-1', self.vendor)
+
+        asyncio.run(server.sync_messages('sid-1', {
+            'conversation_id': self.conversation.id, 'after_message_id': seen.message_id
+        }))
+
+        event, payload = self.emit.await_args.args
+        self.assertEqual(event, 'messages_synced')
+        self.assertEqual([m['id'] for m in payload['messages']], [missed.id])
+        self.assertFalse(payload['reset'])
+
+    def test_presence_follows_connections(self):
+        fakeredis = pytest.importorskip('fakeredis')
+
+        async def scenario():
+            with patch.object(server, 'presence', AsyncPresenceService(fakeredis.aioredis.FakeRedis(decode_responses=True))):
+                await server.connect('sid-1', {}, {'token': str(AccessToken.for_user(self.vendor))})
+                await server.connect('sid-2', {}, {'token': str(AccessToken.for_user(self.customer))})
+                await server.disconnect('sid-2')
+                return await server.who_is_online('sid-1', {'user_ids': [self.vendor.id, self.customer.id]})
+
+        payload = asyncio.run(scenario())
+
+        self.emit.assert_awaited_with('presence_status', payload, room='sid-1')
+        self.assertTrue(payload['users'][self.vendor.id]['online'])
+        self.assertFalse(payload['users'][self.customer.id]['online'])
+        self.assertIsNotNone(payload['users'][self.customer.id]['last_seen'])
+
+    def test_delivery_acks_are_applied_in_one_update_per_flush(self):
+        other_customer = User.objects.create_user(username='other', password='pass', user_type='customer')
+        other_conversation = Conversation.objects.create(vendor=self.vendor, customer=other_customer)
+        sent = [
+            Message.objects.create(conversation=self.conversation, sender=self.vendor, content=f'm{i}', status='sent')
+            for i in range(5)
+        ]
+        other = Message.objects.create(conversation=other_conversation, sender=self.vendor, content='x', status='sent')
+        self.connect('sid-1', self.customer)
+        self.connect('sid-2', other_customer)
+
+        async def scenario():
+            # Acks arrive message by message; only the highest per conversation is kept
+            for message in sent[:4]:
+                await server.ack_delivered('sid-1', {'conversation_id': self.conversation.id, 'up_to_id': message.id})
+            await server.ack_delivered('sid-1', {'conversation_id': self.conversation.id, 'up_to_id': sent[1].id})
+            await server.ack_delivered('sid-2', {'conversation_id': other_conversation.id, 'up_to_id': other.id})
+            # Not a participant
+            await server.ack_delivered('sid-2', {'conversation_id': self.conversation.id, 'up_to_id': sent[4].id})
+            await server.flush_delivery_acks()
+
+        queries = []
+        with self.inline_db(queries), patch.object(server, 'delivery_acks', server.receipts.DeliveryAcks()):
+            asyncio.run(scenario())
+
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(Message.objects.filter(sender=self.vendor).order_by('id').values_list('status', flat=True)),
+            ['delivered'] * 4 + ['sent', 'delivered']
+        )
+        receipts = [call for call in self.emit.await_args_list if call.args[0] == 'messages_delivered']
+        self.assertEqual({call.kwargs['room'] for call in receipts}, {f'user_{self.vendor.id}'})
+        self.assertCountEqual([call.args[1] for call in receipts], [
+            {'conversation_id': self.conversation.id, 'recipient_id': self.customer.id, 'up_to_id': sent[3].id, 'count': 4},
+            {'conversation_id': other_conversation.id, 'recipient_id': other_customer.id, 'up_to_id': other.id, 'count': 1}
+        ])
+        self.emit.assert_any_await('error', {'message': 'Not authorized'}, room='sid-2')
+
+    def test_delivery_flush_without_new_messages_emits_nothing(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.vendor, content='m', status='read')
+        self.connect('sid-1', self.customer)
+
+        async def scenario():
+            await server.ack_delivered('sid-1', {'conversation_id': self.conversation.id, 'up_to_id': message.id})
+            await server.flush_delivery_acks()
+            await server.flush_delivery_acks()
+
+        with patch.object(server, 'delivery_acks', server.receipts.DeliveryAcks()):
+            asyncio.run(scenario())
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'read')
+        self.assertFalse([call for call in self.emit.await_args_list if call.args[0] == 'messages_delivered'])
+
+
+class TypingCoalescerTestCase(SimpleTestCase):
+    """State changes per (conversation, user) are throttled and expire on their own"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.typing = TypingCoalescer(interval=1.0, timeout=5.0, clock=lambda: self.now)
+
+    def states(self, events):
+        return [payload['is_typing'] for _, _, payload in events]
+
+    def test_changes_inside_interval_are_held_back(self):
+        self.assertEqual(self.states(self.typing.update(1, 7, 'vendor', 'sid-1', True)), [True])
+        self.now = 0.3
+        self.assertEqual(self.typing.update(1, 7, 'vendor', 'sid-1', False), [])
+        self.assertEqual(self.typing.update(1, 7, 'vendor', 'sid-1', True), [])
+        self.now = 0.6
+        self.assertEqual(self.typing.update(1, 7, 'vendor', 'sid-1', False), [])
+
+        self.now = 1.0
+        self.assertEqual(self.states(self.typing.sweep()), [False])
+        self.assertEqual(self.typing.states, {})
+
+    def test_typing_expires_without_refresh(self):
+        self.typing.update(1, 7, 'vendor', 'sid-1', True)
+        self.now = 4.0
+        self.typing.update(1, 7, 'vendor', 'sid-1', True)
+
+        self.now = 8.9
+        self.assertEqual(self.typing.sweep(), [])
+        self.now = 9.0
+        self.assertEqual(self.states(self.typing.sweep()), [False])
+
+    def test_users_and_conversations_are_independent(self):
+        events = (
+            self.typing.update(1, 7, 'vendor', 'sid-1', True)
+            + self.typing.update(1, 8, 'customer', 'sid-2', True)
+            + self.typing.update(2, 7, 'vendor', 'sid-1', True)
+        )
+        self.assertEqual(len(events), 3)
+        self.assertEqual(self.states(self.typing.drop_user(7)), [False, False])
+        self.assertEqual(list(self.typing.states), [(1, 8)])
+
+
+
+class WireEncodingTestCase(SimpleTestCase):
+    def test_negotiate(self):
+        self.assertEqual(negotiate({}, {'token': 't', 'encoding': 'msgpack'}), 'msgpack')
+        self.assertEqual(negotiate({'QUERY_STRING': 'token=t&encoding=msgpack'}, None), 'msgpack')
+        self.assertEqual(negotiate({'QUERY_STRING': 'encoding=protobuf'}, {}), 'json')
+        self.assertEqual(negotiate({}, None), 'json')
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..db_pool import GreenDBPool, ThreadDBPool
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+class ThreadDBPoolTestCase(TransactionTestCase):
+    def setUp(self):
+        self.pool = ThreadDBPool(size=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_connections_are_bounded_by_pool_size(self):
+        User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        used = set()
+        lock = threading.Lock()
+
+        def query():
+            with lock:
+                used.add(id(connection))
+            return User.objects.count()
+
+        async def scenario():
+            return await asyncio.gather(*[self.pool.run(query) for _ in range(20)])
+
+        self.assertEqual(asyncio.run(scenario()), [1] * 20)
+        self.assertLessEqual(len(used), 2)
+
+    def test_metrics_report_utilization_and_waits(self):
+        async def scenario():
+            await asyncio.gather(*[self.pool.run(time.sleep, 0.05) for _ in range(4)])
+            with self.assertRaises(ZeroDivisionError):
+                await self.pool.run(lambda: 1 / 0)
+
+        asyncio.run(scenario())
+        snapshot = self.pool.snapshot()
+
+        self.assertEqual((snapshot['size'], snapshot['tasks'], snapshot['failures']), (2, 5, 1))
+        self.assertEqual((snapshot['busy'], snapshot['queued']), (0, 0))
+        self.assertEqual(snapshot['max_busy'], 2)
+        # Two of the four sleeps had to wait for a free worker
+        self.assertGreaterEqual(snapshot['wait_ms_max'], 40)
+        self.assertGreater(snapshot['utilization'], 0)
+
+        # Each snapshot starts a new window
+        snapshot = self.pool.snapshot()
+        self.assertEqual((snapshot['utilization'], snapshot['wait_ms_max'], snapshot['tasks']), (0.0, 0.0, 5))
+
+
+class GreenDBPoolTestCase(SimpleTestCase):
+    def test_runs_on_worker_threads(self):
+        pytest.importorskip('eventlet')
+        pool = GreenDBPool(size=2)
+
+        thread = pool.run(threading.get_ident)
+
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual(pool.snapshot()['tasks'], 1)
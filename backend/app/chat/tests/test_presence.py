@@ -0,0 +1,99 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from .. import presence as presence_module, views
+from ..models import Conversation
+from ..presence import PresenceService, AsyncPresenceService, PRESENCE_KEY, PRESENCE_TTL
+
+User = get_user_model()
+
+
+class PresenceServiceTestCase(SimpleTestCase):
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self.fakeredis = fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.presence = PresenceService(self.redis)
+
+    def test_heartbeat_online_and_offline(self):
+        self.presence.heartbeat(1, 2)
+        self.presence.set_offline(2)
+
+        statuses = self.presence.statuses([1, 2, 3])
+
+        self.assertEqual(statuses[1], {'online': True, 'last_seen': None})
+        self.assertFalse(statuses[2]['online'])
+        self.assertIsNotNone(statuses[2]['last_seen'])
+        self.assertEqual(statuses[3], {'online': False, 'last_seen': None})
+        self.assertEqual(self.presence.who_is_online([1, 2]), {1: True, 2: False})
+
+    def test_missed_heartbeats_expire(self):
+        with patch.object(presence_module.time, 'time', return_value=1000.0):
+            self.presence.heartbeat(1)
+        with patch.object(presence_module.time, 'time', return_value=1000.0 + PRESENCE_TTL + 1):
+            status = self.presence.statuses([1])[1]
+
+        self.assertFalse(status['online'])
+        self.assertTrue(status['last_seen'].startswith('1970-01-01T00:16:40'))
+
+    def test_bulk_lookup_is_one_round_trip(self):
+        self.presence.heartbeat(*range(100))
+        with patch.object(self.redis, 'pipeline', wraps=self.redis.pipeline) as pipeline, \
+                patch.object(self.redis, 'execute_command', wraps=self.redis.execute_command) as command:
+            online = self.presence.who_is_online(range(200))
+
+        self.assertEqual(sum(online.values()), 100)
+        self.assertEqual(pipeline.call_count, 1)
+        command.assert_not_called()
+
+    def test_prune_moves_old_heartbeats_to_last_seen(self):
+        with patch.object(presence_module.time, 'time', return_value=1000.0):
+            self.presence.heartbeat(1)
+        self.presence.heartbeat(2)
+        self.presence.prune()
+
+        self.assertEqual(self.redis.zrange(PRESENCE_KEY, 0, -1), ['2'])
+        self.assertIsNotNone(self.presence.statuses([1])[1]['last_seen'])
+
+    def test_unreachable_redis_reports_everyone_offline(self):
+        with patch.object(presence_module, 'get_redis', return_value=None):
+            self.assertEqual(PresenceService().who_is_online([1, 2]), {1: False, 2: False})
+
+    def test_async_service_matches(self):
+        async def scenario():
+            service = AsyncPresenceService(self.fakeredis.aioredis.FakeRedis(decode_responses=True))
+            await service.heartbeat(1)
+            await service.heartbeat(2)
+            await service.set_offline(2)
+            return await service.who_is_online([1, 2, 3])
+
+        self.assertEqual(asyncio.run(scenario()), {1: True, 2: False, 3: False})
+
+
+class PresenceEndpointTestCase(TestCase):
+    def test_presence_of_every_peer(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        customers = [
+            User.objects.create_user(username=f'customer{i}', password='pass', user_type='customer') for i in range(3)
+        ]
+        for customer in customers:
+            Conversation.objects.create(vendor=vendor, customer=customer)
+        service = PresenceService(fakeredis.FakeRedis(decode_responses=True))
+        service.heartbeat(customers[0].id, customers[2].id)
+
+        client = APIClient()
+        client.force_authenticate(user=vendor)
+        with patch.object(views, 'presence', service):
+            response = client.get('/api/chat/conversations/presence/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {user_id: status['online'] for user_id, status in response.data['users'].items()},
+            {customers[0].id: True, customers[1].id: False, customers[2].id: True}
+        )
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+
+import pytest
+from django.test import SimpleTestCase
+
+from ..push import PushWorker, LoopbackPushProvider, FilePushProvider, Push, coalesce, PUSH_QUEUE, PUSH_METRICS_KEY
+from ..realtime import push_payload
+
+ALICE = {'username': 'alice'}
+BOB = {'username': 'bob'}
+
+
+def entry(sender, recipient_id, conversation_id, content):
+    return json.dumps(push_payload(sender, recipient_id, conversation_id, content, f'm-{content}'))
+
+
+class FailingProvider:
+    def send(self, pushes):
+        raise RuntimeError('provider down')
+
+
+class PushWorkerTestCase(SimpleTestCase):
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self.redis = fakeredis.FakeRedis()
+        self.provider = LoopbackPushProvider()
+
+    def enqueue(self, *entries):
+        for item in entries:
+            self.redis.lpush(PUSH_QUEUE, item)
+
+    def test_batch_coalesces_per_user_and_conversation(self):
+        self.enqueue(
+            entry(ALICE, 1, 10, 'hi'),
+            entry(ALICE, 1, 10, 'are you there?'),
+            entry(ALICE, 1, 10, 'ping'),
+            entry(BOB, 2, 20, 'hello'),
+            entry(BOB, 1, 11, 'quote ready'),
+        )
+        worker = PushWorker(self.redis, self.provider, batch_size=10, block_timeout=0.1)
+
+        self.assertEqual(worker.step(), 3)
+
+        by_key = {(p.user_id, p.conversation_id): p for p in self.provider.sent}
+        self.assertEqual(by_key[(1, 10)].title, '3 new messages from alice')
+        self.assertEqual(by_key[(1, 10)].body, 'ping')
+        self.assertEqual(by_key[(1, 10)].data['message_id'], 'm-ping')
+        self.assertEqual(by_key[(2, 20)].title, 'New message from bob')
+        self.assertEqual(self.redis.llen(PUSH_QUEUE), 0)
+        self.assertEqual(int(self.redis.hget(PUSH_METRICS_KEY, 'pushes')), 3)
+
+    def test_batches_are_bounded_and_report_queue_depth(self):
+        self.enqueue(*[entry(ALICE, user_id, 10, 'hi') for user_id in range(25)])
+        worker = PushWorker(self.redis, self.provider, batch_size=10, block_timeout=0.1)
+
+        worker.step()
+
+        self.assertEqual([p.user_id for p in self.provider.sent], list(range(10)))
+        self.assertEqual(worker.metrics.queue_depth, 15)
+        self.assertEqual(worker.step() + worker.step() + worker.step(), 15)
+
+    def test_failed_delivery_puts_entries_back_in_order(self):
+        self.enqueue(entry(ALICE, 1, 10, 'first'), entry(ALICE, 2, 10, 'second'))
+
+        with self.assertRaises(RuntimeError):
+            PushWorker(self.redis, FailingProvider(), block_timeout=0.1).step()
+        PushWorker(self.redis, self.provider, block_timeout=0.1).step()
+
+        self.assertEqual([p.body for p in self.provider.sent], ['first', 'second'])
+
+    def test_empty_queue_returns_after_block_timeout(self):
+        self.assertEqual(PushWorker(self.redis, self.provider, block_timeout=0.1).step(), 0)
+
+
+class PushProviderTestCase(SimpleTestCase):
+    def test_file_provider_writes_json_lines(self):
+        path = os.path.join(tempfile.mkdtemp(), 'outbox', 'push.jsonl')
+        provider = FilePushProvider(path)
+
+        provider.send(coalesce([push_payload(ALICE, 1, 10, 'hi'), push_payload(BOB, 1, 10, 'yo')]))
+
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [Push(1, 10, '2 new messages', 'yo', 2, {'conversation_id': 10, 'message_id': None}).as_dict()])
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import pytest
+from datetime import timedelta
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from unittest.mock import patch
+
+from ..models import Conversation, Message
+from ..realtime import user_profile
+from ..write_behind import (
+    MessagePersister, STREAM_KEY, DEAD_LETTER_KEY, GROUP, pending_message, stream_entry, persist_batch
+)
+from notifications.models import Notification
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+class WriteBehindTestCase(TransactionTestCase):
+    """Messages queued on the Redis Stream are saved in batches and acknowledged"""
+
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self.redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        self.vendor = User.objects.create_user(username='vendor', password='pass', user_type='vendor')
+        self.customer = User.objects.create_user(username='customer', password='pass', user_type='customer')
+        self.conversation = Conversation.objects.create(vendor=self.vendor, customer=self.customer)
+        self.acks = []
+        self.queries = []
+
+        patcher = patch.dict(os.environ, {'DJANGO_ALLOW_ASYNC_UNSAFE': 'true'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entry(self, content, temp_id=None, conversation_id=None):
+        message = pending_message(conversation_id or self.conversation.id, self.vendor.id, content)
+        return stream_entry(message, user_profile(self.vendor), self.customer.id, temp_id)
+
+    def persister(self, consumer='node-a', **kwargs):
+        async def run_inline(func, *args):
+            with CaptureQueriesContext(connections['default']) as captured:
+                result = func(*args)
+            self.queries.append(len(captured.captured_queries))
+            return result
+
+        async def on_persisted(acks):
+            self.acks.extend(acks)
+
+        return MessagePersister(self.redis, run_inline, on_persisted, consumer, **kwargs)
+
+    async def enqueue(self, *entries):
+        for entry in entries:
+            await self.redis.xadd(STREAM_KEY, entry)
+
+    def test_batch_is_saved_and_acknowledged(self):
+        async def scenario():
+            persister = self.persister()
+            await persister.ensure_group()
+            await self.enqueue(*[self.entry(f'Hi {i}', temp_id=f'tmp-{i}') for i in range(3)])
+            handled = await persister.step()
+            return handled, await self.redis.xlen(STREAM_KEY)
+
+        handled, remaining = asyncio.run(scenario())
+
+        self.assertEqual((handled, remaining), (3, 0))
+        self.assertEqual(set(Message.objects.values_list('status', flat=True)), {'sent'})
+        self.assertEqual(sorted(ack['temp_id'] for ack in self.acks), ['tmp-0', 'tmp-1', 'tmp-2'])
+        self.assertEqual(
+            {ack['id'] for ack in self.acks}, set(Message.objects.values_list('id', flat=True))
+        )
+        self.assertEqual(Notification.objects.filter(recipient=self.customer).count(), 3)
+
+    def test_saved_message_keeps_broadcast_time(self):
+        """created_at is the time the broadcast carried, not the time of the insert"""
+        message = pending_message(self.conversation.id, self.vendor.id, 'Hi')
+        message.created_at -= timedelta(seconds=30)
+        entry = stream_entry(message, user_profile(self.vendor), self.customer.id)
+
+        acks = persist_batch([entry])
+
+        saved = Message.objects.get(message_id=message.message_id)
+        self.assertEqual(saved.created_at, message.created_at)
+        self.assertEqual(acks[0]['created_at'], entry['created_at'])
+
+    def test_batch_queries_do_not_grow_with_size(self):
+        persist_batch([self.entry('warm up')])
+
+        for size in (2, 50):
+            with CaptureQueriesContext(connections['default']) as captured:
+                persist_batch([self.entry(f'Hi {i}') for i in range(size)])
+            self.queries.append(len(captured.captured_queries))
+
+        self.assertEqual(self.queries[0], self.queries[1])
+
+    def test_replayed_batch_is_not_saved_twice(self):
+        entries = [self.entry(f'Hi {i}') for i in range(3)]
+        persist_batch(entries)
+        acks = persist_batch(entries)
+
+        self.assertEqual(len(acks), 3)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(Notification.objects.filter(recipient=self.customer).count(), 3)
+
+    def test_unacknowledged_entries_are_replayed(self):
+        """A consumer that read a batch and died before XACK loses nothing"""
+        async def scenario():
+            await self.persister().ensure_group()
+            await self.enqueue(self.entry('Before the crash'), self.entry('Also before'))
+            await self.redis.xreadgroup(GROUP, 'crashed-node', {STREAM_KEY: '>'}, count=10)
+
+            handled = await self.persister('node-b', claim_idle_ms=0).recover()
+            return handled, (await self.redis.xpending(STREAM_KEY, GROUP))['pending']
+
+        handled, pending = asyncio.run(scenario())
+
+        self.assertEqual((handled, pending), (2, 0))
+        self.assertEqual(
+            set(Message.objects.values_list('content', flat=True)), {'Before the crash', 'Also before'}
+        )
+
+    def test_bad_entry_is_dead_lettered(self):
+        async def scenario():
+            persister = self.persister()
+            await persister.ensure_group()
+            await self.enqueue(self.entry('Fine'), self.entry('Orphan', conversation_id=999999))
+            await persister.step()
+            return await self.redis.xrange(DEAD_LETTER_KEY), await self.redis.xlen(STREAM_KEY)
+
+        dead, remaining = asyncio.run(scenario())
+
+        self.assertEqual(remaining, 0)
+        self.assertEqual([fields['content'] for _, fields in dead], ['Orphan'])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['Fine'])
@@ -0,0 +1,102 @@
+"""Typing indicator coalescing for the chat servers.
+
+Clients send typing events as often as they like. Per (conversation, user)
+the server forwards at most one state change per TYPING_INTERVAL and ends
+"is typing" itself after TYPING_TIMEOUT without a refresh, so a client that
+disconnects or goes quiet never leaves the indicator on. Everything lives in
+process memory: a typing event costs a dict lookup, and broadcasts per
+conversation are bounded by the interval however chatty the clients are.
+
+Before updating, the servers drop events for conversations the socket has
+not joined or posted to, and typing starts beyond realtime.TYPING_LIMIT per
+user, so one client cannot grow the state without bound.
+"""
+import time
+
+TYPING_INTERVAL = 1.0  # seconds between broadcasts for one (conversation, user)
+TYPING_TIMEOUT = 5.0   # seconds without a typing event before it is switched off
+SWEEP_INTERVAL = 0.5   # how often servers call sweep()
+
+
+class TypingState:
+    __slots__ = ('username', 'sid', 'wanted', 'sent', 'sent_at', 'expires_at')
+
+    def __init__(self, username, sid):
+        self.username = username
+        self.sid = sid
+        self.wanted = False
+        self.sent = False
+        self.sent_at = float('-inf')
+        self.expires_at = 0.0
+
+
+class TypingCoalescer:
+    """Decides which user_typing events to broadcast.
+
+    update() and sweep() return (conversation_id, sid, payload) tuples to emit
+    to the conversation room, skipping sid.
+    """
+
+    def __init__(self, interval=TYPING_INTERVAL, timeout=TYPING_TIMEOUT, clock=time.monotonic):
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock
+        self.states = {}
+        self.user_conversations = {}
+
+    def update(self, conversation_id, user_id, username, sid, is_typing):
+        now = self.clock()
+        key = (conversation_id, user_id)
+        state = self.states.get(key)
+        if state is None:
+            if not is_typing:
+                return []
+            state = self.states[key] = TypingState(username, sid)
+            self.user_conversations.setdefault(user_id, set()).add(conversation_id)
+        state.sid = sid
+        state.wanted = bool(is_typing)
+        if is_typing:
+            state.expires_at = now + self.timeout
+        return self._flush(key, state, now)
+
+    def sweep(self):
+        """Expire stale indicators and send changes held back by the interval"""
+        now = self.clock()
+        events = []
+        for key, state in list(self.states.items()):
+            if state.wanted and now >= state.expires_at:
+                state.wanted = False
+            events.extend(self._flush(key, state, now))
+        return events
+
+    def drop_user(self, user_id):
+        """Switch off a user's indicators at once (their last socket closed)"""
+        events = []
+        for conversation_id in list(self.user_conversations.get(user_id, ())):
+            key = (conversation_id, user_id)
+            state = self.states[key]
+            state.wanted = False
+            state.sent_at = float('-inf')
+            events.extend(self._flush(key, state, self.clock()))
+        return events
+
+    def _flush(self, key, state, now):
+        events = []
+        if state.wanted != state.sent and now - state.sent_at >= self.interval:
+            state.sent = state.wanted
+            state.sent_at = now
+            conversation_id, user_id = key
+            events.append((conversation_id, state.sid, {
+                'conversation_id': conversation_id,
+                'user_id': user_id,
+                'username': state.username,
+                'is_typing': state.sent
+            }))
+        if not state.wanted and not state.sent:
+            del self.states[key]
+            conversation_id, user_id = key
+            conversations = self.user_conversations[user_id]
+            conversations.discard(conversation_id)
+            if not conversations:
+                del self.user_conversations[user_id]
+        return events
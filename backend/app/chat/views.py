@@ -5,12 +5,23 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.authentication import TokenAuthentication, BaseAuthentication
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q
-from django.core.paginator import Paginator
 from django.utils import timezone
 from authentication.models import CustomUser
-from .models import Conversation, Message, MessageAttachment, ConversationContext
+from .models import Conversation, Message, MessageAttachment, ConversationContext, AttachmentUpload
 from .serializers import ConversationSerializer, MessageSerializer, ConversationCreateSerializer, UserSerializer, MessageAttachmentSerializer
+from .realtime import mark_conversation_read, emit_external, conversation_room
+from .last_message import flush as flush_last_message_at
+from .history import page_before, sync_payload
+from .search import search_messages, highlight
+from .presence import presence
+from .attachments import (
+    CHUNK_SIZE, MAX_UPLOAD_SIZE, UploadOffsetMismatch, append_chunk, attach_upload, attachment_response,
+    file_type_for, schedule_processing
+)
 import jwt
 from django.conf import settings
 import mimetypes
@@ -23,10 +34,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        query = Q(vendor=user) | Q(customer=user)
-        return Conversation.objects.filter(query).select_related(
-            'vendor', 'customer'
-        ).prefetch_related('messages').order_by('-last_message_at')
+        if self.action not in ('list', 'retrieve'):
+            # Detail actions only need the participant check
+            return Conversation.objects.filter(Q(vendor=user) | Q(customer=user)).select_related('vendor', 'customer')
+        # Apply coalesced last_message_at updates so ordering is current
+        flush_last_message_at()
+        return Conversation.objects.for_inbox(user).order_by('-last_message_at')
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -35,45 +48,58 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
+        """Newest page of messages; pass ?before=<next_cursor> for older pages"""
         conversation = self.get_object()
-        page = int(request.GET.get('page', 1))
-        page_size = 50
-        
-        messages = conversation.messages.select_related('sender').order_by('-created_at')
-        paginator = Paginator(messages, page_size)
-        page_obj = paginator.get_page(page)
+        try:
+            messages, next_cursor = page_before(conversation, request.GET.get('before'))
+        except ValueError:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = MessageSerializer(list(reversed(page_obj.object_list)), many=True)
+        serializer = MessageSerializer(messages, many=True)
         return Response({
             'results': serializer.data,
-            'has_next': page_obj.has_next(),
-            'has_previous': page_obj.has_previous(),
-            'total_pages': paginator.num_pages
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor
         })
     
+    @action(detail=True, methods=['get'], url_path='messages/since')
+    def messages_since(self, request, pk=None):
+        """Messages after ?after=<message_id>, for clients catching up after a reconnect"""
+        conversation = self.get_object()
+        after = request.GET.get('after')
+        if not after:
+            return Response({'error': 'after is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        payload = sync_payload(conversation.id, after)
+        if payload['reset']:
+            return Response({'error': 'Unknown message', 'reset': True}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payload)
+    
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         conversation = self.get_object()
-        user = request.user
-        
-        # Mark messages from other user as read
-        other_user = conversation.get_other_user(user)
-        messages = Message.objects.filter(
-            conversation=conversation,
-            sender=other_user,
-            status__in=['sent', 'delivered']
-        )
         
-        updated_count = 0
-        for message in messages:
-            message.mark_read()
-            updated_count += 1
+        # Mark messages from other user as read in one statement
+        receipt = mark_conversation_read(conversation, request.user)
+        if receipt:
+            emit_external('messages_read', receipt, room=conversation_room(conversation.id))
         
         return Response({
             'status': 'success',
-            'marked_read': updated_count
+            'marked_read': receipt['count'] if receipt else 0,
+            'up_to_id': receipt['up_to_id'] if receipt else None
         })
     
+    @action(detail=False, methods=['get'], url_path='presence')
+    def peer_presence(self, request):
+        """Online status and last seen of the other participant of every conversation"""
+        user = request.user
+        peers = {
+            customer_id if vendor_id == user.id else vendor_id
+            for vendor_id, customer_id in self.get_queryset().values_list('vendor_id', 'customer_id')
+        }
+        return Response({'users': presence.statuses(sorted(peers))})
+    
     @action(detail=False, methods=['get'])
     def search(self, request):
         """Search messages across all conversations"""
@@ -82,17 +108,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response({'results': []})
         
         user = request.user
-        conversations = self.get_queryset()
-        
-        messages = Message.objects.filter(
-            conversation__in=conversations,
-            content__icontains=query
-        ).select_related('sender', 'conversation').order_by('-created_at')[:50]
-        
         results = []
-        for message in messages:
+        for message, snippet, rank in search_messages(user, query):
             results.append({
                 'message': MessageSerializer(message).data,
+                'snippet': highlight(snippet),
+                'rank': rank,
                 'conversation': {
                     'id': message.conversation.id,
                     'other_user': UserSerializer(message.conversation.get_other_user(user)).data
@@ -195,6 +216,61 @@ class MessageAttachmentViewSet(viewsets.ModelViewSet):
                 Q(vendor=user) | Q(customer=user)
             )
         ).select_related('message')
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The file itself; honours Range so clients can resume or seek"""
+        attachment = self.get_object()
+        return attachment_response(attachment, request.META.get('HTTP_RANGE'))
+    
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def create_upload(self, request):
+        """Start a resumable upload; chunks are then PUT to uploads/<upload_id>/"""
+        file_name = os.path.basename(str(request.data.get('file_name', ''))).strip()
+        mime_type = request.data.get('mime_type') or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        try:
+            total_size = int(request.data.get('total_size'))
+        except (TypeError, ValueError):
+            total_size = -1
+        if not file_name or not 0 < total_size <= MAX_UPLOAD_SIZE:
+            return Response({'error': 'file_name and a valid total_size are required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        upload = AttachmentUpload.objects.create(
+            user=request.user, file_name=file_name, mime_type=mime_type, total_size=total_size
+        )
+        return Response({
+            'upload_id': str(upload.upload_id),
+            'offset': 0,
+            'total_size': total_size,
+            'chunk_size': CHUNK_SIZE
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get', 'put'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)')
+    def upload_chunk(self, request, upload_id=None):
+        """GET reports the offset to resume from; PUT appends the body at the Upload-Offset header"""
+        with transaction.atomic():
+            try:
+                # Locked so two retries of one chunk cannot interleave
+                upload = AttachmentUpload.objects.select_for_update().get(upload_id=upload_id, user=request.user)
+            except (AttachmentUpload.DoesNotExist, ValidationError):
+                return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+            
+            if request.method == 'PUT':
+                try:
+                    offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+                    length = int(request.META.get('CONTENT_LENGTH') or 0)
+                    append_chunk(upload, request.stream, offset, length)
+                except UploadOffsetMismatch as e:
+                    return Response({'error': str(e), 'offset': e.expected}, status=status.HTTP_409_CONFLICT)
+                except ValueError as e:
+                    return Response({'error': str(e), 'offset': upload.offset}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'upload_id': str(upload.upload_id),
+            'offset': upload.offset,
+            'total_size': upload.total_size,
+            'complete': upload.is_complete
+        })
 
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
@@ -212,30 +288,33 @@ class MessageViewSet(viewsets.ModelViewSet):
         ).select_related('sender', 'conversation').prefetch_related('attachments').order_by('-created_at')
     
     def perform_create(self, serializer):
+        # Large files were sent beforehand as resumable uploads
+        try:
+            uploads = [
+                upload for upload in AttachmentUpload.objects.filter(
+                    upload_id__in=self.request.data.getlist('upload_ids'), user=self.request.user
+                ) if upload.is_complete
+            ]
+        except ValidationError:
+            raise DRFValidationError({'upload_ids': 'Invalid upload id'})
+        
         message = serializer.save(sender=self.request.user, status='sent')
         
-        # Handle file attachments
+        # Small files come with the request; thumbnails and hashes are made after commit
         files = self.request.FILES.getlist('files')
         for file in files:
-            file_type = self.get_file_type(file.content_type)
-            MessageAttachment.objects.create(
+            attachment = MessageAttachment.objects.create(
                 message=message,
                 file=file,
                 file_name=file.name,
                 file_size=file.size,
-                file_type=file_type,
+                file_type=file_type_for(file.content_type),
                 mime_type=file.content_type
             )
-    
-    def get_file_type(self, mime_type):
-        if mime_type.startswith('image/'):
-            return 'image'
-        elif mime_type.startswith('video/'):
-            return 'video'
-        elif mime_type.startswith('audio/'):
-            return 'audio'
-        else:
-            return 'document'
+            schedule_processing(attachment)
+        
+        for upload in uploads:
+            attach_upload(upload, message)
     
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -0,0 +1,134 @@
+"""Wire encodings of the new_message event.
+
+The default encoding is the JSON dict from realtime.message_payload: long key
+names, an ISO timestamp and the message UUID as text on every event. Clients
+may opt in to a compact encoding at connect, with auth {'encoding': 'msgpack'}
+or ?encoding=msgpack. The chat servers answer with the negotiated encoding in
+the connected event, and new_message then arrives as one msgpack binary
+attachment:
+
+    {'i': id, 'm': uuid bytes, 'c': conversation_id, 's': sender_id,
+     'u': sender_username, 'k': sender_type, 'b': content,
+     't': created_at in epoch milliseconds, 'x': status, 'p': temp_id}
+
+Keys with no value are left out. Every other event stays JSON.
+
+Each encoding is built and broadcast at most once per message. Sockets join
+message_room(conversation_id, encoding) next to the conversation room, so each
+socket receives new_message in exactly one encoding. EncodingRooms counts the
+local sockets per (conversation, encoding), and a broadcast skips encodings
+no local socket in the conversation takes, e.g. the msgpack body while nobody
+has opted in. In a cluster the other nodes' sockets are not counted, so every
+encoding is sent.
+"""
+import collections
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import parse_qs
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - compact mode is unavailable without it
+    msgpack = None
+
+from .realtime import conversation_room, message_payload
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+ENCODINGS = (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+COMPACT_KEYS = {
+    'id': 'i',
+    'message_id': 'm',
+    'conversation_id': 'c',
+    'sender_id': 's',
+    'sender_username': 'u',
+    'sender_type': 'k',
+    'content': 'b',
+    'created_at': 't',
+    'status': 'x',
+    'temp_id': 'p'
+}
+FULL_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+
+
+def negotiate(environ, auth):
+    """The encoding a connecting client asked for, if this server can speak it"""
+    requested = None
+    if auth and isinstance(auth, dict):
+        requested = auth.get('encoding')
+    if not requested:
+        requested = parse_qs(environ.get('QUERY_STRING', '')).get('encoding', [None])[0]
+    return requested if requested in ENCODINGS else JSON
+
+
+def message_room(conversation_id, encoding):
+    return f'{conversation_room(conversation_id)}:{encoding}'
+
+
+class EncodingRooms:
+    """Local sockets per (conversation, encoding), kept from join to disconnect"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.joined = {}
+
+    def join(self, sid, conversation_id, encoding):
+        rooms = self.joined.setdefault(sid, set())
+        if (conversation_id, encoding) not in rooms:
+            rooms.add((conversation_id, encoding))
+            self.counts[(conversation_id, encoding)] += 1
+
+    def leave_all(self, sid):
+        for key in self.joined.pop(sid, ()):
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def encodings(self, conversation_id):
+        """The encodings at least one local socket in the conversation receives"""
+        return tuple(encoding for encoding in ENCODINGS if self.counts[(conversation_id, encoding)])
+
+
+def _uuid_bytes(value):
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError):
+        return value
+
+
+def compact_message(message, sender, conversation_id, temp_id=None):
+    """The msgpack new_message body; sender is a user_profile dict"""
+    fields = {
+        'i': message.id,
+        'm': _uuid_bytes(message.message_id),
+        'c': conversation_id,
+        's': sender['id'],
+        'u': sender['username'],
+        'k': sender['user_type'],
+        'b': message.content,
+        't': int(message.created_at.timestamp() * 1000),
+        'x': message.status,
+        'p': temp_id
+    }
+    return msgpack.packb({key: value for key, value in fields.items() if value is not None}, use_bin_type=True)
+
+
+def expand_message(data):
+    """The message_payload dict for a compact new_message body"""
+    fields = msgpack.unpackb(data, raw=False)
+    payload = {key: None for key in COMPACT_KEYS}
+    payload.update((FULL_KEYS[short], value) for short, value in fields.items() if short in FULL_KEYS)
+    if isinstance(payload['message_id'], bytes):
+        payload['message_id'] = str(uuid.UUID(bytes=payload['message_id']))
+    if payload['created_at'] is not None:
+        payload['created_at'] = datetime.fromtimestamp(payload['created_at'] / 1000, dt_timezone.utc).isoformat()
+    return payload
+
+
+def encoded_messages(message, sender, conversation_id, temp_id=None, encodings=ENCODINGS):
+    """(room, body) for each of encodings of one new_message broadcast"""
+    if MSGPACK in encodings:
+        yield message_room(conversation_id, MSGPACK), compact_message(message, sender, conversation_id, temp_id)
+    if JSON in encodings:
+        yield message_room(conversation_id, JSON), message_payload(message, sender, conversation_id, temp_id)
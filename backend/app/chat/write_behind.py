@@ -0,0 +1,264 @@
+"""Write-behind persistence for chat messages.
+
+In write-behind mode the asyncio chat server assigns the message_id, appends
+the message to the chat:messages Redis Stream and broadcasts it with status
+'sending' without touching the database. MessagePersister reads the stream
+through a consumer group, saves each batch with one bulk_create and sends a
+message_ack event to the sender once the rows exist (status 'sent').
+
+Entries are acknowledged (XACK) only after they are saved. A persister that
+starts up first replays its own pending entries, then claims entries another
+consumer read but never acknowledged for CLAIM_IDLE_MS, so a node that
+crashes mid-batch loses nothing. Inserts skip message_ids that already exist,
+which makes a replayed batch harmless.
+"""
+import logging
+import time
+import uuid
+
+import redis
+from django.db import DataError, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from authentication.models import CustomUser
+from .models import Message, ConversationContext
+from . import last_message
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'chat:messages'
+DEAD_LETTER_KEY = 'chat:messages:dead'
+GROUP = 'chat-persisters'
+BATCH_SIZE = 500
+BLOCK_MS = 1000
+CLAIM_IDLE_MS = 30000
+CLAIM_INTERVAL = 15  # seconds between checks for abandoned entries
+
+# Errors caused by an entry itself; anything else (e.g. the database being
+# down) leaves the batch pending for a retry
+ENTRY_ERRORS = (IntegrityError, DataError, KeyError, ValueError)
+
+
+def pending_message(conversation_id, sender_id, content):
+    """An unsaved message with the id and timestamp the broadcast will carry"""
+    return Message(
+        message_id=str(uuid.uuid4()),
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        content=content,
+        status='sending',
+        created_at=timezone.now()
+    )
+
+
+def stream_entry(message, sender, recipient_id, temp_id=None):
+    """Stream fields for an unsaved message; sender is a user_profile dict"""
+    return {
+        'message_id': message.message_id,
+        'conversation_id': message.conversation_id,
+        'sender_id': sender['id'],
+        'sender_username': sender['username'],
+        'recipient_id': recipient_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'temp_id': temp_id or ''
+    }
+
+
+def persist_batch(entries):
+    """Save a batch of stream entries; returns the message_ack body for each message
+
+    Messages already in the database (a replayed batch) are acknowledged again
+    but not re-inserted or re-notified.
+    """
+    by_message_id = {entry['message_id']: entry for entry in entries}
+    existing = set(
+        Message.objects.filter(message_id__in=by_message_id).values_list('message_id', flat=True)
+    )
+    new_entries = [entry for message_id, entry in by_message_id.items() if message_id not in existing]
+
+    Message.objects.bulk_create([
+        Message(
+            message_id=entry['message_id'],
+            conversation_id=int(entry['conversation_id']),
+            sender_id=int(entry['sender_id']),
+            content=entry['content'],
+            status='sent',
+            created_at=parse_datetime(entry['created_at'])
+        )
+        for entry in new_entries
+    ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    saved = Message.objects.filter(message_id__in=by_message_id).values(
+        'id', 'message_id', 'conversation_id', 'sender_id', 'created_at'
+    )
+    acks = []
+    newest = {}
+    for row in saved:
+        entry = by_message_id[row['message_id']]
+        acks.append({
+            'id': row['id'],
+            'message_id': row['message_id'],
+            'conversation_id': row['conversation_id'],
+            'sender_id': row['sender_id'],
+            'temp_id': entry['temp_id'] or None,
+            'status': 'sent',
+            'created_at': row['created_at'].isoformat()
+        })
+        if row['message_id'] not in existing:
+            conversation_id = row['conversation_id']
+            if conversation_id not in newest or newest[conversation_id] < row['created_at']:
+                newest[conversation_id] = row['created_at']
+
+    # bulk_create skips Message.save, so record last_message_at here
+    for conversation_id, value in newest.items():
+        last_message.record(conversation_id, value)
+
+    if new_entries:
+        _notify_batch(new_entries)
+    return acks
+
+
+def _notify_batch(entries):
+    """One new_message notification per saved message, with a fixed number of queries"""
+    from notifications.services import NotificationService
+
+    recipients = CustomUser.objects.in_bulk({int(entry['recipient_id']) for entry in entries})
+    event_titles = dict(
+        ConversationContext.objects.filter(
+            conversation_id__in={int(entry['conversation_id']) for entry in entries}
+        ).values_list('conversation_id', 'event_title')
+    )
+    notifications = []
+    for entry in entries:
+        recipient = recipients.get(int(entry['recipient_id']))
+        if recipient is None:
+            continue
+        conversation_id = int(entry['conversation_id'])
+        notifications.append({
+            'recipient': recipient,
+            'context': {
+                'sender_name': entry['sender_username'],
+                'event_type': event_titles.get(conversation_id) or 'your event',
+                'conversation_id': conversation_id
+            },
+            'related_object_id': conversation_id
+        })
+    try:
+        NotificationService.create_notifications_bulk(
+            'new_message', notifications, related_object_type='conversation'
+        )
+    except Exception as e:
+        logger.error(f"Message notification error: {e}")
+
+
+class MessagePersister:
+    """Drains the message stream into the database as one consumer of GROUP.
+
+    redis_client is a redis.asyncio client with decode_responses=True;
+    run_db(func, *args) runs a blocking ORM call and returns its result;
+    on_persisted(acks) is awaited after each saved batch.
+    """
+
+    def __init__(self, redis_client, run_db, on_persisted, consumer, stream=STREAM_KEY,
+                 batch_size=BATCH_SIZE, block_ms=BLOCK_MS, claim_idle_ms=CLAIM_IDLE_MS):
+        self.redis = redis_client
+        self.stream = stream
+        self.run_db = run_db
+        self.on_persisted = on_persisted
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def process(self, entries):
+        """Persist and acknowledge (stream_id, fields) pairs; returns how many were handled"""
+        if not entries:
+            return 0
+        stream_ids = [stream_id for stream_id, _ in entries]
+        # Pending entries deleted from the stream come back without fields
+        entries = [(stream_id, fields) for stream_id, fields in entries if fields]
+        try:
+            acks = await self.run_db(persist_batch, [fields for _, fields in entries]) if entries else []
+        except ENTRY_ERRORS as e:
+            logger.error(f"Batch of {len(entries)} messages failed, retrying one by one: {e}")
+            acks = await self._process_singly(entries)
+        if acks:
+            await self.on_persisted(acks)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            await pipe.xack(self.stream, GROUP, *stream_ids).xdel(self.stream, *stream_ids).execute()
+        return len(entries)
+
+    async def _process_singly(self, entries):
+        # A bad entry (e.g. its conversation was deleted) must not hold back the batch
+        acks = []
+        for stream_id, fields in entries:
+            try:
+                acks.extend(await self.run_db(persist_batch, [fields]))
+            except ENTRY_ERRORS as e:
+                logger.error(f"Message {fields.get('message_id')} moved to {DEAD_LETTER_KEY}: {e}")
+                await self.redis.xadd(DEAD_LETTER_KEY, dict(fields, error=str(e)[:200]))
+        return acks
+
+    async def read_pending(self):
+        """Replay entries this consumer read before a restart"""
+        handled = 0
+        while True:
+            response = await self.redis.xreadgroup(
+                GROUP, self.consumer, {self.stream: '0'}, count=self.batch_size
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                return handled
+            handled += await self.process(entries)
+
+    async def claim_abandoned(self):
+        """Take over entries other consumers read but never acknowledged"""
+        handled = 0
+        start_id = '0-0'
+        while True:
+            response = await self.redis.xautoclaim(
+                self.stream, GROUP, self.consumer, self.claim_idle_ms, start_id=start_id, count=self.batch_size
+            )
+            start_id, entries = response[0], response[1]
+            handled += await self.process(entries)
+            if start_id == '0-0':
+                return handled
+
+    async def recover(self):
+        await self.ensure_group()
+        return await self.read_pending() + await self.claim_abandoned()
+
+    async def step(self):
+        """Read and persist one batch of new entries; returns how many were handled"""
+        response = await self.redis.xreadgroup(
+            GROUP, self.consumer, {self.stream: '>'}, count=self.batch_size, block=self.block_ms
+        )
+        if not response:
+            return 0
+        return await self.process(response[0][1])
+
+    async def run(self, sleep):
+        """Persist until cancelled; sleep is the server's async sleep"""
+        last_claim = None
+        while True:
+            try:
+                if last_claim is None:
+                    await self.recover()
+                    last_claim = time.monotonic()
+                elif time.monotonic() - last_claim >= CLAIM_INTERVAL:
+                    await self.claim_abandoned()
+                    last_claim = time.monotonic()
+                await self.step()
+            except Exception as e:
+                # Unacknowledged entries stay pending and are replayed later
+                logger.error(f"Message persister error: {e}")
+                await sleep(1)
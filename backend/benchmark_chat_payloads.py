@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Compare the wire encodings of the new_message event (app.chat.wire).
+
+json:     the message_payload dict, one Socket.IO text frame
+msgpack:  the compact body, a text header frame plus one binary frame
+
+For each encoding reports the bytes a recipient receives per message, as
+WebSocket payload without and with permessage-deflate (one compression context
+per connection, as browsers negotiate it), and the CPU time per broadcast:
+building the body and encoding the Socket.IO packet, done once per message,
+plus compressing it, done once per recipient socket.
+
+Needs no database or Redis: the messages are unsaved.
+
+Usage: python benchmark_chat_payloads.py [--messages 5000] [--seed 1]
+"""
+import os
+import sys
+import argparse
+import random
+import time
+import zlib
+
+import django
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'partyoria.settings')
+django.setup()
+
+from socketio import packet
+
+from app.chat.realtime import message_payload
+from app.chat.wire import JSON, MSGPACK, ENCODINGS, compact_message
+from app.chat.write_behind import pending_message
+
+SAMPLE_LINES = [
+    'Hi!',
+    'Is the venue available on the 14th?',
+    'Yes, we still have the garden hall free that evening.',
+    'Great, can you send me a quote for 150 guests with vegetarian catering?',
+    'Sure. I will include decoration and the sound system as discussed, and we can adjust the menu later.',
+    'Thanks',
+    'What time can the setup team arrive?',
+    'Perfect, see you then!'
+]
+
+ENCODERS = {
+    JSON: message_payload,
+    MSGPACK: compact_message
+}
+
+
+def make_messages(count, seed):
+    rng = random.Random(seed)
+    senders = [
+        {'id': 1041, 'username': 'sunrise_events_decor', 'user_type': 'vendor'},
+        {'id': 2213, 'username': 'priya.sharma', 'user_type': 'customer'}
+    ]
+    messages = []
+    for i in range(count):
+        message = pending_message(9120, 0, rng.choice(SAMPLE_LINES))
+        message.id = 1_500_000 + i
+        message.status = 'sent'
+        messages.append((message, senders[i % 2], f'tmp-{i}' if i % 2 else None))
+    return messages
+
+
+def frames(body):
+    """WebSocket message payloads of one new_message event (engine.io prefixes included)"""
+    encoded = packet.Packet(packet.EVENT, data=['new_message', body], namespace='/').encode()
+    if isinstance(encoded, list):
+        header, *attachments = encoded
+        return [b'4' + header.encode()] + attachments
+    return [b'4' + encoded.encode()]
+
+
+def deflated_size(compressor, frame):
+    # permessage-deflate drops the 4-byte empty block that ends every sync flush
+    return len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def bench(encoding, messages):
+    encode = ENCODERS[encoding]
+    started = time.process_time()
+    encoded = [frames(encode(message, sender, message.conversation_id, temp_id)) for message, sender, temp_id in messages]
+    encode_seconds = time.process_time() - started
+
+    raw = sum(len(frame) for event in encoded for frame in event)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    started = time.process_time()
+    deflated = sum(deflated_size(compressor, frame) for event in encoded for frame in event)
+    deflate_seconds = time.process_time() - started
+
+    count = len(messages)
+    return {
+        'encoding': encoding,
+        'frames': len(encoded[0]),
+        'bytes': raw / count,
+        'deflated_bytes': deflated / count,
+        'encode_us': encode_seconds / count * 1e6,
+        'deflate_us': deflate_seconds / count * 1e6
+    }
+
+
+def print_results(results):
+    print(f"{'encoding':<10}{'frames':>8}{'bytes/msg':>12}{'deflated':>12}{'encode us':>12}{'deflate us':>12}")
+    for row in results:
+        print(f"{row['encoding']:<10}{row['frames']:>8}{row['bytes']:>12.1f}{row['deflated_bytes']:>12.1f}"
+              f"{row['encode_us']:>12.2f}{row['deflate_us']:>12.2f}")
+    baseline = results[0]
+    for row in results[1:]:
+        print(f"{row['encoding']} vs {baseline['encoding']}: "
+              f"{row['bytes'] / baseline['bytes']:.0%} of the bytes, "
+              f"{row['deflated_bytes'] / baseline['deflated_bytes']:.0%} with deflate, "
+              f"{row['encode_us'] / baseline['encode_us']:.0%} of the encode CPU")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    messages = make_messages(args.messages, args.seed)
+    print_results([bench(encoding, messages) for encoding in ENCODINGS])
+
+
+if __name__ == '__main__':
+    main()
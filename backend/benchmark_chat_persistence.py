@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Compare the two ways the asyncio chat server can save messages.
+
+direct:        send_message inserts each message before broadcasting it
+write-behind:  send_message appends to the Redis Stream; MessagePersister
+               saves the stream in batches (CHAT_WRITE_BEHIND=1)
+
+Reports per-message latency on the send path and overall messages per second.
+Uses REDIS_URL, or an in-process fake Redis with --fake-redis. The benchmark
+users and everything they create are deleted afterwards.
+
+Usage: python benchmark_chat_persistence.py [--messages 2000] [--batch-size 500] [--fake-redis]
+"""
+import os
+import sys
+import argparse
+import asyncio
+import statistics
+import time
+
+import django
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'partyoria.settings')
+django.setup()
+
+# The persister's ORM calls run on the loop thread here so timings exclude executor hand-offs
+os.environ.setdefault('DJANGO_ALLOW_ASYNC_UNSAFE', 'true')
+
+from decouple import config
+from django.contrib.auth import get_user_model
+
+from app.chat.models import Conversation
+from app.chat.realtime import user_profile, create_message
+from app.chat.write_behind import MessagePersister, pending_message, stream_entry
+from app.chat import last_message
+
+User = get_user_model()
+
+# Kept apart from the live chat:messages stream
+BENCH_STREAM = 'chat:messages:benchmark'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(name, latencies, total_seconds, count):
+    return {
+        'mode': name,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'msgs_per_sec': count / total_seconds
+    }
+
+
+def bench_direct(conversation, sender, count):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        create_message(conversation.id, sender.id, f'direct {i}', defer_notification=True)
+        latencies.append(time.perf_counter() - t0)
+    last_message.flush()
+    return summarize('direct', latencies, time.perf_counter() - started, count)
+
+
+async def bench_write_behind(redis_client, conversation, sender, recipient, count, batch_size):
+    async def run_inline(func, *args):
+        return func(*args)
+
+    async def on_persisted(acks):
+        pass
+
+    persister = MessagePersister(
+        redis_client, run_inline, on_persisted, 'benchmark', stream=BENCH_STREAM, batch_size=batch_size, block_ms=1
+    )
+    await persister.ensure_group()
+    profile = user_profile(sender)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        message = pending_message(conversation.id, sender.id, f'write-behind {i}')
+        await redis_client.xadd(BENCH_STREAM, stream_entry(message, profile, recipient.id))
+        latencies.append(time.perf_counter() - t0)
+    enqueued = time.perf_counter()
+
+    while await redis_client.xlen(BENCH_STREAM):
+        await persister.step()
+    last_message.flush()
+    finished = time.perf_counter()
+
+    result = summarize('write-behind (send path)', latencies, enqueued - started, count)
+    drained = {
+        'mode': 'write-behind (persisted)',
+        'p50_ms': None,
+        'p99_ms': None,
+        'msgs_per_sec': count / (finished - started)
+    }
+    return [result, drained]
+
+
+def make_redis(fake):
+    if fake:
+        import fakeredis
+        return fakeredis.aioredis.FakeRedis(decode_responses=True)
+    import redis.asyncio as aioredis
+    return aioredis.from_url(config('REDIS_URL', default='redis://localhost:6379/0'), decode_responses=True)
+
+
+def print_results(results):
+    print(f"{'mode':<28}{'p50 ms':>10}{'p99 ms':>10}{'msgs/s':>12}")
+    for row in results:
+        p50 = f"{row['p50_ms']:.3f}" if row['p50_ms'] is not None else '-'
+        p99 = f"{row['p99_ms']:.3f}" if row['p99_ms'] is not None else '-'
+        print(f"{row['mode']:<28}{p50:>10}{p99:>10}{row['msgs_per_sec']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--fake-redis', action='store_true', help='use an in-process fake Redis')
+    args = parser.parse_args(argv)
+
+    sender = User.objects.create_user(username='bench_chat_vendor', password='bench', user_type='vendor')
+    recipient = User.objects.create_user(username='bench_chat_customer', password='bench', user_type='customer')
+    try:
+        conversation = Conversation.objects.create(vendor=sender, customer=recipient)
+        results = [bench_direct(conversation, sender, args.messages)]
+
+        async def write_behind():
+            redis_client = make_redis(args.fake_redis)
+            try:
+                return await bench_write_behind(
+                    redis_client, conversation, sender, recipient, args.messages, args.batch_size
+                )
+            finally:
+                await redis_client.delete(BENCH_STREAM)
+                await redis_client.aclose()
+
+        results.extend(asyncio.run(write_behind()))
+    finally:
+        # Cascades to the conversation, its messages and the notifications
+        User.objects.filter(id__in=[sender.id, recipient.id]).delete()
+
+    print(f"=== Chat persistence: {args.messages} messages, batch size {args.batch_size} ===")
+    print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,33 @@
 import os
+import socket
 import django
 import socketio
-import jwt
-from datetime import datetime
 import logging
 import redis
 import json
+from decouple import config
 
 # Setup Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'partyoria.settings')
 django.setup()
 
-from app.chat.models import Conversation, Message
+from app.chat import last_message, receipts
+from app.chat.connections import LocalConnectionRegistry
+from app.chat.db_pool import DB_THREADS, METRICS_INTERVAL, METRICS_TTL, GreenDBPool, metrics_key
+from app.chat.history import sync_payload
+from app.chat.presence import PresenceService, PRESENCE_TTL
+from app.chat.push import PUSH_QUEUE
+from app.chat.signals import INVALIDATION_CHANNEL
+from app.chat.typing import TypingCoalescer, SWEEP_INTERVAL
+from app.chat.wire import EncodingRooms, encoded_messages, message_room, negotiate
+from partyoria.rate_limiting import limiter, local_buckets
+from app.chat.realtime import (
+    MAX_CONNECTIONS_PER_USER, MAX_MESSAGE_LENGTH, MESSAGE_LIMIT, TYPING_LIMIT,
+    user_room, conversation_room, extract_token, authenticate_user, load_participant,
+    mark_conversation_read, user_profile, create_message, notify_message, push_payload,
+    EXTERNAL_EMIT_QUEUE, EXTERNAL_EMIT_POLL, EXTERNAL_EMIT_BATCH, queued_emits
+)
 from authentication.models import CustomUser
-from django.conf import settings
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -21,13 +35,25 @@ logger = logging.getLogger(__name__)
 
 # Redis connection
 try:
-    redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    redis_client = redis.Redis.from_url(config('REDIS_URL', default='redis://localhost:6379/0'), decode_responses=True)
     redis_client.ping()
     logger.info("Redis connected successfully")
 except:
     redis_client = None
     logger.warning("Redis not available - running without caching")
 
+CHAT_NODE_NAME = config('CHAT_NODE_NAME', default=f'{socket.gethostname()}-{os.getpid()}')
+
+# Seconds between checks for cache invalidations; a blocking read would stall the hub
+INVALIDATION_POLL = 0.5
+
+# Blocking ORM work runs on a fixed set of OS threads, each keeping its own DB connection
+db_pool = GreenDBPool(DB_THREADS)
+
+def run_db(func, *args, **kwargs):
+    """Run a blocking ORM function on the database pool; only the calling greenlet waits"""
+    return db_pool.run(func, *args, **kwargs)
+
 # Socket.IO server
 sio = socketio.Server(
     cors_allowed_origins="*",
@@ -37,104 +63,92 @@ sio = socketio.Server(
     ping_interval=25
 )
 
-# Store user connections
-user_connections = {}
+# Store user connections, indexed by sid and by user
+connections = LocalConnectionRegistry()
 
-def authenticate_user(token):
-    """Authenticate user from JWT token"""
-    try:
-        if not token:
+# Typing indicators, coalesced per (conversation, user)
+typing_state = TypingCoalescer()
+
+# Delivery acks, applied every receipts.FLUSH_INTERVAL
+delivery_acks = receipts.DeliveryAcks()
+
+# Wire encodings the sockets in each conversation receive
+encoding_rooms = EncodingRooms()
+
+# Who is online, shared with the other chat processes and the API
+presence = PresenceService(redis_client)
+
+def emit_typing(events):
+    for conversation_id, skip_sid, payload in events:
+        sio.emit('user_typing', payload, room=conversation_room(conversation_id), skip_sid=skip_sid)
+
+def get_session(sid):
+    """The connection's session, reloading the cached profile after an invalidation"""
+    session = sio.get_session(sid)
+    if session.get('user') is None:
+        user = run_db(CustomUser.objects.get, id=connections.user_for(sid))
+        session['user'] = user_profile(user)
+    return session
+
+def authorized_peer(session, conversation_id):
+    """Id of the other participant, or None when the user may not post to the conversation"""
+    conversations = session['conversations']
+    if conversation_id not in conversations:
+        conversation, user = run_db(load_participant, conversation_id, session['user']['id'])
+        if not user:
             return None
-        
-        # Remove 'Bearer ' prefix if present
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        # Decode JWT to check payload first
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            logger.info(f"JWT payload: {payload}")
-            
-            # Get user_id from JWT
-            user_id = payload.get('user_id')
-            if user_id:
-                try:
-                    user = CustomUser.objects.get(id=user_id)
-                    logger.info(f"JWT auth successful for user {user.username} (ID: {user.id}, Type: {user.user_type})")
-                    return user
-                except CustomUser.DoesNotExist:
-                    logger.warning(f"User not found for user_id: {user_id}")
-            
-            logger.warning(f"No valid user found in JWT payload: {payload}")
-                
-        except jwt.ExpiredSignatureError:
-            logger.warning("JWT token expired")
-        except jwt.InvalidTokenError as e:
-            logger.warning(f"JWT invalid: {e}")
-        except Exception as e:
-            logger.warning(f"JWT decode error: {e}")
-        
+        conversations[conversation_id] = conversation.get_other_user(user).id
+    return conversations[conversation_id]
 
-        
-        # Fallback to token auth
-        from rest_framework.authtoken.models import Token
-        try:
-            token_obj = Token.objects.get(key=token)
-            logger.info(f"Token auth successful for user {token_obj.user.username} (ID: {token_obj.user.id})")
-            return token_obj.user
-        except Token.DoesNotExist:
-            logger.warning("Token not found in database")
-        except Exception as e:
-            logger.warning(f"Token auth error: {e}")
-            
-        return None
+def notify_in_background(message_id):
+    try:
+        run_db(notify_message, message_id)
     except Exception as e:
-        logger.error(f"Auth error: {e}")
-        return None
+        logger.error(f"Message notification error: {e}")
+
+def apply_invalidation(event):
+    """Drop cached profiles and conversation grants from this process's sessions"""
+    if event['kind'] == 'user':
+        sids = list(connections.local_sids(event['id']))
+    else:
+        sids = list(connections.sids)
+    for sid in sids:
+        try:
+            session = sio.get_session(sid)
+        except KeyError:
+            continue
+        if event['kind'] == 'user':
+            session['user'] = None
+        elif event['kind'] == 'conversation':
+            session['conversations'].pop(event['id'], None)
 
 @sio.event
 def connect(sid, environ, auth):
     """Handle client connection"""
     try:
-        # Get token from auth parameter or query params
-        token = None
-        
-        if auth and isinstance(auth, dict):
-            token = auth.get('token')
-        
-        if not token:
-            query_string = environ.get('QUERY_STRING', '')
-            if 'token=' in query_string:
-                token = query_string.split('token=')[1].split('&')[0]
-        
-        if not token:
-            headers = environ.get('HTTP_AUTHORIZATION', '')
-            if headers:
-                token = headers
-        
-        user = authenticate_user(token)
+        user = run_db(authenticate_user, extract_token(environ, auth))
         if not user:
             logger.warning(f"Unauthorized connection attempt: {sid}")
             return False
         
         # Check if user already has active connections
-        existing_connections = [s for s, u_id in user_connections.items() if u_id == user.id]
-        if len(existing_connections) >= 2:  # Allow max 2 connections per user
-            logger.warning(f"User {user.username} already has {len(existing_connections)} connections, rejecting")
+        existing_connections = len(connections.local_sids(user.id))
+        if existing_connections >= MAX_CONNECTIONS_PER_USER:
+            logger.warning(f"User {user.username} already has {existing_connections} connections, rejecting")
             return False
         
-        # Store user connection
-        user_connections[sid] = user.id
+        # Store user connection; typing events read the username from the session
+        total_connections = connections.track(sid, user.id)
+        encoding = negotiate(environ, auth)
+        sio.save_session(sid, {'user': user_profile(user), 'conversations': {}, 'encoding': encoding})
         
         # Join user to their personal room
-        sio.enter_room(sid, f'user_{user.id}')
+        sio.enter_room(sid, user_room(user.id))
         
-        # Update online status in Redis
-        if redis_client:
-            redis_client.setex(f'online_{user.id}', 300, '1')  # 5 min expiry
+        presence.heartbeat(user.id)
         
-        logger.info(f"User {user.username} ({user.user_type}) connected: {sid} [Total connections: {len(existing_connections) + 1}]")
-        sio.emit('connected', {'status': 'success', 'user_id': user.id}, room=sid)
+        logger.info(f"User {user.username} ({user.user_type}) connected: {sid} [Total connections: {total_connections}]")
+        sio.emit('connected', {'status': 'success', 'user_id': user.id, 'encoding': encoding}, room=sid)
         
     except Exception as e:
         logger.error(f"Connection error: {e}")
@@ -144,7 +158,7 @@ def connect(sid, environ, auth):
 def join_conversation(sid, data):
     """Join a conversation room"""
     try:
-        user_id = user_connections.get(sid)
+        user_id = connections.user_for(sid)
         if not user_id:
             sio.emit('error', {'message': 'Not authenticated'}, room=sid)
             return
@@ -153,28 +167,25 @@ def join_conversation(sid, data):
         if not conversation_id:
             sio.emit('error', {'message': 'Missing conversation_id'}, room=sid)
             return
+        conversation_id = int(conversation_id)
         
         # Verify user is part of conversation
-        conversation = Conversation.objects.select_related('vendor', 'customer').get(id=conversation_id)
-        user = CustomUser.objects.get(id=user_id)
-        
-        if user not in [conversation.vendor, conversation.customer]:
+        conversation, user = run_db(load_participant, conversation_id, user_id)
+        if not user:
             sio.emit('error', {'message': 'Not authorized'}, room=sid)
             return
+        session = get_session(sid)
+        session['conversations'][conversation_id] = conversation.get_other_user(user).id
         
-        # Join conversation room
-        room_name = f'conv_{conversation_id}'
-        sio.enter_room(sid, room_name)
+        # Join conversation room, and the room new_message arrives in for this socket's encoding
+        sio.enter_room(sid, conversation_room(conversation_id))
+        sio.enter_room(sid, message_room(conversation_id, session['encoding']))
+        encoding_rooms.join(sid, conversation_id, session['encoding'])
         
-        # Mark messages as read
-        other_user = conversation.get_other_user(user)
-        messages = Message.objects.filter(
-            conversation=conversation,
-            sender=other_user,
-            status__in=['sent', 'delivered']
-        )
-        for message in messages:
-            message.mark_read()
+        # Mark messages as read and tell the other side with one receipt
+        receipt = run_db(mark_conversation_read, conversation, user)
+        if receipt:
+            sio.emit('messages_read', receipt, room=conversation_room(conversation_id), skip_sid=sid)
         
         logger.info(f"User {user.username} joined conversation {conversation_id}")
         sio.emit('joined_conversation', {
@@ -190,7 +201,7 @@ def join_conversation(sid, data):
 def send_message(sid, data):
     """Send a message"""
     try:
-        user_id = user_connections.get(sid)
+        user_id = connections.user_for(sid)
         if not user_id:
             sio.emit('error', {'message': 'Not authenticated'}, room=sid)
             return
@@ -202,76 +213,129 @@ def send_message(sid, data):
         if not conversation_id or not content:
             sio.emit('error', {'message': 'Missing data'}, room=sid)
             return
+        conversation_id = int(conversation_id)
         
-        if len(content) > 1000:
+        if len(content) > MAX_MESSAGE_LENGTH:
             sio.emit('error', {'message': 'Message too long'}, room=sid)
             return
         
         # Rate limiting check
-        if redis_client:
-            rate_key = f'rate_{user_id}'
-            current_count = redis_client.get(rate_key) or 0
-            if int(current_count) >= 10:  # 10 messages per minute
-                sio.emit('error', {'message': 'Rate limit exceeded'}, room=sid)
-                return
-            redis_client.incr(rate_key)
-            redis_client.expire(rate_key, 60)
-        
-        # Get conversation and user
-        conversation = Conversation.objects.select_related('vendor', 'customer').get(id=conversation_id)
-        user = CustomUser.objects.get(id=user_id)
-        
-        if user not in [conversation.vendor, conversation.customer]:
+        allowed, _ = limiter.hit(MESSAGE_LIMIT, user_id)
+        if not allowed:
+            sio.emit('error', {'message': 'Rate limit exceeded'}, room=sid)
+            return
+        
+        # Sender profile and conversation access come from the session cache
+        session = get_session(sid)
+        user = session['user']
+        other_user_id = authorized_peer(session, conversation_id)
+        if not other_user_id:
             sio.emit('error', {'message': 'Not authorized'}, room=sid)
             return
         
-        # Create message
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=user,
-            content=content,
-            status='sent'
-        )
-        
-        # Prepare message data
-        message_data = {
-            'id': message.id,
-            'message_id': message.message_id,
-            'conversation_id': conversation_id,
-            'sender_id': user.id,
-            'sender_username': user.username,
-            'sender_type': user.user_type,
-            'content': message.content,
-            'created_at': message.created_at.isoformat(),
-            'status': message.status,
-            'temp_id': temp_id
-        }
-        
-        # Broadcast to conversation room
-        room_name = f'conv_{conversation_id}'
-        sio.emit('new_message', message_data, room=room_name)
+        # Create message; the in-app notification follows the broadcast in the background
+        message = run_db(create_message, conversation_id, user_id, content, defer_notification=True)
+        
+        # Broadcast to conversation room, encoded once per wire encoding a socket receives
+        for room, body in encoded_messages(
+            message, user, conversation_id, temp_id, encoding_rooms.encodings(conversation_id)
+        ):
+            sio.emit('new_message', body, room=room)
+        sio.start_background_task(notify_in_background, message.id)
         
         # Send push notification to offline users
-        other_user = conversation.get_other_user(user)
-        if redis_client and not redis_client.get(f'online_{other_user.id}'):
+        if redis_client and not connections.local_sids(other_user_id):
             # Queue for push notification
-            redis_client.lpush('push_queue', json.dumps({
-                'user_id': other_user.id,
-                'message': f"New message from {user.username}",
-                'conversation_id': conversation_id
-            }))
+            redis_client.lpush(PUSH_QUEUE, json.dumps(
+                push_payload(user, other_user_id, conversation_id, content, message.message_id)
+            ))
         
-        logger.info(f"Message sent by {user.username} in conversation {conversation_id}")
+        logger.info(f"Message sent by {user['username']} in conversation {conversation_id}")
         
     except Exception as e:
         logger.error(f"Send message error: {e}")
         sio.emit('error', {'message': str(e)}, room=sid)
 
+@sio.event
+def sync_messages(sid, data):
+    """Send a reconnecting client the messages it missed after after_message_id"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+        
+        conversation_id = data.get('conversation_id')
+        after_message_id = data.get('after_message_id')
+        if not conversation_id or not after_message_id:
+            sio.emit('error', {'message': 'Missing data'}, room=sid)
+            return
+        
+        _, user = run_db(load_participant, conversation_id, user_id)
+        if not user:
+            sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+        
+        sio.emit('messages_synced', run_db(sync_payload, int(conversation_id), after_message_id), room=sid)
+        
+    except Exception as e:
+        logger.error(f"Sync messages error: {e}")
+        sio.emit('error', {'message': str(e)}, room=sid)
+
+@sio.event
+def ack_delivered(sid, data):
+    """The client has every message up to up_to_id in a conversation; applied at the next flush"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+        
+        conversation_id = data.get('conversation_id')
+        up_to_id = data.get('up_to_id')
+        if not conversation_id or not up_to_id:
+            sio.emit('error', {'message': 'Missing data'}, room=sid)
+            return
+        conversation_id = int(conversation_id)
+        
+        sender_id = authorized_peer(get_session(sid), conversation_id)
+        if not sender_id:
+            sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+        
+        delivery_acks.ack(conversation_id, user_id, sender_id, int(up_to_id))
+        
+    except Exception as e:
+        logger.error(f"Delivery ack error: {e}")
+        sio.emit('error', {'message': str(e)}, room=sid)
+
+@sio.on('heartbeat')
+def client_heartbeat(sid, data=None):
+    """Clients heartbeat while in the foreground so presence stays fresh"""
+    user_id = connections.user_for(sid)
+    if user_id:
+        presence.heartbeat(user_id)
+
+@sio.event
+def who_is_online(sid, data):
+    """Presence of many users at once, e.g. every peer in the conversation list"""
+    try:
+        if not connections.user_for(sid):
+            sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+        user_ids = [int(user_id) for user_id in data.get('user_ids', [])]
+        payload = {'users': presence.statuses(user_ids)}
+        sio.emit('presence_status', payload, room=sid)
+        return payload
+    except Exception as e:
+        logger.error(f"Presence lookup error: {e}")
+        sio.emit('error', {'message': str(e)}, room=sid)
+
 @sio.event
 def typing(sid, data):
     """Handle typing indicator"""
     try:
-        user_id = user_connections.get(sid)
+        user_id = connections.user_for(sid)
         if not user_id:
             return
         
@@ -280,15 +344,19 @@ def typing(sid, data):
         
         if not conversation_id:
             return
+        conversation_id = int(conversation_id)
+        
+        # Only conversations this socket joined or posted to; no database lookup
+        session = get_session(sid)
+        if conversation_id not in session['conversations']:
+            return
         
-        user = CustomUser.objects.get(id=user_id)
-        room_name = f'conv_{conversation_id}'
+        # Excess typing starts are dropped silently; stops always pass
+        if is_typing and not local_buckets.hit(TYPING_LIMIT, TYPING_LIMIT.key(user_id))[0]:
+            return
         
-        sio.emit('user_typing', {
-            'user_id': user_id,
-            'username': user.username,
-            'is_typing': is_typing
-        }, room=room_name, skip_sid=sid)
+        # Coalesced in memory; most events broadcast nothing
+        emit_typing(typing_state.update(conversation_id, user_id, session['user']['username'], sid, is_typing))
         
     except Exception as e:
         logger.error(f"Typing error: {e}")
@@ -297,26 +365,136 @@ def typing(sid, data):
 def disconnect(sid):
     """Handle client disconnect"""
     try:
-        user_id = user_connections.get(sid)
+        encoding_rooms.leave_all(sid)
+        
+        # Remove connection and check if user has other active connections
+        user_id, remaining_connections = connections.untrack(sid)
         if user_id:
-            # Remove connection
-            del user_connections[sid]
-            
-            # Check if user has other active connections
-            remaining_connections = [s for s, u_id in user_connections.items() if u_id == user_id]
+            if not remaining_connections:
+                emit_typing(typing_state.drop_user(user_id))
             
             # Only mark offline if no other connections
-            if not remaining_connections and redis_client:
-                redis_client.delete(f'online_{user_id}')
+            if not remaining_connections:
+                presence.set_offline(user_id)
             
-            logger.info(f"User {user_id} disconnected: {sid} [Remaining connections: {len(remaining_connections)}]")
+            logger.info(f"User {user_id} disconnected: {sid} [Remaining connections: {remaining_connections}]")
     except Exception as e:
         logger.error(f"Disconnect error: {e}")
 
-# Create WSGI app
+def presence_heartbeat_loop():
+    """Keep connected users online while their sockets stay open"""
+    while True:
+        sio.sleep(PRESENCE_TTL / 3)
+        try:
+            presence.heartbeat(*connections.local_users())
+            presence.prune()
+        except Exception as e:
+            logger.error(f"Presence heartbeat error: {e}")
+
+def typing_sweep_loop():
+    """Send typing changes held back by the interval and switch off stale indicators"""
+    while True:
+        sio.sleep(SWEEP_INTERVAL)
+        try:
+            emit_typing(typing_state.sweep())
+        except Exception as e:
+            logger.error(f"Typing sweep error: {e}")
+
+def flush_delivery_loop():
+    """Apply delivery acks in one UPDATE per interval and send each sender one receipt per conversation"""
+    while True:
+        sio.sleep(receipts.FLUSH_INTERVAL)
+        pending = delivery_acks.drain()
+        if not pending:
+            continue
+        try:
+            for sender_id, receipt in run_db(receipts.mark_delivered, pending):
+                sio.emit('messages_delivered', receipt, room=user_room(sender_id))
+        except Exception as e:
+            delivery_acks.restore(pending)
+            logger.error(f"Delivery receipt flush error: {e}")
+
+def flush_last_message_loop():
+    """Write coalesced last_message_at updates for the messages this process saved"""
+    while True:
+        sio.sleep(last_message.FLUSH_INTERVAL)
+        try:
+            run_db(last_message.flush)
+        except Exception as e:
+            logger.error(f"last_message_at flush error: {e}")
+
+def invalidation_loop():
+    """Apply profile and conversation invalidations published by the API and admin"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(INVALIDATION_CHANNEL)
+    while True:
+        sio.sleep(INVALIDATION_POLL)
+        try:
+            # get_message() without a timeout returns at once, so the hub never waits on Redis
+            message = pubsub.get_message()
+            while message:
+                apply_invalidation(json.loads(message['data']))
+                message = pubsub.get_message()
+        except Exception as e:
+            logger.error(f"Invalidation error: {e}")
+
+def drain_external_emits():
+    """Send emits queued by web and worker processes (realtime.emit_external); returns how many"""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lrange(EXTERNAL_EMIT_QUEUE, 0, EXTERNAL_EMIT_BATCH - 1)
+    pipe.ltrim(EXTERNAL_EMIT_QUEUE, EXTERNAL_EMIT_BATCH, -1)
+    rows, _ = pipe.execute()
+    for event, data, room in queued_emits(rows):
+        sio.emit(event, data, room=room)
+    return len(rows)
+
+def external_emit_loop():
+    """Notifications, attachment_ready and REST read receipts reach sockets through this queue"""
+    while True:
+        sio.sleep(EXTERNAL_EMIT_POLL)
+        try:
+            while drain_external_emits() == EXTERNAL_EMIT_BATCH:
+                pass
+        except Exception as e:
+            logger.error(f"External emit error: {e}")
+
+def without_ws_deflate(wsgi_app):
+    """eventlet negotiates permessage-deflate whenever a client offers it; hide the offer when disabled"""
+    def app(environ, start_response):
+        environ.pop('HTTP_SEC_WEBSOCKET_EXTENSIONS', None)
+        return wsgi_app(environ, start_response)
+    return app
+
+def db_metrics_loop():
+    """Log the database pool's utilization and wait times, and share them through Redis"""
+    while True:
+        sio.sleep(METRICS_INTERVAL)
+        try:
+            snapshot = db_pool.snapshot()
+            logger.info(f"DB pool: {snapshot}")
+            if redis_client:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.hset(metrics_key(CHAT_NODE_NAME), mapping=snapshot)
+                pipe.expire(metrics_key(CHAT_NODE_NAME), METRICS_TTL)
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"DB pool metrics error: {e}")
+
+# Create WSGI app; WebSocket frames use permessage-deflate unless CHAT_WS_DEFLATE=0
 app = socketio.WSGIApp(sio)
+if not config('CHAT_WS_DEFLATE', default=True, cast=bool):
+    app = without_ws_deflate(app)
 
 if __name__ == '__main__':
     import eventlet
-    print('Starting production chat server on port 8001...')
-    eventlet.wsgi.server(eventlet.listen(('0.0.0.0', 8001)), app)
\ No newline at end of file
+    port = config('CHAT_PORT', default=8001, cast=int)
+    print(f'Starting production chat server on port {port}...')
+    sio.start_background_task(flush_last_message_loop)
+    sio.start_background_task(typing_sweep_loop)
+    sio.start_background_task(presence_heartbeat_loop)
+    sio.start_background_task(flush_delivery_loop)
+    sio.start_background_task(db_metrics_loop)
+    if redis_client:
+        sio.start_background_task(invalidation_loop)
+        sio.start_background_task(external_emit_loop)
+    eventlet.wsgi.server(eventlet.listen(('0.0.0.0', port)), app)
\ No newline at end of file
@@ -0,0 +1,604 @@
+"""Asyncio chat server: socketio.AsyncServer on ASGI.
+
+Speaks the same event protocol as chat_server.py. Redis is used through
+redis.asyncio, and every ORM call runs on a fixed-size thread pool
+(app.chat.db_pool), so a slow query holds one worker thread instead of
+stalling every socket in the process, and the process holds at most
+CHAT_DB_THREADS database connections.
+
+Each connection's session caches the user's profile and the conversations
+the socket may post to, so steady-state send_message and typing events do
+not read the database. Cached entries are dropped when app.chat.signals
+publishes an invalidation.
+
+With CHAT_CLUSTER=1 any number of these processes can run side by side:
+room broadcasts go through a Redis pub/sub client manager and connections
+are tracked in a shared, TTL-refreshed registry (app.chat.connections).
+
+With CHAT_WRITE_BEHIND=1 send_message broadcasts before the message is
+saved: it goes to a Redis Stream and a persister on every node saves it in
+batches, then emits message_ack (app.chat.write_behind).
+
+Clients may ask for compact msgpack new_message events at connect
+(app.chat.wire). WebSocket frames are compressed with permessage-deflate when
+the client offers it; CHAT_WS_DEFLATE=0 turns that off.
+
+Run with:  uvicorn chat_server_async:app --port 8001
+"""
+import os
+import socket
+import json
+import logging
+
+import django
+import socketio
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'partyoria.settings')
+django.setup()
+
+import redis.asyncio as aioredis
+from decouple import config
+
+from app.chat.db_pool import DB_THREADS, METRICS_INTERVAL, METRICS_TTL, ThreadDBPool, metrics_key
+from app.chat.connections import CONNECTION_TTL, LocalConnectionRegistry, RedisConnectionRegistry
+from app.chat.realtime import (
+    MAX_CONNECTIONS_PER_USER, MAX_MESSAGE_LENGTH, MESSAGE_LIMIT, TYPING_LIMIT,
+    user_room, conversation_room, extract_token, authenticate_user, load_participant,
+    mark_conversation_read, user_profile, create_message, notify_message, push_payload,
+    EXTERNAL_EMIT_QUEUE, EXTERNAL_EMIT_POLL, EXTERNAL_EMIT_BATCH, queued_emits
+)
+from app.chat.signals import INVALIDATION_CHANNEL
+from app.chat.history import sync_payload
+from app.chat.presence import AsyncPresenceService
+from app.chat.push import PUSH_QUEUE
+from app.chat import last_message, receipts
+from app.chat.typing import TypingCoalescer, SWEEP_INTERVAL
+from app.chat.wire import ENCODINGS, EncodingRooms, encoded_messages, message_room, negotiate
+from app.chat.write_behind import MessagePersister, STREAM_KEY, pending_message, stream_entry
+from authentication.models import CustomUser
+from partyoria.rate_limiting import AsyncTokenBucketLimiter, local_buckets
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+CHAT_CLUSTER = config('CHAT_CLUSTER', default=False, cast=bool)
+CHAT_WRITE_BEHIND = config('CHAT_WRITE_BEHIND', default=False, cast=bool)
+# Stable per node so a restarted node replays its own unacknowledged messages at once
+CHAT_NODE_NAME = config('CHAT_NODE_NAME', default=f'{socket.gethostname()}-{os.getpid()}')
+# permessage-deflate on the WebSocket transport (uvicorn --ws-per-message-deflate)
+CHAT_WS_DEFLATE = config('CHAT_WS_DEFLATE', default=True, cast=bool)
+
+# Blocking ORM work runs here; each worker thread keeps its own DB connection
+db_pool = ThreadDBPool(DB_THREADS)
+
+# Set at startup when Redis answers
+redis_client = None
+persister = None
+# Process-local until Redis is connected
+rate_limiter = AsyncTokenBucketLimiter()
+presence = AsyncPresenceService()
+background_tasks = []
+
+# Socket.IO server; in cluster mode emits to rooms reach sockets on every node
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    client_manager=socketio.AsyncRedisManager(REDIS_URL) if CHAT_CLUSTER else None,
+    cors_allowed_origins="*",
+    logger=False,
+    engineio_logger=False,
+    ping_timeout=60,
+    ping_interval=25
+)
+
+# Store user connections; replaced by the shared registry at startup in cluster mode
+connections = LocalConnectionRegistry()
+
+# Typing indicators of the sockets on this node
+typing_state = TypingCoalescer()
+
+# Delivery acks of the sockets on this node, applied every receipts.FLUSH_INTERVAL
+delivery_acks = receipts.DeliveryAcks()
+
+# Wire encodings the sockets on this node receive, per conversation
+encoding_rooms = EncodingRooms()
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking ORM function on the database pool"""
+    return await db_pool.run(func, *args, **kwargs)
+
+
+async def get_session(sid):
+    """The connection's session, reloading the cached profile after an invalidation"""
+    session = await sio.get_session(sid)
+    if session.get('user') is None:
+        user = await run_db(CustomUser.objects.get, id=connections.user_for(sid))
+        session['user'] = user_profile(user)
+    return session
+
+
+async def authorized_peer(session, conversation_id):
+    """Id of the other participant, or None when the user may not post to the conversation"""
+    conversations = session['conversations']
+    if conversation_id not in conversations:
+        conversation, user = await run_db(load_participant, conversation_id, session['user']['id'])
+        if not user:
+            return None
+        conversations[conversation_id] = conversation.get_other_user(user).id
+    return conversations[conversation_id]
+
+
+async def notify_in_background(message_id):
+    try:
+        await run_db(notify_message, message_id)
+    except Exception as e:
+        logger.error(f"Message notification error: {e}")
+
+
+async def ack_persisted(acks):
+    """Tell both participants a write-behind message is saved and what its id is"""
+    for ack in acks:
+        await sio.emit('message_ack', ack, room=conversation_room(ack['conversation_id']))
+
+
+async def apply_invalidation(event):
+    """Drop cached profiles and conversation grants from this node's sessions"""
+    if event['kind'] == 'user':
+        sids = list(connections.local_sids(event['id']))
+    else:
+        sids = list(connections.sids)
+    for sid in sids:
+        try:
+            session = await sio.get_session(sid)
+        except KeyError:
+            continue
+        if event['kind'] == 'user':
+            session['user'] = None
+        elif event['kind'] == 'conversation':
+            session['conversations'].pop(event['id'], None)
+
+
+async def invalidation_listener():
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(INVALIDATION_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message['type'] == 'message':
+                await apply_invalidation(json.loads(message['data']))
+    finally:
+        await pubsub.aclose()
+
+
+async def heartbeat():
+    """Keep this node's connections and users' presence alive while their sockets stay open"""
+    while True:
+        await sio.sleep(CONNECTION_TTL / 3)
+        try:
+            await connections.refresh()
+            await presence.heartbeat(*connections.local_users())
+            await presence.prune()
+        except Exception as e:
+            logger.error(f"Heartbeat error: {e}")
+
+
+async def emit_typing(events):
+    for conversation_id, sid, payload in events:
+        await sio.emit('user_typing', payload, room=conversation_room(conversation_id), skip_sid=sid)
+
+
+async def typing_sweep_loop():
+    """Send typing changes held back by the interval and switch off stale indicators"""
+    while True:
+        await sio.sleep(SWEEP_INTERVAL)
+        try:
+            await emit_typing(typing_state.sweep())
+        except Exception as e:
+            logger.error(f"Typing sweep error: {e}")
+
+
+async def flush_last_message_loop():
+    """Write coalesced last_message_at updates for the messages this node saved"""
+    while True:
+        await sio.sleep(last_message.FLUSH_INTERVAL)
+        try:
+            await run_db(last_message.flush)
+        except Exception as e:
+            logger.error(f"last_message_at flush error: {e}")
+
+
+async def flush_delivery_acks():
+    """Apply pending delivery acks in one UPDATE and send each sender one receipt per conversation"""
+    pending = delivery_acks.drain()
+    if not pending:
+        return
+    try:
+        delivered = await run_db(receipts.mark_delivered, pending)
+    except Exception:
+        delivery_acks.restore(pending)
+        raise
+    for sender_id, receipt in delivered:
+        await sio.emit('messages_delivered', receipt, room=user_room(sender_id))
+
+
+async def flush_delivery_loop():
+    """Apply delivery acks once per interval however many arrive"""
+    while True:
+        await sio.sleep(receipts.FLUSH_INTERVAL)
+        try:
+            await flush_delivery_acks()
+        except Exception as e:
+            logger.error(f"Delivery receipt flush error: {e}")
+
+
+async def db_metrics_loop():
+    """Log the database pool's utilization and wait times, and share them through Redis"""
+    while True:
+        await sio.sleep(METRICS_INTERVAL)
+        try:
+            snapshot = db_pool.snapshot()
+            logger.info(f"DB pool: {snapshot}")
+            if redis_client:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hset(metrics_key(CHAT_NODE_NAME), mapping=snapshot)
+                    pipe.expire(metrics_key(CHAT_NODE_NAME), METRICS_TTL)
+                    await pipe.execute()
+        except Exception as e:
+            logger.error(f"DB pool metrics error: {e}")
+
+
+async def drain_external_emits():
+    """Send emits queued by web and worker processes (realtime.emit_external); returns how many"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.lrange(EXTERNAL_EMIT_QUEUE, 0, EXTERNAL_EMIT_BATCH - 1)
+        pipe.ltrim(EXTERNAL_EMIT_QUEUE, EXTERNAL_EMIT_BATCH, -1)
+        rows, _ = await pipe.execute()
+    for event, data, room in queued_emits(rows):
+        await sio.emit(event, data, room=room)
+    return len(rows)
+
+
+async def external_emit_loop():
+    while True:
+        await sio.sleep(EXTERNAL_EMIT_POLL)
+        try:
+            while await drain_external_emits() == EXTERNAL_EMIT_BATCH:
+                pass
+        except Exception as e:
+            logger.error(f"External emit error: {e}")
+
+
+async def startup():
+    global redis_client, connections, persister, rate_limiter, presence
+    background_tasks.append(sio.start_background_task(flush_last_message_loop))
+    background_tasks.append(sio.start_background_task(typing_sweep_loop))
+    background_tasks.append(sio.start_background_task(flush_delivery_loop))
+    background_tasks.append(sio.start_background_task(db_metrics_loop))
+    client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    try:
+        await client.ping()
+        redis_client = client
+        rate_limiter = AsyncTokenBucketLimiter(redis_client)
+        presence = AsyncPresenceService(redis_client)
+        logger.info("Redis connected successfully")
+    except Exception:
+        await client.aclose()
+        if CHAT_CLUSTER:
+            raise RuntimeError("CHAT_CLUSTER requires Redis at REDIS_URL")
+        if CHAT_WRITE_BEHIND:
+            logger.warning("Write-behind needs Redis - saving messages directly")
+        logger.warning("Redis not available - running without caching")
+        return
+
+    if CHAT_CLUSTER:
+        connections = RedisConnectionRegistry(redis_client)
+        logger.info("Cluster mode: sharing rooms and connections through Redis")
+    else:
+        # Without a client manager, emits from web and worker processes are queued in Redis
+        background_tasks.append(sio.start_background_task(external_emit_loop))
+    background_tasks.append(sio.start_background_task(heartbeat))
+    background_tasks.append(sio.start_background_task(invalidation_listener))
+    if CHAT_WRITE_BEHIND:
+        persister = MessagePersister(redis_client, run_db, ack_persisted, CHAT_NODE_NAME)
+        background_tasks.append(sio.start_background_task(persister.run, sio.sleep))
+        logger.info(f"Write-behind mode: persisting messages from {STREAM_KEY} as {CHAT_NODE_NAME}")
+
+
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await run_db(last_message.flush)
+    await flush_delivery_acks()
+    if redis_client:
+        await redis_client.aclose()
+    db_pool.shutdown()
+
+
+@sio.event
+async def connect(sid, environ, auth):
+    """Handle client connection"""
+    try:
+        user = await run_db(authenticate_user, extract_token(environ, auth))
+        if not user:
+            logger.warning(f"Unauthorized connection attempt: {sid}")
+            return False
+
+        # Check if user already has active connections (on any node in cluster mode)
+        existing_connections = await connections.count(user.id)
+        if existing_connections >= MAX_CONNECTIONS_PER_USER:
+            logger.warning(f"User {user.username} already has {existing_connections} connections, rejecting")
+            return False
+
+        # Store user connection and cache the profile for later events
+        total_connections = await connections.add(sid, user.id)
+        encoding = negotiate(environ, auth)
+        await sio.save_session(sid, {'user': user_profile(user), 'conversations': {}, 'encoding': encoding})
+
+        # Join user to their personal room
+        await sio.enter_room(sid, user_room(user.id))
+
+        await presence.heartbeat(user.id)
+
+        logger.info(f"User {user.username} ({user.user_type}) connected: {sid} [Total connections: {total_connections}]")
+        await sio.emit('connected', {'status': 'success', 'user_id': user.id, 'encoding': encoding}, room=sid)
+
+    except Exception as e:
+        logger.error(f"Connection error: {e}")
+        return False
+
+
+@sio.event
+async def join_conversation(sid, data):
+    """Join a conversation room"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+
+        conversation_id = data.get('conversation_id')
+        if not conversation_id:
+            await sio.emit('error', {'message': 'Missing conversation_id'}, room=sid)
+            return
+        conversation_id = int(conversation_id)
+
+        # Verify user is part of conversation
+        conversation, user = await run_db(load_participant, conversation_id, user_id)
+        if not user:
+            await sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+        session = await get_session(sid)
+        session['conversations'][conversation_id] = conversation.get_other_user(user).id
+
+        # Join conversation room, and the room new_message arrives in for this socket's encoding
+        await sio.enter_room(sid, conversation_room(conversation_id))
+        await sio.enter_room(sid, message_room(conversation_id, session['encoding']))
+        encoding_rooms.join(sid, conversation_id, session['encoding'])
+
+        # Mark messages as read and tell the other side with one receipt
+        receipt = await run_db(mark_conversation_read, conversation, user)
+        if receipt:
+            await sio.emit('messages_read', receipt, room=conversation_room(conversation_id), skip_sid=sid)
+
+        logger.info(f"User {user.username} joined conversation {conversation_id}")
+        await sio.emit('joined_conversation', {
+            'conversation_id': conversation_id,
+            'status': 'success'
+        }, room=sid)
+
+    except Exception as e:
+        logger.error(f"Join conversation error: {e}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+
+@sio.event
+async def send_message(sid, data):
+    """Send a message"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+
+        conversation_id = data.get('conversation_id')
+        content = data.get('content', '').strip()
+        temp_id = data.get('temp_id')
+
+        if not conversation_id or not content:
+            await sio.emit('error', {'message': 'Missing data'}, room=sid)
+            return
+        conversation_id = int(conversation_id)
+
+        if len(content) > MAX_MESSAGE_LENGTH:
+            await sio.emit('error', {'message': 'Message too long'}, room=sid)
+            return
+
+        # Rate limiting check
+        allowed, _ = await rate_limiter.hit(MESSAGE_LIMIT, user_id)
+        if not allowed:
+            await sio.emit('error', {'message': 'Rate limit exceeded'}, room=sid)
+            return
+
+        # Sender profile and conversation access come from the session cache
+        session = await get_session(sid)
+        user = session['user']
+        other_user_id = await authorized_peer(session, conversation_id)
+        if not other_user_id:
+            await sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+
+        # Create message; in write-behind mode it is durable in the stream before anyone sees it
+        if persister:
+            message = pending_message(conversation_id, user_id, content)
+            await redis_client.xadd(STREAM_KEY, stream_entry(message, user, other_user_id, temp_id))
+        else:
+            message = await run_db(create_message, conversation_id, user_id, content, defer_notification=True)
+
+        # Broadcast to conversation room, encoded once per wire encoding a socket receives;
+        # in a cluster other nodes' sockets are unknown here, so every encoding goes out
+        encodings = ENCODINGS if CHAT_CLUSTER else encoding_rooms.encodings(conversation_id)
+        for room, body in encoded_messages(message, user, conversation_id, temp_id, encodings):
+            await sio.emit('new_message', body, room=room)
+        if not persister:
+            sio.start_background_task(notify_in_background, message.id)
+
+        # Send push notification to offline users
+        if redis_client and not await connections.is_online(other_user_id):
+            # Queue for push notification
+            await redis_client.lpush(PUSH_QUEUE, json.dumps(
+                push_payload(user, other_user_id, conversation_id, content, message.message_id)
+            ))
+
+        logger.info(f"Message sent by {user['username']} in conversation {conversation_id}")
+
+    except Exception as e:
+        logger.error(f"Send message error: {e}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+
+@sio.event
+async def sync_messages(sid, data):
+    """Send a reconnecting client the messages it missed after after_message_id"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+
+        conversation_id = data.get('conversation_id')
+        after_message_id = data.get('after_message_id')
+        if not conversation_id or not after_message_id:
+            await sio.emit('error', {'message': 'Missing data'}, room=sid)
+            return
+        conversation_id = int(conversation_id)
+
+        session = await get_session(sid)
+        if not await authorized_peer(session, conversation_id):
+            await sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+
+        payload = await run_db(sync_payload, conversation_id, after_message_id)
+        await sio.emit('messages_synced', payload, room=sid)
+
+    except Exception as e:
+        logger.error(f"Sync messages error: {e}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+
+@sio.event
+async def ack_delivered(sid, data):
+    """The client has every message up to up_to_id in a conversation; applied at the next flush"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+
+        conversation_id = data.get('conversation_id')
+        up_to_id = data.get('up_to_id')
+        if not conversation_id or not up_to_id:
+            await sio.emit('error', {'message': 'Missing data'}, room=sid)
+            return
+        conversation_id = int(conversation_id)
+
+        session = await get_session(sid)
+        sender_id = await authorized_peer(session, conversation_id)
+        if not sender_id:
+            await sio.emit('error', {'message': 'Not authorized'}, room=sid)
+            return
+
+        delivery_acks.ack(conversation_id, user_id, sender_id, int(up_to_id))
+
+    except Exception as e:
+        logger.error(f"Delivery ack error: {e}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+
+@sio.on('heartbeat')
+async def client_heartbeat(sid, data=None):
+    """Clients heartbeat while in the foreground so presence stays fresh between server heartbeats"""
+    user_id = connections.user_for(sid)
+    if user_id:
+        await presence.heartbeat(user_id)
+
+
+@sio.event
+async def who_is_online(sid, data):
+    """Presence of many users at once, e.g. every peer in the conversation list"""
+    try:
+        if not connections.user_for(sid):
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+        user_ids = [int(user_id) for user_id in data.get('user_ids', [])]
+        payload = {'users': await presence.statuses(user_ids)}
+        await sio.emit('presence_status', payload, room=sid)
+        return payload
+    except Exception as e:
+        logger.error(f"Presence lookup error: {e}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+
+@sio.event
+async def typing(sid, data):
+    """Handle typing indicator"""
+    try:
+        user_id = connections.user_for(sid)
+        if not user_id:
+            return
+
+        conversation_id = data.get('conversation_id')
+        is_typing = data.get('is_typing', False)
+
+        if not conversation_id:
+            return
+        conversation_id = int(conversation_id)
+
+        # Only conversations this socket joined or posted to; no database lookup
+        session = await get_session(sid)
+        if conversation_id not in session['conversations']:
+            return
+
+        # Excess typing starts are dropped silently; stops always pass
+        if is_typing and not local_buckets.hit(TYPING_LIMIT, TYPING_LIMIT.key(user_id))[0]:
+            return
+
+        # Coalesced in memory; most events broadcast nothing
+        await emit_typing(typing_state.update(
+            conversation_id, user_id, session['user']['username'], sid, is_typing
+        ))
+
+    except Exception as e:
+        logger.error(f"Typing error: {e}")
+
+
+@sio.event
+async def disconnect(sid):
+    """Handle client disconnect"""
+    try:
+        encoding_rooms.leave_all(sid)
+
+        # Remove connection and check if user has other active connections
+        user_id, remaining_connections = await connections.remove(sid)
+        if user_id:
+            if not connections.local_sids(user_id):
+                await emit_typing(typing_state.drop_user(user_id))
+
+            # Only mark offline if no other connections
+            if not remaining_connections:
+                await presence.set_offline(user_id)
+
+            logger.info(f"User {user_id} disconnected: {sid} [Remaining connections: {remaining_connections}]")
+    except Exception as e:
+        logger.error(f"Disconnect error: {e}")
+
+
+# Create ASGI app
+app = socketio.ASGIApp(sio, on_startup=startup, on_shutdown=shutdown)
+
+if __name__ == '__main__':
+    import uvicorn
+    port = config('CHAT_PORT', default=8001, cast=int)
+    print(f'Starting asyncio chat server on port {port}...')
+    uvicorn.run(app, host='0.0.0.0', port=port, ws_per_message_deflate=CHAT_WS_DEFLATE)
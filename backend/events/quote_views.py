@@ -10,12 +10,13 @@ from decimal import Decimal
 from .models import Event, QuoteRequest
 from authentication.models import CustomUser
 from vendors.models import VendorProfile
+from vendors.availability import free_vendor_ids
 from notifications.services import VendorNotifications, CustomerNotifications
 
-def parse_event_date(date_string):
-    """Parse event date from various formats"""
+def event_date_or_none(date_string):
+    """The date in an event's dateTime, or None when it is missing or unparseable"""
     if not date_string:
-        return timezone.now().date()
+        return None
     
     try:
         # Try parsing different date formats
@@ -25,11 +26,13 @@ def parse_event_date(date_string):
         elif '-' in date_string and len(date_string) == 10:
             # YYYY-MM-DD format
             return datetime.strptime(date_string, '%Y-%m-%d').date()
-        else:
-            # Fallback to current date
-            return timezone.now().date()
-    except:
-        return timezone.now().date()
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def parse_event_date(date_string):
+    """Parse event date from various formats, falling back to today"""
+    return event_date_or_none(date_string) or timezone.now().date()
 
 @api_view(['POST'])
 @permission_classes([])
@@ -498,6 +501,13 @@ def match_vendors_to_event(event):
                 seen.add(vendor.id)
                 unique_vendors.append(vendor)
         
+        # Drop vendors already booked on the event date (single query for all candidates);
+        # without a usable date there is nothing to check availability against
+        event_date = event_date_or_none(event.form_data.get('dateTime') if event.form_data else None)
+        if event_date and unique_vendors:
+            free_ids = free_vendor_ids(seen, event_date)
+            unique_vendors = [vendor for vendor in unique_vendors if vendor.id in free_ids]
+        
         return unique_vendors, categories
             
     except Exception as e:
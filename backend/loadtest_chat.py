@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+"""
+Load test for the chat servers.
+
+Seeds --clients users paired into vendor/customer conversations, connects one
+Socket.IO client per user with a JWT and, for --duration seconds, has every
+client pick actions from --mix (send a message, send typing, re-join the
+conversation) at --rate actions per second.
+
+Reports connect time, send-to-receive latency (sender's emit until the peer's
+new_message) as p50/p95/p99, messages per second sent and delivered, typing
+events, server errors and the server process' CPU.
+
+--server sync|async starts chat_server.py or chat_server_async.py on --port
+and --fake-redis gives it an in-process fake Redis, so a run needs nothing
+but the database. --server none targets a server already running at --url
+(pass --server-pid to sample its CPU). --encoding msgpack has the clients
+negotiate compact new_message events (app.chat.wire). --max-p99-ms and --min-throughput make
+the run exit 1 when a hot path regresses; --json writes the report for CI.
+The seeded users and everything they create are deleted afterwards.
+
+Usage: python loadtest_chat.py [--clients 50] [--duration 30] [--rate 2] [--server async] [--fake-redis]
+"""
+import os
+import sys
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+
+import django
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'partyoria.settings')
+django.setup()
+
+import requests
+import socketio
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.chat.models import Conversation
+from app.chat.wire import JSON, ENCODINGS, expand_message
+
+User = get_user_model()
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+USERNAME_PREFIX = 'loadtest_chat_'
+DEFAULT_MIX = 'send=0.5,typing=0.45,join=0.05'
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        action, weight = part.split('=')
+        mix[action.strip()] = float(weight)
+    unknown = set(mix) - {'send', 'typing', 'join'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown actions in mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Stats:
+    """Shared by every client thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connect_times = []
+        self.latencies = []
+        self.pending = {}
+        self.sent = 0
+        self.delivered = 0
+        self.typing_sent = 0
+        self.typing_received = 0
+        self.joins = 0
+        self.errors = Counter()
+
+    def message_sent(self, temp_id):
+        with self.lock:
+            self.pending[temp_id] = time.perf_counter()
+            self.sent += 1
+
+    def message_received(self, temp_id):
+        received = time.perf_counter()
+        with self.lock:
+            sent_at = self.pending.pop(temp_id, None)
+            if sent_at is not None:
+                self.latencies.append(received - sent_at)
+                self.delivered += 1
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def error(self, message):
+        with self.lock:
+            self.errors[message] += 1
+
+
+class SimulatedClient:
+    """One user's socket; sends from a thread, receives on socketio's threads"""
+
+    def __init__(self, user, conversation_id, url, stats, mix, rate, seed, encoding=JSON):
+        self.user_id = user.id
+        self.encoding = encoding
+        self.token = str(AccessToken.for_user(user))
+        self.conversation_id = conversation_id
+        self.url = url
+        self.stats = stats
+        self.rate = rate
+        self.random = random.Random(seed)
+        self.actions, self.weights = zip(*mix.items())
+        self.connected = threading.Event()
+        self.joined = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('connected', self.on_connected)
+        self.sio.on('joined_conversation', self.on_joined)
+        self.sio.on('new_message', self.on_new_message)
+        self.sio.on('user_typing', self.on_typing)
+        self.sio.on('error', self.on_error)
+
+    def on_connected(self, data):
+        self.connected.set()
+
+    def on_joined(self, data):
+        self.joined.set()
+
+    def on_new_message(self, data):
+        if isinstance(data, bytes):
+            data = expand_message(data)
+        if data.get('sender_id') != self.user_id and data.get('temp_id'):
+            self.stats.message_received(data['temp_id'])
+
+    def on_typing(self, data):
+        self.stats.count('typing_received')
+
+    def on_error(self, data):
+        self.stats.error((data or {}).get('message', 'unknown'))
+
+    def connect(self, timeout=10):
+        started = time.perf_counter()
+        try:
+            self.sio.connect(self.url, auth={'token': self.token, 'encoding': self.encoding}, transports=['websocket'], wait_timeout=timeout)
+        except socketio.exceptions.ConnectionError as e:
+            self.stats.error(f'connect failed: {e}')
+            return False
+        if not self.connected.wait(timeout):
+            self.stats.error('connect timed out')
+            return False
+        with self.stats.lock:
+            self.stats.connect_times.append(time.perf_counter() - started)
+        self.sio.emit('join_conversation', {'conversation_id': self.conversation_id})
+        return self.joined.wait(timeout)
+
+    def run(self, deadline):
+        sequence = 0
+        while True:
+            pause = self.random.expovariate(self.rate)
+            if time.perf_counter() + pause >= deadline:
+                break
+            time.sleep(pause)
+            action = self.random.choices(self.actions, self.weights)[0]
+            if action == 'send':
+                sequence += 1
+                temp_id = uuid.uuid4().hex
+                self.stats.message_sent(temp_id)
+                self.sio.emit('send_message', {
+                    'conversation_id': self.conversation_id,
+                    'content': f'Load test message {sequence} from {self.user_id}',
+                    'temp_id': temp_id
+                })
+            elif action == 'typing':
+                self.stats.count('typing_sent')
+                self.sio.emit('typing', {'conversation_id': self.conversation_id, 'is_typing': True})
+            else:
+                self.stats.count('joins')
+                self.sio.emit('join_conversation', {'conversation_id': self.conversation_id})
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+class CPUSampler:
+    """CPU use of another process, from psutil when installed or /proc on Linux"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def cpu_seconds(self):
+        try:
+            import psutil
+            times = psutil.Process(self.pid).cpu_times()
+            return times.user + times.system
+        except ImportError:
+            pass
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime are fields 14 and 15 of the full line
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def available(self):
+        try:
+            self.cpu_seconds()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def run(self):
+        last_cpu, last_wall = self.cpu_seconds(), time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            try:
+                cpu, wall = self.cpu_seconds(), time.perf_counter()
+            except (OSError, ValueError):
+                return
+            self.samples.append(100 * (cpu - last_cpu) / (wall - last_wall))
+            last_cpu, last_wall = cpu, wall
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        if not self.samples:
+            return None
+        return {'avg_percent': statistics.mean(self.samples), 'max_percent': max(self.samples)}
+
+
+def start_fake_redis(port):
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(kind, port, env):
+    if kind == 'async':
+        command = [sys.executable, '-m', 'uvicorn', 'chat_server_async:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, 'chat_server.py']
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_server(url, process=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'Chat server exited with code {process.returncode}')
+        try:
+            if requests.get(f'{url}/socket.io/', params={'EIO': 4, 'transport': 'polling'}, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Chat server at {url} did not answer within {timeout}s')
+
+
+def seed(count):
+    """count users (an even number), paired into conversations; returns [(user, conversation_id)]"""
+    User.objects.bulk_create([
+        User(username=f'{USERNAME_PREFIX}{i}', user_type='vendor' if i % 2 == 0 else 'customer')
+        for i in range(count)
+    ])
+    users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+    participants = []
+    for vendor, customer in zip(users[::2], users[1::2]):
+        conversation = Conversation.objects.create(vendor=vendor, customer=customer)
+        participants.extend([(vendor, conversation.id), (customer, conversation.id)])
+    return participants
+
+
+def cleanup():
+    # Cascades to the conversations, their messages and the notifications
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+def run(args):
+    stats = Stats()
+    participants = seed(args.clients)
+    clients = [
+        SimulatedClient(user, conversation_id, args.url, stats, args.mix, args.rate, seed=index, encoding=args.encoding)
+        for index, (user, conversation_id) in enumerate(participants)
+    ]
+
+    connected = []
+    connecting = time.perf_counter()
+    lock = threading.Lock()
+
+    def connect(client):
+        if client.connect():
+            with lock:
+                connected.append(client)
+
+    threads = [threading.Thread(target=connect, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+        time.sleep(args.ramp_up / max(1, len(threads)))
+    for thread in threads:
+        thread.join()
+    connect_seconds = time.perf_counter() - connecting
+
+    sampler = CPUSampler(args.server_pid) if args.server_pid else None
+    if sampler and not sampler.available():
+        sampler = None
+    if sampler:
+        sampler.start()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client.run, args=(deadline,)) for client in connected]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Give messages still in flight a moment to arrive
+    time.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    cpu = sampler.stop() if sampler else None
+
+    for client in clients:
+        client.close()
+
+    return {
+        'server': args.server,
+        'encoding': args.encoding,
+        'clients': len(clients),
+        'connected': len(connected),
+        'duration_s': round(elapsed, 3),
+        'connect_all_s': round(connect_seconds, 3),
+        'connect_ms': summary(stats.connect_times),
+        'latency_ms': summary(stats.latencies),
+        'messages_sent': stats.sent,
+        'messages_delivered': stats.delivered,
+        'sent_per_sec': round(stats.sent / elapsed, 1),
+        'delivered_per_sec': round(stats.delivered / elapsed, 1),
+        'typing_sent': stats.typing_sent,
+        'typing_received': stats.typing_received,
+        'joins': stats.joins,
+        'errors': dict(stats.errors),
+        'server_cpu': cpu
+    }
+
+
+def summary(seconds):
+    if not seconds:
+        return None
+    return {
+        'p50': round(percentile(seconds, 50) * 1000, 3),
+        'p95': round(percentile(seconds, 95) * 1000, 3),
+        'p99': round(percentile(seconds, 99) * 1000, 3),
+        'max': round(max(seconds) * 1000, 3)
+    }
+
+
+def print_report(report):
+    print(f"=== Chat load test: {report['connected']}/{report['clients']} clients, "
+          f"{report['duration_s']}s against {report['server']} ({report['encoding']}) ===")
+    print(f"{'':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, key in (('connect', 'connect_ms'), ('send -> receive', 'latency_ms')):
+        row = report[key]
+        if row:
+            print(f"{name:<22}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}{row['max']:>10.2f}")
+        else:
+            print(f"{name:<22}{'-':>10}{'-':>10}{'-':>10}{'-':>10}")
+    print(f"messages: {report['messages_sent']} sent ({report['sent_per_sec']}/s), "
+          f"{report['messages_delivered']} delivered ({report['delivered_per_sec']}/s)")
+    print(f"typing: {report['typing_sent']} sent, {report['typing_received']} broadcasts; joins: {report['joins']}")
+    if report['server_cpu']:
+        print(f"server CPU: {report['server_cpu']['avg_percent']:.1f}% avg, {report['server_cpu']['max_percent']:.1f}% peak")
+    if report['errors']:
+        print(f"errors: {report['errors']}")
+
+
+def check(report, args):
+    """Failed gates, empty when the run is within limits"""
+    failures = []
+    latency = report['latency_ms']
+    if args.max_p99_ms is not None and (latency is None or latency['p99'] > args.max_p99_ms):
+        failures.append(f"p99 latency {latency and latency['p99']} ms exceeds {args.max_p99_ms} ms")
+    if args.min_throughput is not None and report['delivered_per_sec'] < args.min_throughput:
+        failures.append(f"throughput {report['delivered_per_sec']}/s is below {args.min_throughput}/s")
+    if report['connected'] < report['clients']:
+        failures.append(f"only {report['connected']} of {report['clients']} clients connected")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=50, help='simulated users; rounded up to an even number')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic after everyone connected')
+    parser.add_argument('--rate', type=float, default=2, help='actions per second per client')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--ramp-up', type=float, default=2, help='seconds over which clients connect')
+    parser.add_argument('--drain', type=float, default=1, help='seconds to wait for in-flight messages')
+    parser.add_argument('--server', choices=['none', 'sync', 'async'], default='async')
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON, help='new_message encoding the clients ask for')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help='server to test with --server none (default http://127.0.0.1:8001)')
+    parser.add_argument('--server-pid', type=int, help='process to sample CPU from with --server none')
+    parser.add_argument('--fake-redis', action='store_true', help='give the started server an in-process fake Redis')
+    parser.add_argument('--redis-port', type=int, default=6390)
+    parser.add_argument('--max-p99-ms', type=float)
+    parser.add_argument('--min-throughput', type=float, help='delivered messages per second')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args(argv)
+    args.clients += args.clients % 2
+
+    process = None
+    fake_redis = None
+    cleanup()
+    try:
+        if args.server == 'none':
+            args.url = args.url or 'http://127.0.0.1:8001'
+        else:
+            args.url = f'http://127.0.0.1:{args.port}'
+            env = dict(os.environ, CHAT_PORT=str(args.port), CHAT_RATE_LIMIT_MESSAGES='1000000')
+            if args.fake_redis:
+                fake_redis = start_fake_redis(args.redis_port)
+                env['REDIS_URL'] = f'redis://127.0.0.1:{args.redis_port}/0'
+            process = start_server(args.server, args.port, env)
+            args.server_pid = process.pid
+        wait_for_server(args.url, process)
+        report = run(args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if fake_redis is not None:
+            fake_redis.shutdown()
+        cleanup()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    failures = check(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+from django.dispatch import Signal
 from django.utils import timezone
 from django.template import Template, Context
 from .models import Notification, NotificationPreference, NotificationTemplate
@@ -7,6 +8,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Sent with notifications=[...] once in-app notifications are saved; the chat
+# app pushes them to the recipients' open sockets
+notifications_created = Signal()
+
 class NotificationService:
     
     @staticmethod
@@ -63,8 +68,70 @@ class NotificationService:
         notification.mark_as_delivered()
         
         logger.info(f"Created notification {notification.id} for {recipient.username}")
+        notifications_created.send(sender=Notification, notifications=[notification])
         return notification
     
+    @staticmethod
+    def create_notifications_bulk(
+        notification_type: str,
+        entries: List[Dict[str, Any]],
+        priority: str = 'medium',
+        related_object_type: str = None
+    ) -> List[Notification]:
+        """Create one notification per entry with a fixed number of queries.
+        
+        Each entry holds 'recipient', 'context' and optionally 'related_object_id'.
+        """
+        if not entries:
+            return []
+        
+        recipient_ids = {entry['recipient'].id for entry in entries}
+        prefs_by_user = {
+            prefs.user_id: prefs
+            for prefs in NotificationPreference.objects.filter(user_id__in=recipient_ids)
+        }
+        
+        template = NotificationTemplate.objects.filter(notification_type=notification_type).first()
+        if not template:
+            template = NotificationService._create_default_template(notification_type)
+        
+        now = timezone.now()
+        notifications = []
+        for entry in entries:
+            recipient = entry['recipient']
+            prefs = prefs_by_user.get(recipient.id)
+            if prefs and not prefs.enable_in_app:
+                continue
+            if not NotificationService._should_send_notification(prefs, notification_type):
+                continue
+            
+            context = entry.get('context', {})
+            try:
+                title, message, action_url = template.render(context)
+            except Exception as e:
+                logger.error(f"Error rendering notification template {notification_type}: {e}")
+                continue
+            
+            related_object_id = entry.get('related_object_id')
+            notifications.append(Notification(
+                recipient=recipient,
+                title=title,
+                message=message,
+                notification_type=notification_type,
+                priority=priority,
+                action_url=action_url,
+                related_object_type=related_object_type,
+                related_object_id=str(related_object_id) if related_object_id else None,
+                metadata=context,
+                delivered_at=now
+            ))
+        
+        created = Notification.objects.bulk_create(notifications)
+        logger.info(f"Created {len(created)} {notification_type} notifications")
+        if created:
+            notifications_created.send(sender=Notification, notifications=created)
+        return created
+    
     @staticmethod
     def _should_send_notification(prefs: NotificationPreference, notification_type: str) -> bool:
         """Check if notification should be sent based on preferences"""
@@ -116,6 +183,11 @@ class NotificationService:
                 'message': 'Your booking with {vendor_name} for {event_type} is confirmed for {event_date}.',
                 'action_url': '/dashboard/bookings/{booking_id}'
             },
+            'booking_cancelled': {
+                'title': 'Booking Cancelled',
+                'message': 'Your booking with {other_party} for {event_date} was cancelled.',
+                'action_url': '/dashboard/bookings/{booking_id}'
+            },
             'payment_due': {
                 'title': 'Payment Due',
                 'message': 'Payment of ${amount} is due for your {event_type} booking.',
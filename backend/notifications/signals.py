@@ -3,24 +3,29 @@ from django.dispatch import receiver
 from django.apps import apps
 from .services import CustomerNotifications, VendorNotifications, MessageNotifications
 
+def notify_new_message(message):
+    """Notify the other participant of a new chat message"""
+    conversation = message.conversation
+    recipient = conversation.get_other_user(message.sender)
+    
+    # Get event type from conversation context
+    event_type = "your event"
+    if hasattr(conversation, 'context') and conversation.context:
+        event_type = getattr(conversation.context, 'event_title', 'your event')
+    
+    MessageNotifications.new_message(
+        recipient=recipient,
+        sender_name=message.sender.username,
+        event_type=event_type,
+        conversation_id=conversation.id
+    )
+
 @receiver(post_save, sender='chat.Message')
 def create_message_notification(sender, instance, created, **kwargs):
     """Create notification when new message is sent"""
-    if created and instance.message_type == 'text':
-        conversation = instance.conversation
-        recipient = conversation.get_other_user(instance.sender)
-        
-        # Get event type from conversation context
-        event_type = "your event"
-        if hasattr(conversation, 'context') and conversation.context:
-            event_type = getattr(conversation.context, 'event_title', 'your event')
-        
-        MessageNotifications.new_message(
-            recipient=recipient,
-            sender_name=instance.sender.username,
-            event_type=event_type,
-            conversation_id=conversation.id
-        )
+    # The asyncio chat server notifies after broadcasting, off its hot path
+    if created and instance.message_type == 'text' and not getattr(instance, 'defer_notification', False):
+        notify_new_message(instance)
 
 @receiver(post_save, sender='events.QuoteRequest')
 def create_quote_notifications(sender, instance, created, **kwargs):
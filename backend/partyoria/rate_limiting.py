@@ -0,0 +1,151 @@
+"""Token-bucket rate limiting shared by the chat servers and the HTTP API.
+
+Limits use GCRA, the generic cell rate algorithm: each key stores a single
+number, its theoretical arrival time (TAT). A request moves the TAT forward by
+one emission interval (period / rate) per token and is allowed while the TAT
+stays within `burst` intervals of now. That is a token bucket refilling at
+`rate` per `period` with room for `burst` tokens, without a counter window
+that resets.
+
+The check and update run in one Lua script, loaded once and called with
+EVALSHA, so concurrent requests cannot race and Redis' clock is the only clock.
+When Redis is unreachable each process applies the same limits on its own.
+"""
+import logging
+import math
+import threading
+import time
+
+import redis
+
+from .redis_store import get_redis, mark_unavailable
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+
+# KEYS[1] = bucket key; ARGV = emission interval (seconds), burst, cost
+# Returns {allowed, retry_after}; numbers go back as strings to keep fractions
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * cost
+local allow_at = new_tat - interval * burst
+if now < allow_at then
+    return {0, tostring(allow_at - now)}
+end
+
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+
+class RateLimit:
+    """`rate` requests per `period` seconds, with up to `burst` at once (default: rate)"""
+
+    def __init__(self, name, rate, period, burst=None):
+        self.name = name
+        self.rate = rate
+        self.period = period
+        self.burst = burst or rate
+        self.interval = period / rate
+
+    def key(self, identifier):
+        return f'{KEY_PREFIX}:{self.name}:{identifier}'
+
+    def script_args(self, cost):
+        return [repr(self.interval), self.burst, cost]
+
+
+class LocalBuckets:
+    """The same algorithm in process memory, used while Redis is unreachable"""
+
+    # Forget idle buckets once this many are stored
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self.tats = {}
+        self.lock = threading.Lock()
+
+    def hit(self, limit, key, cost=1, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            tat = max(self.tats.get(key, now), now)
+            new_tat = tat + limit.interval * cost
+            allow_at = new_tat - limit.interval * limit.burst
+            if now < allow_at:
+                return False, allow_at - now
+            if len(self.tats) >= self.MAX_KEYS:
+                self.tats = {k: v for k, v in self.tats.items() if v > now}
+            self.tats[key] = new_tat
+            return True, 0.0
+
+
+local_buckets = LocalBuckets()
+
+
+def _result(reply):
+    allowed, retry_after = reply
+    return bool(int(allowed)), float(retry_after)
+
+
+class TokenBucketLimiter:
+    """Synchronous limiter over the shared Redis client (web and eventlet processes)"""
+
+    def __init__(self):
+        # (client, Script): a Script keeps its SHA and reloads itself on NOSCRIPT,
+        # but only for the client that registered it
+        self._registered = (None, None)
+
+    def _script(self, client):
+        registered_client, script = self._registered
+        if registered_client is not client:
+            script = client.register_script(GCRA_SCRIPT)
+            self._registered = (client, script)
+        return script
+
+    def hit(self, limit, identifier, cost=1):
+        """Spend cost tokens; returns (allowed, seconds until it would be allowed)"""
+        key = limit.key(identifier)
+        client = get_redis()
+        if client is not None:
+            try:
+                return _result(self._script(client)(keys=[key], args=limit.script_args(cost)))
+            except redis.RedisError as e:
+                logger.warning(f"Rate limiting locally, Redis failed: {e}")
+                mark_unavailable()
+        return local_buckets.hit(limit, key, cost)
+
+
+class AsyncTokenBucketLimiter:
+    """Limiter for the asyncio chat server; redis_client is a redis.asyncio client or None"""
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self._script = redis_client.register_script(GCRA_SCRIPT) if redis_client is not None else None
+
+    async def hit(self, limit, identifier, cost=1):
+        key = limit.key(identifier)
+        if self._script is not None:
+            try:
+                return _result(await self._script(keys=[key], args=limit.script_args(cost)))
+            except redis.RedisError as e:
+                logger.warning(f"Rate limiting locally, Redis failed: {e}")
+        return local_buckets.hit(limit, key, cost)
+
+
+limiter = TokenBucketLimiter()
+
+
+def retry_after_header(seconds):
+    """Whole seconds for a Retry-After header"""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,44 @@
+"""Synchronous Redis client shared by the chat and rate limiting code in web, worker and chat processes"""
+import logging
+import time
+
+import redis
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before trying an unreachable Redis again
+RETRY_AFTER = 30
+
+_client = None
+_down_until = 0
+
+
+def get_redis():
+    """Return a connected client, or None while Redis is unreachable"""
+    global _client, _down_until
+    if _client is not None:
+        return _client
+    if time.monotonic() < _down_until:
+        return None
+
+    client = redis.Redis.from_url(
+        config('REDIS_URL', default='redis://localhost:6379/0'),
+        socket_connect_timeout=1,
+        socket_timeout=2
+    )
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        logger.warning(f"Redis not available: {e}")
+        _down_until = time.monotonic() + RETRY_AFTER
+        return None
+    _client = client
+    return client
+
+
+def mark_unavailable():
+    """Drop the client after a failed command; callers fall back until RETRY_AFTER passes"""
+    global _client, _down_until
+    _client = None
+    _down_until = time.monotonic() + RETRY_AFTER
@@ -9,6 +9,7 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from functools import wraps
 import logging
+from .rate_limiting import RateLimit, limiter, retry_after_header
 
 logger = logging.getLogger(__name__)
 
@@ -161,40 +162,31 @@ def validate_request_data(required_fields: List[str], optional_fields: List[str]
     return decorator
 
 class RateLimiter:
-    """Simple rate limiting"""
-    _attempts = {}
+    """Token-bucket rate limiting, shared across processes through Redis"""
     
     @classmethod
-    def check_rate_limit(cls, identifier: str, max_attempts: int = 100, window: int = 3600) -> bool:
-        """Check if request is within rate limit"""
-        import time
-        now = time.time()
-        
-        if identifier not in cls._attempts:
-            cls._attempts[identifier] = []
-        
-        # Clean old attempts
-        cls._attempts[identifier] = [
-            attempt for attempt in cls._attempts[identifier] 
-            if now - attempt < window
-        ]
-        
-        # Check limit
-        if len(cls._attempts[identifier]) >= max_attempts:
+    def check_rate_limit(cls, identifier: str, max_attempts: int = 100, window: int = 3600,
+                         scope: str = 'api') -> bool:
+        """Check if request is within rate limit: max_attempts per window seconds, refilled continuously"""
+        allowed, _ = limiter.hit(RateLimit(f'{scope}:{max_attempts}:{window}', max_attempts, window), identifier)
+        if not allowed:
             logger.warning(f"Rate limit exceeded for {identifier}")
-            return False
-        
-        cls._attempts[identifier].append(now)
-        return True
+        return allowed
 
 def rate_limit(max_attempts: int = 100, window: int = 3600):
-    """Rate limiting decorator"""
+    """Rate limiting decorator; each view has its own bucket per client address"""
     def decorator(view_func):
+        limit = RateLimit(f'view:{view_func.__module__}.{view_func.__qualname__}', max_attempts, window)
+        
         @wraps(view_func)
         def wrapper(request, *args, **kwargs):
             identifier = request.META.get('REMOTE_ADDR', 'unknown')
-            if not RateLimiter.check_rate_limit(identifier, max_attempts, window):
-                return JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+            allowed, retry_after = limiter.hit(limit, identifier)
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for {identifier}")
+                response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+                response['Retry-After'] = retry_after_header(retry_after)
+                return response
             return view_func(request, *args, **kwargs)
         return wrapper
     return decorator
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.middleware.security import SecurityMiddleware
 from django.http import HttpResponseForbidden, JsonResponse
+from django.http.multipartparser import MultiPartParserError
 from django.core.cache import cache
 from django.utils import timezone
 from datetime import timedelta
@@ -30,6 +31,9 @@ class SecurityHardeningMiddleware:
             r'(--|#|/\*|\*/)',
         ]
         
+        # Request bodies that are streamed to storage instead of inspected
+        self.binary_content_types = {'application/octet-stream', 'application/offset+octet-stream'}
+        
         # Rate limiting
         self.rate_limits = {
             'login': {'requests': 5, 'window': 900},  # 5 requests per 15 minutes
@@ -94,6 +98,19 @@ class SecurityHardeningMiddleware:
             if self._is_malicious_string(value):
                 return True
         
+        # File bodies are not text, and reading them here would buffer whole uploads in memory
+        content_type = request.META.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+        if content_type in self.binary_content_types:
+            return False
+        
+        # Multipart: check the form fields; file parts go to the upload handlers as usual
+        if content_type == 'multipart/form-data':
+            try:
+                fields = request.POST.lists()
+            except MultiPartParserError:
+                return False  # the view answers malformed forms with a 400
+            return any(self._is_malicious_string(value) for _, values in fields for value in values)
+        
         # Check POST data
         if hasattr(request, 'body') and request.body:
             try:
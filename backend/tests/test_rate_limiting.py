@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+from django.http import JsonResponse
+from django.test import SimpleTestCase, RequestFactory
+
+from partyoria import rate_limiting
+from partyoria.rate_limiting import (
+    RateLimit, LocalBuckets, TokenBucketLimiter, AsyncTokenBucketLimiter
+)
+from partyoria.security_core import rate_limit
+
+
+class RedisTokenBucketTestCase(SimpleTestCase):
+    """The Lua GCRA script, run through fakeredis' Lua support"""
+
+    def setUp(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        self.fakeredis = fakeredis
+        self.redis = fakeredis.FakeRedis()
+        patcher = patch.object(rate_limiting, 'get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = TokenBucketLimiter()
+
+    def test_burst_then_reject_with_retry_after(self):
+        limit = RateLimit('test', rate=5, period=60)
+
+        results = [self.limiter.hit(limit, 'user-1') for _ in range(6)]
+
+        self.assertEqual([allowed for allowed, _ in results], [True] * 5 + [False])
+        self.assertAlmostEqual(results[-1][1], 12, delta=0.5)
+        # Buckets are per identifier
+        self.assertTrue(self.limiter.hit(limit, 'user-2')[0])
+
+    def test_script_is_loaded_once_and_called_by_sha(self):
+        limit = RateLimit('test', rate=5, period=60)
+        with patch.object(self.redis, 'script_load', wraps=self.redis.script_load) as script_load, \
+                patch.object(self.redis, 'eval') as plain_eval:
+            for _ in range(3):
+                self.limiter.hit(limit, 'user-1')
+
+        self.assertEqual(script_load.call_count, 1)
+        plain_eval.assert_not_called()
+
+    def test_new_client_gets_its_own_script(self):
+        """After get_redis() reconnects, the script is registered on the new client"""
+        limit = RateLimit('test', rate=5, period=60)
+        self.limiter.hit(limit, 'user-1')
+        reconnected = self.fakeredis.FakeRedis(server=self.redis.connection_pool.connection_kwargs['server'])
+
+        with patch.object(rate_limiting, 'get_redis', return_value=reconnected), \
+                patch.object(reconnected, 'register_script', wraps=reconnected.register_script) as register:
+            self.assertTrue(self.limiter.hit(limit, 'user-1')[0])
+
+        register.assert_called_once()
+
+    def test_concurrent_requests_do_not_exceed_burst(self):
+        limit = RateLimit('test', rate=10, period=3600)
+        allowed = []
+
+        def worker():
+            for _ in range(10):
+                allowed.append(self.limiter.hit(limit, 'shared')[0])
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(allowed.count(True), 10)
+
+    def test_async_limiter_uses_same_script(self):
+        async def scenario():
+            limiter = AsyncTokenBucketLimiter(self.fakeredis.aioredis.FakeRedis())
+            limit = RateLimit('test', rate=2, period=60)
+            return [(await limiter.hit(limit, 'user-1'))[0] for _ in range(3)]
+
+        self.assertEqual(asyncio.run(scenario()), [True, True, False])
+
+
+class LocalTokenBucketTestCase(SimpleTestCase):
+    """Fallback used while Redis is unreachable"""
+
+    def test_tokens_refill_over_time(self):
+        buckets = LocalBuckets()
+        limit = RateLimit('test', rate=2, period=10, burst=2)
+
+        self.assertEqual([buckets.hit(limit, 'k', now=100)[0] for _ in range(3)], [True, True, False])
+        self.assertFalse(buckets.hit(limit, 'k', now=104)[0])
+        self.assertTrue(buckets.hit(limit, 'k', now=105)[0])
+
+    def test_limiter_falls_back_without_redis(self):
+        limit = RateLimit('fallback-test', rate=1, period=60)
+        with patch.object(rate_limiting, 'get_redis', return_value=None), \
+                patch.object(rate_limiting, 'local_buckets', LocalBuckets()):
+            self.assertTrue(TokenBucketLimiter().hit(limit, 'user-1')[0])
+            self.assertFalse(TokenBucketLimiter().hit(limit, 'user-1')[0])
+
+    def test_view_decorator_returns_429_with_retry_after(self):
+        @rate_limit(max_attempts=1, window=60)
+        def view(request):
+            return JsonResponse({'ok': True})
+
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        with patch.object(rate_limiting, 'get_redis', return_value=None), \
+                patch.object(rate_limiting, 'local_buckets', LocalBuckets()):
+            self.assertEqual(view(request).status_code, 200)
+            response = view(request)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
@@ -0,0 +1,36 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, RequestFactory
+
+from partyoria.security_hardening import SecurityHardeningMiddleware
+
+
+class MaliciousContentTestCase(SimpleTestCase):
+    """Which request bodies the hardening middleware inspects"""
+
+    def setUp(self):
+        self.middleware = SecurityHardeningMiddleware(lambda request: None)
+        self.factory = RequestFactory()
+
+    def test_multipart_form_fields_are_inspected(self):
+        request = self.factory.post('/api/chat/messages/', {
+            'content': '<script>alert(1)</script>',
+            'file': SimpleUploadedFile('photo.jpg', b'\xff\xd8\xff binary', content_type='image/jpeg')
+        })
+
+        self.assertTrue(self.middleware._contains_malicious_content(request))
+
+    def test_multipart_file_contents_are_not_inspected(self):
+        request = self.factory.post('/api/chat/messages/', {
+            'content': 'Venue photos',
+            'file': SimpleUploadedFile('notes.txt', b'<script>alert(1)</script>', content_type='text/plain')
+        })
+
+        self.assertFalse(self.middleware._contains_malicious_content(request))
+
+    def test_octet_stream_body_is_skipped(self):
+        request = self.factory.patch(
+            '/api/chat/uploads/1/', b'<script>alert(1)</script>', content_type='application/offset+octet-stream'
+        )
+
+        self.assertFalse(self.middleware._contains_malicious_content(request))
+        self.assertFalse(hasattr(request, '_body'))
@@ -0,0 +1,453 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from vendors.models import CalendarEvent
+from vendors.booking_models import Booking
+from vendors import availability
+
+User = get_user_model()
+
+
+class VendorCalendarTestCase(APITestCase):
+    """Base test case with a vendor and a customer"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.vendor = User.objects.create_user(
+            username='calvendor',
+            email='calvendor@example.com',
+            password='testpass123',
+            user_type='vendor'
+        )
+        self.customer = User.objects.create_user(
+            username='calcustomer',
+            email='calcustomer@example.com',
+            password='testpass123',
+            user_type='customer'
+        )
+        self.client.force_authenticate(user=self.vendor)
+
+    def create_calendar_event(self, day, vendor=None, hour=10):
+        return CalendarEvent.objects.create(
+            vendor=vendor or self.vendor,
+            title='Engagement',
+            event_date=timezone.make_aware(datetime(day.year, day.month, day.day, hour))
+        )
+
+    def create_booking(self, day, vendor=None, booking_status='confirmed'):
+        return Booking.objects.create(
+            vendor=vendor or self.vendor,
+            customer=self.customer,
+            customer_name='Customer',
+            service_type='Catering',
+            event_date=day,
+            amount=Decimal('1000.00'),
+            status=booking_status
+        )
+
+
+class AvailabilityRangeTestCase(VendorCalendarTestCase):
+    """Test the date-range availability endpoint"""
+
+    url = '/api/vendor/calendar/availability/range/'
+
+    def test_bitmap_encoding(self):
+        """Busy days from events and confirmed bookings are set in the month bitmap"""
+        self.create_calendar_event(date(2026, 3, 1))
+        self.create_calendar_event(date(2026, 3, 1), hour=15)
+        self.create_booking(date(2026, 3, 3))
+        self.create_booking(date(2026, 3, 5), booking_status='cancelled')
+        self.create_booking(date(2026, 4, 2))
+
+        response = self.client.get(self.url, {'start': '2026-03-01', 'end': '2026-04-30', 'counts': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['months'], {'2026-03': '5', '2026-04': '2'})
+        self.assertEqual(response.data['counts'], {'2026-03-01': 2, '2026-03-03': 1, '2026-04-02': 1})
+
+    def test_runs_encoding(self):
+        """Consecutive busy days collapse into a single run"""
+        for day in (2, 3, 4, 8):
+            self.create_calendar_event(date(2026, 5, day))
+
+        response = self.client.get(self.url, {'start': '2026-05-01', 'end': '2026-05-31', 'encoding': 'runs'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['busy'], [[1, 3], [7, 1]])
+
+    def test_single_occupancy_query(self):
+        """Occupancy for any window is read with one statement"""
+        for day in range(1, 29):
+            self.create_calendar_event(date(2026, 2, day))
+            self.create_booking(date(2026, 2, day))
+
+        with CaptureQueriesContext(connection) as queries:
+            occupancy = availability.occupancy_by_day(self.vendor.id, date(2026, 2, 1), date(2026, 2, 28))
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(occupancy), 28)
+
+    def test_etag_not_modified(self):
+        """Unchanged calendars answer 304 and changes produce a new ETag"""
+        self.create_calendar_event(date(2026, 6, 10))
+        params = {'start': '2026-06-01', 'end': '2026-06-30'}
+
+        first = self.client.get(self.url, params)
+        etag = first['ETag']
+
+        cached = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.create_booking(date(2026, 6, 12))
+        changed = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_invalid_range(self):
+        """Reversed and oversized windows are rejected"""
+        response = self.client.get(self.url, {'start': '2026-06-30', 'end': '2026-06-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.url, {'start': '2026-01-01', 'end': '2027-06-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkAvailabilityTestCase(VendorCalendarTestCase):
+    """Test bulk availability checks and quote matching"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_vendors = [
+            User.objects.create_user(
+                username=f'caterer{i}',
+                email=f'caterer{i}@example.com',
+                password='testpass123',
+                user_type='vendor',
+                business='Catering'
+            ) for i in range(5)
+        ]
+
+    def test_free_vendor_ids_single_query(self):
+        """Availability for any number of vendors costs one query"""
+        booked, busy, *free = self.other_vendors
+        self.create_booking(date(2026, 7, 4), vendor=booked)
+        self.create_booking(date(2026, 7, 4), vendor=free[0], booking_status='cancelled')
+        self.create_calendar_event(date(2026, 7, 4), vendor=busy)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = availability.free_vendor_ids([v.id for v in self.other_vendors], date(2026, 7, 4))
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(result, {v.id for v in free})
+
+    def test_bulk_endpoint(self):
+        """The bulk endpoint splits vendors into free and busy"""
+        booked = self.other_vendors[0]
+        self.create_booking(date(2026, 7, 6), vendor=booked)
+
+        response = self.client.post('/api/vendor/calendar/availability/bulk/', {
+            'vendor_ids': [v.id for v in self.other_vendors],
+            'start': '2026-07-01',
+            'end': '2026-07-10'
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['busy'], [booked.id])
+        self.assertEqual(len(response.data['free']), 4)
+
+    def test_match_vendors_skips_booked(self):
+        """Quote matching drops vendors already booked on the event date"""
+        from events.models import Event
+        from events.quote_views import match_vendors_to_event
+
+        booked = self.other_vendors[0]
+        self.create_booking(date(2026, 8, 15), vendor=booked)
+        event = Event.objects.create(
+            event_name='Summer Party',
+            user=self.customer,
+            event_type='birthday',
+            attendees=40,
+            total_budget=Decimal('5000.00'),
+            form_data={'dateTime': '2026-08-15'},
+            services=['catering']
+        )
+
+        matched, _ = match_vendors_to_event(event)
+        matched_ids = {v.id for v in matched}
+
+        self.assertNotIn(booked.id, matched_ids)
+        self.assertTrue({v.id for v in self.other_vendors[1:]} <= matched_ids)
+
+    def test_match_vendors_ignores_availability_without_a_date(self):
+        """An unparseable event date does not filter on today's bookings"""
+        from events.models import Event
+        from events.quote_views import match_vendors_to_event
+
+        booked = self.other_vendors[0]
+        self.create_booking(timezone.now().date(), vendor=booked)
+        event = Event.objects.create(
+            event_name='Someday Party',
+            user=self.customer,
+            event_type='birthday',
+            attendees=40,
+            total_budget=Decimal('5000.00'),
+            form_data={'dateTime': 'next summer'},
+            services=['catering']
+        )
+
+        matched, _ = match_vendors_to_event(event)
+
+        self.assertIn(booked.id, {v.id for v in matched})
+
+
+class CalendarFeedTestCase(VendorCalendarTestCase):
+    """Test the per-vendor iCalendar feed"""
+
+    def get_feed_url(self):
+        response = self.client.get('/api/vendor/calendar/feed-url/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['feed_url']
+
+    def test_feed_streams_events_and_confirmed_bookings(self):
+        """The feed lists calendar entries and confirmed bookings only"""
+        self.create_calendar_event(date(2026, 9, 1))
+        self.create_booking(date(2026, 9, 2))
+        self.create_booking(date(2026, 9, 3), booking_status='pending_vendor')
+
+        feed = APIClient().get(self.get_feed_url())
+
+        self.assertEqual(feed.status_code, status.HTTP_200_OK)
+        self.assertTrue(feed.streaming)
+        body = b''.join(feed.streaming_content).decode()
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('DTSTART;VALUE=DATE:20260902', body)
+        self.assertIn('DTEND;VALUE=DATE:20260903', body)
+        self.assertNotIn('DTSTART;VALUE=DATE:20260903', body)
+        # Every entry has an end, and customers stay private
+        self.assertEqual(body.count('DTEND'), 2)
+        self.assertNotIn('Customer', body)
+
+    def test_unchanged_feed_not_modified(self):
+        """Polls with a current ETag answer 304 without reading any rows"""
+        self.create_calendar_event(date(2026, 9, 1))
+        url = self.get_feed_url()
+        client = APIClient()
+        etag = client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # The token lookup and the calendar version
+        self.assertEqual(len(queries), 2)
+
+    def test_regenerate_revokes_old_url(self):
+        old_url = self.get_feed_url()
+        self.assertEqual(self.get_feed_url(), old_url)
+
+        response = self.client.post('/api/vendor/calendar/feed-url/regenerate/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data['feed_url'], old_url)
+        self.assertEqual(APIClient().get(old_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(APIClient().get(response.data['feed_url']).status_code, status.HTTP_200_OK)
+
+    def test_invalid_token(self):
+        response = APIClient().get('/api/vendor/calendar/feed/1:forged.ics')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookingConflictTestCase(VendorCalendarTestCase):
+    """Test interval conflict detection and enforcement"""
+
+    def test_bulk_slots_single_query(self):
+        """Many candidate slots are tested with one query"""
+        from vendors.booking_conflicts import find_conflicts
+
+        self.create_booking(date(2026, 10, 3))
+        self.create_booking(date(2026, 10, 9), booking_status='pending_vendor')
+        self.create_calendar_event(date(2026, 10, 20))
+        slots = [(date(2026, 10, day), date(2026, 10, day + 1)) for day in range(1, 30, 2)]
+
+        with CaptureQueriesContext(connection) as queries:
+            results = find_conflicts(self.vendor.id, slots)
+
+        self.assertEqual(len(queries), 1)
+        conflicting = {slots[i][0].day: days for i, days in enumerate(results) if days}
+        self.assertEqual(conflicting, {3: [date(2026, 10, 3)], 19: [date(2026, 10, 20)]})
+
+    def test_conflicts_endpoint(self):
+        self.create_booking(date(2026, 10, 3))
+
+        response = self.client.post('/api/vendor/bookings/conflicts/', {
+            'vendor_id': self.vendor.id,
+            'slots': [{'start': '2026-10-01', 'end': '2026-10-05'}, {'start': '2026-10-06'}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [slot['available'] for slot in response.data['slots']],
+            [False, True]
+        )
+
+    def test_confirm_rejects_double_booking(self):
+        """Confirming a second booking on an already confirmed day is refused"""
+        self.create_booking(date(2026, 11, 14))
+        pending = self.create_booking(date(2026, 11, 14), booking_status='pending_vendor')
+
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['conflicts'], ['2026-11-14'])
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'pending_vendor')
+
+    def test_conflicts_endpoint_invalid_vendor(self):
+        response = self.client.post('/api/vendor/bookings/conflicts/', {
+            'vendor_id': 'abc',
+            'slots': [{'start': '2026-10-01'}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm_rejects_calendar_block(self):
+        """A day blocked by a calendar event cannot be confirmed either"""
+        self.create_calendar_event(date(2026, 11, 16))
+        pending = self.create_booking(date(2026, 11, 16), booking_status='pending_vendor')
+
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['conflicts'], ['2026-11-16'])
+
+    def test_calendar_block_cannot_link_another_vendors_booking(self):
+        """A linked entry no longer blocks its day, so foreign bookings are refused"""
+        other_vendor = User.objects.create_user(
+            username='othervendor', email='othervendor@example.com', password='testpass123', user_type='vendor'
+        )
+        foreign = self.create_booking(date(2026, 11, 18), vendor=other_vendor)
+        payload = {'title': 'Private event', 'event_date': '2026-11-18T10:00:00Z', 'booking_id': foreign.id}
+
+        response = self.client.post('/api/vendor/calendar/events/create/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CalendarEvent.objects.exists())
+
+    def test_confirm_free_day(self):
+        pending = self.create_booking(date(2026, 11, 15), booking_status='pending_vendor')
+
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'confirmed')
+
+
+    def test_migration_cancels_existing_overlaps(self):
+        """Overlaps from before the exclusion constraint are resolved before it is added"""
+        from importlib import import_module
+        from django.apps import apps
+
+        migration = import_module('vendors.migrations.0010_booking_no_overlap')
+        kept = self.create_booking(date(2026, 12, 1))
+        clash = self.create_booking(date(2026, 12, 1), booking_status='completed')
+        other_day = self.create_booking(date(2026, 12, 2))
+
+        migration.cancel_overlapping_bookings(apps, None)
+
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {kept.id: 'confirmed', clash.id: 'cancelled', other_day.id: 'confirmed'})
+
+class BookingTransitionTestCase(VendorCalendarTestCase):
+    """Test versioned booking transitions and bulk updates"""
+
+    url = '/api/vendor/bookings/bulk-transition/'
+
+    def test_bulk_confirm_constant_queries(self):
+        """Confirming a batch costs the same number of queries as confirming one"""
+        def confirm(count, month):
+            pending = [
+                self.create_booking(date(2027, month, day), booking_status='pending_vendor')
+                for day in range(1, count + 1)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, {
+                    'action': 'confirm',
+                    'booking_ids': [b.id for b in pending]
+                }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['updated']), count)
+            return len(queries)
+
+        # The first batch also creates the notification template
+        confirm(1, 1)
+        self.assertEqual(confirm(2, 2), confirm(20, 3))
+        self.assertEqual(CalendarEvent.objects.filter(booking__isnull=False).count(), 23)
+        self.assertEqual(Booking.objects.filter(status='confirmed', version=1).count(), 23)
+
+    def test_bulk_confirm_skips_conflicts_and_invalid(self):
+        """Per-booking failures are reported without aborting the batch"""
+        self.create_booking(date(2027, 3, 1))
+        clash = self.create_booking(date(2027, 3, 1), booking_status='pending_vendor')
+        first = self.create_booking(date(2027, 3, 2), booking_status='pending_vendor')
+        second = self.create_booking(date(2027, 3, 2), booking_status='pending_vendor')
+        done = self.create_booking(date(2027, 3, 3), booking_status='cancelled')
+
+        response = self.client.post(self.url, {
+            'action': 'confirm',
+            'booking_ids': [clash.id, first.id, second.id, done.id, 999999]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([b['id'] for b in response.data['updated']], [first.id])
+        self.assertEqual(response.data['skipped'], {
+            str(clash.id): 'conflict',
+            str(second.id): 'conflict',
+            str(done.id): 'invalid_state',
+            '999999': 'not_found'
+        })
+
+    def test_stale_version_rejected(self):
+        pending = self.create_booking(date(2027, 4, 1), booking_status='pending_vendor')
+
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/', {'version': 3}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['reason'], 'stale')
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'pending_vendor')
+
+    def test_invalid_version_rejected(self):
+        pending = self.create_booking(date(2026, 11, 22), booking_status='pending_vendor')
+
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/', {'version': 'x'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancel_removes_calendar_entry(self):
+        """Cancelling a confirmed booking frees the day and notifies the other party"""
+        from notifications.models import Notification
+
+        pending = self.create_booking(date(2027, 5, 1), booking_status='pending_vendor')
+        self.client.post(f'/api/vendor/bookings/{pending.id}/confirm/', {'version': 0}, format='json')
+        self.assertTrue(CalendarEvent.objects.filter(booking=pending).exists())
+
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(f'/api/vendor/bookings/{pending.id}/cancel/', {
+            'version': 1,
+            'reason': 'Venue changed'
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['booking']['version'], 2)
+        self.assertFalse(CalendarEvent.objects.filter(booking=pending).exists())
+        self.assertTrue(Notification.objects.filter(recipient=self.vendor, notification_type='booking_cancelled').exists())
+        self.assertTrue(availability.free_vendor_ids([self.vendor.id], date(2027, 5, 1)))
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class VendorsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'vendors'
\ No newline at end of file
+    name = 'vendors'
+
+    def ready(self):
+        # Booking lives outside models.py; register it so CalendarEvent.booking resolves
+        from . import booking_models  # noqa: F401
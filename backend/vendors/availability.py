@@ -0,0 +1,144 @@
+"""Aggregate availability lookups over CalendarEvent and Booking"""
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CalendarEvent
+from .booking_models import Booking
+
+# Bookings in these states hold the vendor's day. Calendar entries created
+# for a booking (booking_id set) are counted through the booking itself.
+BLOCKING_BOOKING_STATUSES = ('confirmed', 'completed')
+
+# Upper bound for a single range request
+MAX_RANGE_DAYS = 366
+
+
+def day_bounds(start, end):
+    """Aware datetimes covering [start, end] so the (vendor, event_date) index stays usable"""
+    tz = timezone.get_current_timezone()
+    lower = timezone.make_aware(datetime.combine(start, time.min), tz)
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+    return lower, upper
+
+
+def _occupancy_rows(vendor_ids, start, end):
+    """(vendor_id, day, count) rows for calendar entries and blocking bookings in one statement"""
+    lower, upper = day_bounds(start, end)
+
+    events = CalendarEvent.objects.filter(
+        vendor_id__in=vendor_ids,
+        booking__isnull=True,
+        event_date__gte=lower,
+        event_date__lt=upper
+    ).annotate(day=TruncDate('event_date')).values('vendor_id', 'day').annotate(
+        total=Count('id')
+    ).values_list('vendor_id', 'day', 'total').order_by()
+
+    bookings = Booking.objects.filter(
+        vendor_id__in=vendor_ids,
+        status__in=BLOCKING_BOOKING_STATUSES,
+        event_date__gte=start,
+        event_date__lte=end
+    ).values('vendor_id', 'event_date').annotate(
+        total=Count('id')
+    ).values_list('vendor_id', 'event_date', 'total').order_by()
+
+    return events.union(bookings, all=True)
+
+
+def occupancy_by_day(vendor_id, start, end):
+    """Map each busy day in [start, end] to its number of calendar entries and bookings"""
+    occupancy = {}
+    for _, day, total in _occupancy_rows([vendor_id], start, end):
+        occupancy[day] = occupancy.get(day, 0) + total
+    return occupancy
+
+
+def busy_vendor_ids(vendor_ids, start, end=None):
+    """Vendors in vendor_ids with a calendar entry or blocking booking in [start, end], in one query"""
+    end = end or start
+    lower, upper = day_bounds(start, end)
+
+    events = CalendarEvent.objects.filter(
+        vendor_id__in=vendor_ids,
+        booking__isnull=True,
+        event_date__gte=lower,
+        event_date__lt=upper
+    ).values_list('vendor_id', flat=True).order_by()
+
+    bookings = Booking.objects.filter(
+        vendor_id__in=vendor_ids,
+        status__in=BLOCKING_BOOKING_STATUSES,
+        event_date__gte=start,
+        event_date__lte=end
+    ).values_list('vendor_id', flat=True).order_by()
+
+    return set(events.union(bookings))
+
+
+def free_vendor_ids(vendor_ids, start, end=None):
+    """Vendors in vendor_ids that are free for the whole of [start, end]"""
+    vendor_ids = set(vendor_ids)
+    if not vendor_ids:
+        return set()
+    return vendor_ids - busy_vendor_ids(vendor_ids, start, end)
+
+
+def iter_days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def encode_month_bitmaps(start, end, busy_days):
+    """Encode busy days as {'YYYY-MM': hex}, bit (day - 1) set when that day is busy"""
+    months = {}
+    for day in iter_days(start, end):
+        key = f"{day.year:04d}-{day.month:02d}"
+        bits = months.get(key, 0)
+        if day in busy_days:
+            bits |= 1 << (day.day - 1)
+        months[key] = bits
+    return {key: format(bits, 'x') for key, bits in months.items()}
+
+
+def encode_runs(start, end, busy_days):
+    """Encode busy days as [offset, length] runs relative to start"""
+    runs = []
+    for offset, day in enumerate(iter_days(start, end)):
+        if day not in busy_days:
+            continue
+        if runs and runs[-1][0] + runs[-1][1] == offset:
+            runs[-1][1] += 1
+        else:
+            runs.append([offset, 1])
+    return runs
+
+
+def calendar_version(vendor_id):
+    """Return (last_modified, signature) for a vendor's calendar entries and bookings.
+
+    Row counts are part of the signature so deletions change it as well.
+    """
+    events = CalendarEvent.objects.filter(vendor_id=vendor_id).values('vendor_id').annotate(
+        last=Max('updated_at'), total=Count('id')
+    ).values_list('last', 'total').order_by()
+    bookings = Booking.objects.filter(vendor_id=vendor_id).values('vendor_id').annotate(
+        last=Max('updated_at'), total=Count('id')
+    ).values_list('last', 'total').order_by()
+
+    rows = list(events.union(bookings, all=True))
+    stamps = [last for last, _ in rows if last]
+    last_modified = max(stamps) if stamps else None
+    signature = f"{vendor_id}:" + ";".join(sorted(f"{last.isoformat() if last else ''}/{total}" for last, total in rows))
+    return last_modified, signature
+
+
+def make_etag(signature, *parts):
+    raw = "|".join([signature] + [str(part) for part in parts])
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
@@ -2,11 +2,14 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from .booking_models import Booking
+from .booking_conflicts import find_conflicts
+from . import booking_state
 from events.models import QuoteRequest
 from authentication.models import CustomUser
-from datetime import datetime
+from datetime import date, datetime
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -54,6 +57,17 @@ def create_booking_from_quote(request):
                 'booking_id': existing.id
             }, status=400)
         
+        # Reject requests for a day the vendor is already booked
+        event_day = quote_request.event_date
+        if isinstance(event_day, datetime):
+            event_day = timezone.localdate(event_day)
+        taken = find_conflicts(vendor.id, [(event_day, event_day)])[0]
+        if taken:
+            return Response({
+                'error': 'Vendor is already booked on this date',
+                'conflicts': [day.isoformat() for day in taken]
+            }, status=409)
+        
         # Create booking with transaction
         with transaction.atomic():
             booking = Booking.objects.create(
@@ -109,6 +123,7 @@ def get_customer_bookings(request):
             'vendor_profile_picture': b.vendor.profile_picture.url if b.vendor.profile_picture else None,
             'amount': float(b.amount),
             'status': b.status,
+            'version': b.version,
             'event_date': b.event_date.isoformat(),
             'location': b.location,
             'description': b.description,
@@ -145,6 +160,7 @@ def get_vendor_bookings(request):
             'service_type': b.service_type,
             'amount': float(b.amount),
             'status': b.status,
+            'version': b.version,
             'event_date': b.event_date.isoformat(),
             'location': b.location,
             'description': b.description,
@@ -162,6 +178,18 @@ def get_vendor_bookings(request):
         return Response({'error': str(e)}, status=500)
 
 
+SKIP_RESPONSES = {
+    booking_state.NOT_FOUND: ('Booking not found', 404),
+    booking_state.INVALID_STATE: ('Booking cannot make this transition from its current status', 400),
+    booking_state.STALE: ('Booking was modified by another request, reload and retry', 409),
+    booking_state.CONFLICT: ('Vendor is already booked on this date', 409),
+}
+
+
+def _parse_version(value):
+    return int(value) if value not in (None, '') else None
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def confirm_booking(request, booking_id):
@@ -170,25 +198,38 @@ def confirm_booking(request, booking_id):
         if request.user.user_type != 'vendor':
             return Response({'error': 'Only vendors can confirm bookings'}, status=403)
         
-        booking = Booking.objects.get(id=booking_id, vendor=request.user)
-        
-        if booking.status != 'pending_vendor':
-            return Response({'error': 'Booking already processed'}, status=400)
-        
-        booking.status = 'confirmed'
-        booking.save()
+        try:
+            version = _parse_version(request.data.get('version'))
+        except (TypeError, ValueError):
+            return Response({'error': 'version must be an integer'}, status=400)
+        
+        booking, skipped = booking_state.transition_booking(
+            booking_id, 'confirm', request.user, version=version
+        )
+        if skipped == booking_state.CONFLICT:
+            event_date = Booking.objects.values_list('event_date', flat=True).get(id=booking_id)
+            return Response({
+                'error': SKIP_RESPONSES[skipped][0],
+                'reason': skipped,
+                'conflicts': [event_date.isoformat()]
+            }, status=409)
+        if skipped:
+            error, code = SKIP_RESPONSES[skipped]
+            return Response({'error': error, 'reason': skipped}, status=code)
         
         return Response({
             'success': True,
             'message': 'Booking confirmed successfully',
             'booking': {
                 'id': booking.id,
-                'status': booking.status
+                'status': booking.status,
+                'version': booking.version
             }
         })
         
-    except Booking.DoesNotExist:
-        return Response({'error': 'Booking not found'}, status=404)
+    except (booking_state.StaleBookingError, IntegrityError):
+        # Lost a race, or the Postgres exclusion constraint caught an overlap
+        return Response({'error': 'Booking could not be confirmed, reload and retry'}, status=409)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -198,27 +239,80 @@ def confirm_booking(request, booking_id):
 def cancel_booking(request, booking_id):
     """Cancel booking (customer or vendor)"""
     try:
-        booking = Booking.objects.get(id=booking_id)
+        try:
+            version = _parse_version(request.data.get('version'))
+        except (TypeError, ValueError):
+            return Response({'error': 'version must be an integer'}, status=400)
+        
+        booking, skipped = booking_state.transition_booking(
+            booking_id, 'cancel', request.user,
+            version=version,
+            reason=request.data.get('reason', '')
+        )
+        if skipped:
+            error, code = SKIP_RESPONSES[skipped]
+            return Response({'error': error, 'reason': skipped}, status=code)
         
-        # Check permission
-        if booking.customer != request.user and booking.vendor != request.user:
-            return Response({'error': 'Not authorized'}, status=403)
+        return Response({
+            'success': True,
+            'message': 'Booking cancelled successfully',
+            'booking': {
+                'id': booking.id,
+                'status': booking.status,
+                'version': booking.version
+            }
+        })
+        
+    except booking_state.StaleBookingError:
+        return Response({'error': 'Booking was modified by another request, reload and retry'}, status=409)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_transition_bookings(request):
+    """Confirm, cancel or complete many bookings in one request"""
+    try:
+        action = request.data.get('action')
+        booking_ids = request.data.get('booking_ids') or []
+        
+        if action not in booking_state.TRANSITIONS:
+            return Response({'error': f"action must be one of {', '.join(booking_state.TRANSITIONS)}"}, status=400)
         
-        if booking.status == 'completed':
-            return Response({'error': 'Cannot cancel completed booking'}, status=400)
+        if action in ('confirm', 'complete') and request.user.user_type != 'vendor':
+            return Response({'error': f'Only vendors can {action} bookings'}, status=403)
+        
+        if not booking_ids or len(booking_ids) > booking_state.MAX_BULK_SIZE:
+            return Response({'error': f'booking_ids must hold 1 to {booking_state.MAX_BULK_SIZE} ids'}, status=400)
+        
+        try:
+            booking_ids = [int(booking_id) for booking_id in booking_ids]
+            versions = {
+                int(booking_id): int(version)
+                for booking_id, version in (request.data.get('versions') or {}).items()
+            }
+        except (TypeError, ValueError, AttributeError):
+            return Response({'error': 'Invalid booking ids or versions'}, status=400)
         
-        reason = request.data.get('reason', '')
-        booking.status = 'cancelled'
-        booking.description = f"{booking.description}\n\nCancellation reason: {reason}"
-        booking.save()
+        updated, skipped = booking_state.bulk_transition(
+            booking_ids, action, request.user,
+            versions=versions,
+            reason=request.data.get('reason', '')
+        )
         
         return Response({
             'success': True,
-            'message': 'Booking cancelled successfully'
+            'updated': [{
+                'id': booking.id,
+                'status': booking.status,
+                'version': booking.version
+            } for booking in updated],
+            'skipped': {str(booking_id): reason for booking_id, reason in skipped.items()}
         })
         
-    except Booking.DoesNotExist:
-        return Response({'error': 'Booking not found'}, status=404)
+    except (booking_state.StaleBookingError, IntegrityError):
+        return Response({'error': 'Bookings were modified by another request, reload and retry'}, status=409)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -250,6 +344,7 @@ def get_booking_detail(request, booking_id):
             },
             'amount': float(booking.amount),
             'status': booking.status,
+            'version': booking.version,
             'event_date': booking.event_date.isoformat(),
             'location': booking.location,
             'description': booking.description,
@@ -267,3 +362,48 @@ def get_booking_detail(request, booking_id):
         return Response({'error': 'Booking not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def check_slot_conflicts(request):
+    """Test many candidate date slots for a vendor in one query"""
+    try:
+        try:
+            vendor_id = int(request.data.get('vendor_id') or request.user.id)
+        except (TypeError, ValueError):
+            return Response({'error': 'vendor_id must be an integer'}, status=400)
+        slots = request.data.get('slots') or []
+        
+        if not slots:
+            return Response({'error': 'slots required'}, status=400)
+        
+        if len(slots) > 366:
+            return Response({'error': 'At most 366 slots per request'}, status=400)
+        
+        try:
+            parsed = []
+            for slot in slots:
+                start = date.fromisoformat(slot['start'])
+                end = date.fromisoformat(slot.get('end') or slot['start'])
+                if end < start:
+                    raise ValueError
+                parsed.append((start, end))
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'Each slot needs a valid start (and optional end) date'}, status=400)
+        
+        results = find_conflicts(vendor_id, parsed)
+        
+        return Response({
+            'success': True,
+            'vendor_id': vendor_id,
+            'slots': [{
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'available': not conflicts,
+                'conflicts': [day.isoformat() for day in conflicts]
+            } for (start, end), conflicts in zip(parsed, results)]
+        })
+        
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
@@ -0,0 +1,72 @@
+"""Interval conflict detection for vendor bookings.
+
+Bookings occupy the half-open day interval [event_date, event_date + 1) and
+calendar entries occupy the day they fall on. Candidate slots are inclusive
+date ranges. Occupied days are fetched with one indexed range query and
+candidates are tested against the sorted list with binary search, so
+checking many slots costs a single query plus O((n + m) log n).
+
+On Postgres the same rule is enforced by the booking_no_overlap exclusion
+constraint (see migration 0010). Other backends have no such constraint, so
+booking_state runs this check under a row lock on the vendor when confirming.
+SQLite ignores row locks, so there the check is best effort only.
+"""
+from bisect import bisect_left, bisect_right
+
+from django.db.models import F
+from django.db.models.functions import TruncDate
+
+from .models import CalendarEvent
+from .booking_models import Booking
+from .availability import BLOCKING_BOOKING_STATUSES, day_bounds
+
+EXCLUSION_CONSTRAINT = 'booking_no_overlap'
+
+
+def occupied_days(vendor_id, start, end, include_calendar=True, exclude_booking_id=None):
+    """Sorted, de-duplicated days in [start, end] the vendor is already committed to"""
+    bookings = Booking.objects.filter(
+        vendor_id=vendor_id,
+        status__in=BLOCKING_BOOKING_STATUSES,
+        event_date__gte=start,
+        event_date__lte=end
+    )
+    if exclude_booking_id:
+        bookings = bookings.exclude(id=exclude_booking_id)
+    # Both sides of the UNION select an annotation named day
+    days = bookings.annotate(day=F('event_date')).values_list('day', flat=True).order_by()
+
+    if include_calendar:
+        lower, upper = day_bounds(start, end)
+        events = CalendarEvent.objects.filter(
+            vendor_id=vendor_id,
+            booking__isnull=True,
+            event_date__gte=lower,
+            event_date__lt=upper
+        ).annotate(day=TruncDate('event_date')).values_list('day', flat=True).order_by()
+        days = days.union(events)
+
+    return sorted(set(days))
+
+
+def _overlapping(days, start, end):
+    return days[bisect_left(days, start):bisect_right(days, end)]
+
+
+def find_conflicts(vendor_id, slots, include_calendar=True, exclude_booking_id=None):
+    """Test many (start, end) candidate slots at once.
+
+    Returns one list per slot holding the occupied days inside it; an empty
+    list means the slot is free.
+    """
+    if not slots:
+        return []
+    days = occupied_days(
+        vendor_id,
+        min(start for start, _ in slots),
+        max(end for _, end in slots),
+        include_calendar=include_calendar,
+        exclude_booking_id=exclude_booking_id
+    )
+    return [_overlapping(days, start, end) for start, end in slots]
+
@@ -16,6 +16,7 @@ class Booking(models.Model):
     event_date = models.DateField()
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending_vendor')
+    version = models.PositiveIntegerField(default=0)
     description = models.TextField(blank=True)
     location = models.CharField(max_length=500, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
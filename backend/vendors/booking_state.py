@@ -0,0 +1,191 @@
+"""Booking state machine with optimistic concurrency.
+
+Transitions are applied as conditional UPDATEs guarded by the booking's
+current status and version, for one booking or many at once. Side effects
+(calendar entries, notifications) are emitted per batch, not per booking.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Q, TextField, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from authentication.models import CustomUser
+from notifications.services import NotificationService
+from .models import CalendarEvent
+from .booking_models import Booking
+from .availability import day_bounds
+from .booking_conflicts import occupied_days
+
+# action -> (allowed source states, target state)
+TRANSITIONS = {
+    'confirm': (('pending_vendor',), 'confirmed'),
+    'cancel': (('pending_vendor', 'confirmed'), 'cancelled'),
+    'complete': (('confirmed',), 'completed'),
+}
+
+# Reasons a booking is skipped by a transition
+NOT_FOUND = 'not_found'
+INVALID_STATE = 'invalid_state'
+STALE = 'stale'
+CONFLICT = 'conflict'
+
+MAX_BULK_SIZE = 200
+
+
+class StaleBookingError(Exception):
+    """Raised when bookings changed between being read and being updated"""
+
+
+def _actor_filter(action, user):
+    if action == 'cancel':
+        return Q(vendor=user) | Q(customer=user)
+    return Q(vendor=user)
+
+
+def bulk_transition(booking_ids, action, user, versions=None, reason=''):
+    """Apply one transition to many bookings with a few set-based statements.
+
+    versions optionally maps booking id -> expected version. Returns
+    (updated bookings, {booking_id: skip reason}).
+    """
+    if action not in TRANSITIONS:
+        raise ValueError(f"Unknown booking action: {action}")
+    sources, target = TRANSITIONS[action]
+    versions = versions or {}
+    booking_ids = list(dict.fromkeys(booking_ids))
+    skipped = {}
+
+    with transaction.atomic():
+        if action == 'confirm' and connection.vendor != 'postgresql':
+            # No booking_no_overlap constraint here: serialise confirmations per
+            # vendor so two racing confirms cannot both pass _drop_conflicts
+            CustomUser.objects.select_for_update().filter(id=user.id).exists()
+
+        # Bookings are not locked: the UPDATE below only matches the versions read here
+        candidates = {
+            booking.id: booking
+            for booking in Booking.objects.filter(
+                _actor_filter(action, user), id__in=booking_ids
+            ).select_related('vendor', 'customer')
+        }
+
+        ready = []
+        for booking_id in booking_ids:
+            booking = candidates.get(booking_id)
+            if booking is None:
+                skipped[booking_id] = NOT_FOUND
+            elif booking.status not in sources:
+                skipped[booking_id] = INVALID_STATE
+            elif booking_id in versions and versions[booking_id] != booking.version:
+                skipped[booking_id] = STALE
+            else:
+                ready.append(booking)
+
+        if action == 'confirm' and ready:
+            ready = _drop_conflicts(ready, skipped)
+
+        if not ready:
+            return [], skipped
+
+        updates = {
+            'status': target,
+            'version': F('version') + 1,
+            'updated_at': timezone.now(),
+        }
+        if action == 'cancel' and reason:
+            updates['description'] = Concat(
+                F('description'), Value(f"\n\nCancellation reason: {reason}"), output_field=TextField()
+            )
+
+        guard = Q()
+        for booking in ready:
+            guard |= Q(id=booking.id, version=booking.version)
+        updated = Booking.objects.filter(guard, status__in=sources).update(**updates)
+        if updated != len(ready):
+            raise StaleBookingError('Bookings were modified by another request')
+
+        for booking in ready:
+            booking.status = target
+            booking.version += 1
+            booking.updated_at = updates['updated_at']
+
+        _emit_side_effects(action, ready, user)
+
+    return ready, skipped
+
+
+def transition_booking(booking_id, action, user, version=None, reason=''):
+    """Single-booking transition; returns (booking or None, skip reason or None)"""
+    versions = {booking_id: version} if version is not None else None
+    updated, skipped = bulk_transition([booking_id], action, user, versions=versions, reason=reason)
+    return (updated[0], None) if updated else (None, skipped[booking_id])
+
+
+def _drop_conflicts(bookings, skipped):
+    """Keep at most one blocking booking per vendor day, against the database and within the batch"""
+    taken = set()
+    for vendor_id in {booking.vendor_id for booking in bookings}:
+        days = [booking.event_date for booking in bookings if booking.vendor_id == vendor_id]
+        taken.update((vendor_id, day) for day in occupied_days(vendor_id, min(days), max(days)))
+
+    kept = []
+    for booking in sorted(bookings, key=lambda b: (b.created_at, b.id)):
+        key = (booking.vendor_id, booking.event_date)
+        if key in taken:
+            skipped[booking.id] = CONFLICT
+        else:
+            taken.add(key)
+            kept.append(booking)
+    return kept
+
+
+def _emit_side_effects(action, bookings, user):
+    ids = [booking.id for booking in bookings]
+
+    if action == 'confirm':
+        CalendarEvent.objects.bulk_create([
+            CalendarEvent(
+                vendor_id=booking.vendor_id,
+                booking=booking,
+                title=f"{booking.service_type} - {booking.customer_name}",
+                event_date=day_bounds(booking.event_date, booking.event_date)[0],
+                description=booking.description,
+                location=booking.location[:255]
+            ) for booking in bookings
+        ])
+        NotificationService.create_notifications_bulk(
+            'booking_confirmed',
+            [{
+                'recipient': booking.customer,
+                'context': {
+                    'vendor_name': booking.vendor.get_full_name() or booking.vendor.username,
+                    'event_type': booking.service_type,
+                    'event_date': booking.event_date.isoformat(),
+                    'booking_id': booking.id
+                },
+                'related_object_id': booking.id
+            } for booking in bookings if booking.customer],
+            priority='high',
+            related_object_type='booking'
+        )
+
+    elif action == 'cancel':
+        CalendarEvent.objects.filter(booking_id__in=ids).delete()
+        entries = []
+        for booking in bookings:
+            recipient = booking.customer if booking.vendor_id == user.id else booking.vendor
+            if recipient is None:
+                continue
+            other_party = booking.vendor if recipient == booking.customer else booking.customer
+            entries.append({
+                'recipient': recipient,
+                'context': {
+                    'other_party': other_party.get_full_name() or other_party.username,
+                    'event_date': booking.event_date.isoformat(),
+                    'booking_id': booking.id
+                },
+                'related_object_id': booking.id
+            })
+        NotificationService.create_notifications_bulk(
+            'booking_cancelled', entries, priority='high', related_object_type='booking'
+        )
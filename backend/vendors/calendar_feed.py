@@ -0,0 +1,121 @@
+"""iCalendar (RFC 5545) feed of a vendor's calendar entries and confirmed bookings.
+
+The feed URL carries a random per-vendor secret (CalendarFeedSecret) rather
+than anything derived from the vendor id, so a leaked URL stops working as
+soon as the vendor regenerates it. Subscribers see no customer names.
+"""
+import secrets
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .models import CalendarEvent, CalendarFeedSecret
+from .booking_models import Booking
+from .availability import BLOCKING_BOOKING_STATUSES
+
+CHUNK_SIZE = 500
+PRODID = '-//PartyOria//Vendor Calendar//EN'
+
+
+def make_feed_token(vendor_id):
+    """The vendor's current feed token, created on first use"""
+    feed, _ = CalendarFeedSecret.objects.get_or_create(
+        vendor_id=vendor_id, defaults={'secret': secrets.token_urlsafe(32)}
+    )
+    return feed.secret
+
+
+def regenerate_feed_token(vendor_id):
+    """Replace the vendor's feed token; URLs with the old one stop working"""
+    secret = secrets.token_urlsafe(32)
+    CalendarFeedSecret.objects.update_or_create(vendor_id=vendor_id, defaults={'secret': secret})
+    return secret
+
+
+def vendor_id_from_token(token):
+    """Return the vendor id for a feed token, or None when it is unknown or revoked"""
+    return CalendarFeedSecret.objects.filter(secret=token).values_list('vendor_id', flat=True).first()
+
+
+def _escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Fold content lines at 75 octets as required by RFC 5545"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        # Never split a multi-byte character
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _end_of_day(value):
+    """Calendar entries block the vendor's whole (local) day"""
+    day = timezone.localtime(value).date() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _calendar_event_lines(event):
+    yield 'BEGIN:VEVENT'
+    yield f"UID:calendar-{event['id']}@partyoria"
+    yield f"DTSTAMP:{_utc(event['updated_at'])}"
+    yield f"LAST-MODIFIED:{_utc(event['updated_at'])}"
+    yield f"DTSTART:{_utc(event['event_date'])}"
+    yield f"DTEND:{_utc(_end_of_day(event['event_date']))}"
+    yield f"SUMMARY:{_escape(event['title'])}"
+    if event['description']:
+        yield f"DESCRIPTION:{_escape(event['description'])}"
+    if event['location']:
+        yield f"LOCATION:{_escape(event['location'])}"
+    yield 'END:VEVENT'
+
+
+def _booking_lines(booking):
+    yield 'BEGIN:VEVENT'
+    yield f"UID:booking-{booking['id']}@partyoria"
+    yield f"DTSTAMP:{_utc(booking['updated_at'])}"
+    yield f"LAST-MODIFIED:{_utc(booking['updated_at'])}"
+    yield f"DTSTART;VALUE=DATE:{booking['event_date']:%Y%m%d}"
+    yield f"DTEND;VALUE=DATE:{booking['event_date'] + timedelta(days=1):%Y%m%d}"
+    yield f"SUMMARY:{_escape(booking['service_type'] + ' booking')}"
+    if booking['description']:
+        yield f"DESCRIPTION:{_escape(booking['description'])}"
+    if booking['location']:
+        yield f"LOCATION:{_escape(booking['location'])}"
+    yield 'STATUS:CONFIRMED'
+    yield 'END:VEVENT'
+
+
+def iter_vendor_feed(vendor_id):
+    """Yield the feed in chunks; rows are read with server-side iteration, never all at once"""
+    yield _fold('BEGIN:VCALENDAR') + _fold('VERSION:2.0') + _fold(f'PRODID:{PRODID}') + _fold('CALSCALE:GREGORIAN')
+
+    events = CalendarEvent.objects.filter(vendor_id=vendor_id, booking__isnull=True).values(
+        'id', 'title', 'event_date', 'description', 'location', 'updated_at'
+    ).order_by('id')
+    for event in events.iterator(chunk_size=CHUNK_SIZE):
+        yield ''.join(_fold(line) for line in _calendar_event_lines(event))
+
+    bookings = Booking.objects.filter(
+        vendor_id=vendor_id,
+        status__in=BLOCKING_BOOKING_STATUSES
+    ).values(
+        'id', 'service_type', 'event_date', 'description', 'location', 'updated_at'
+    ).order_by('id')
+    for booking in bookings.iterator(chunk_size=CHUNK_SIZE):
+        yield ''.join(_fold(line) for line in _booking_lines(booking))
+
+    yield _fold('END:VCALENDAR')
@@ -3,9 +3,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Q
-from datetime import datetime, timedelta
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_GET
+from django.utils.http import http_date, parse_etags
+from datetime import date, datetime, timedelta
 from .models import CalendarEvent
 from .booking_models import Booking
+from . import availability, calendar_feed
 from django.utils import timezone
 
 @api_view(['GET'])
@@ -53,13 +59,18 @@ def create_calendar_event(request):
     data = request.data
     
     try:
+        # A linked entry stops blocking the day on its own, so only the vendor's own bookings may be linked
+        booking_id = data.get('booking_id') or None
+        if booking_id is not None and not Booking.objects.filter(id=booking_id, vendor=vendor).exists():
+            return Response({'error': 'booking_id must be one of your bookings'}, status=status.HTTP_400_BAD_REQUEST)
+        
         event = CalendarEvent.objects.create(
             vendor=vendor,
             title=data['title'],
             event_date=data['event_date'],
             description=data.get('description', ''),
             location=data.get('location', ''),
-            booking_id=data.get('booking_id')
+            booking_id=booking_id
         )
         
         return Response({
@@ -130,4 +141,142 @@ def vendor_availability(request):
         })
         
     except ValueError:
-        return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def vendor_availability_range(request):
+    """Per-day availability for a date window from a single aggregate query"""
+    vendor = request.user
+    start = request.GET.get('start')
+    end = request.GET.get('end')
+    encoding = request.GET.get('encoding', 'bitmap')
+    include_counts = request.GET.get('counts', '').lower() in ('1', 'true')
+    
+    if not start or not end:
+        return Response({'error': 'start and end parameters required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        start_date = date.fromisoformat(start)
+        end_date = date.fromisoformat(end)
+    except ValueError:
+        return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if end_date < start_date:
+        return Response({'error': 'end must not be before start'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if (end_date - start_date).days >= availability.MAX_RANGE_DAYS:
+        return Response({'error': f'Range cannot exceed {availability.MAX_RANGE_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if encoding not in ('bitmap', 'runs'):
+        return Response({'error': 'encoding must be bitmap or runs'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    last_modified, signature = availability.calendar_version(vendor.id)
+    etag = availability.make_etag(signature, start_date, end_date, encoding, include_counts)
+    
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        occupancy = availability.occupancy_by_day(vendor.id, start_date, end_date)
+        busy_days = set(occupancy)
+        
+        data = {
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'encoding': encoding,
+        }
+        if encoding == 'bitmap':
+            data['months'] = availability.encode_month_bitmaps(start_date, end_date, busy_days)
+        else:
+            data['busy'] = availability.encode_runs(start_date, end_date, busy_days)
+        if include_counts:
+            data['counts'] = {day.isoformat(): count for day, count in sorted(occupancy.items())}
+        
+        response = Response(data)
+    
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_vendor_availability(request):
+    """Check which of many vendors are free on a date or range"""
+    vendor_ids = request.data.get('vendor_ids') or []
+    start = request.data.get('start') or request.data.get('date')
+    end = request.data.get('end') or start
+    
+    if not vendor_ids or not start:
+        return Response({'error': 'vendor_ids and date (or start/end) required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(vendor_ids) > 500:
+        return Response({'error': 'At most 500 vendor_ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        vendor_ids = [int(vendor_id) for vendor_id in vendor_ids]
+        start_date = date.fromisoformat(start)
+        end_date = date.fromisoformat(end)
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid vendor id or date format'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if end_date < start_date or (end_date - start_date).days >= availability.MAX_RANGE_DAYS:
+        return Response({'error': 'Invalid date range'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    free = availability.free_vendor_ids(vendor_ids, start_date, end_date)
+    
+    return Response({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'free': sorted(free),
+        'busy': sorted(set(vendor_ids) - free)
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def vendor_calendar_feed_url(request):
+    """Subscription URL for the vendor's iCalendar feed"""
+    token = calendar_feed.make_feed_token(request.user.id)
+    return Response({
+        'feed_url': request.build_absolute_uri(reverse('vendor-calendar-feed', args=[token]))
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def regenerate_calendar_feed_url(request):
+    """Revoke the current feed URL and return a new one"""
+    token = calendar_feed.regenerate_feed_token(request.user.id)
+    return Response({
+        'feed_url': request.build_absolute_uri(reverse('vendor-calendar-feed', args=[token]))
+    })
+
+
+@require_GET
+def vendor_calendar_feed(request, token):
+    """Streaming iCalendar feed; unchanged polls answer 304 before any rows are read"""
+    vendor_id = calendar_feed.vendor_id_from_token(token)
+    if vendor_id is None:
+        raise Http404('Unknown calendar feed')
+    
+    last_modified, signature = availability.calendar_version(vendor_id)
+    etag = availability.make_etag(signature, 'ics')
+    last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+    if not_modified is not None:
+        return not_modified
+    
+    response = StreamingHttpResponse(
+        calendar_feed.iter_vendor_feed(vendor_id),
+        content_type='text/calendar; charset=utf-8'
+    )
+    response['ETag'] = etag
+    if last_modified_ts:
+        response['Last-Modified'] = http_date(last_modified_ts)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
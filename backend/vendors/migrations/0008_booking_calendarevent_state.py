@@ -0,0 +1,83 @@
+# booking_details and vendors_calendarevent were created outside of the
+# migration history (see final_migration.py). This brings both models into
+# migration state and only creates the tables on databases that lack them,
+# so later schema changes can be expressed as regular migrations.
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_missing_tables(apps, schema_editor):
+    existing = set(schema_editor.connection.introspection.table_names())
+    for model_name in ('Booking', 'CalendarEvent'):
+        model = apps.get_model('vendors', model_name)
+        if model._meta.db_table not in existing:
+            schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('events', '0008_remove_budget_positive_total_budget_and_more'),
+        ('vendors', '0007_remove_vendorservicepackage_vendor_and_more'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Booking',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('customer_name', models.CharField(max_length=255)),
+                        ('service_type', models.CharField(max_length=255)),
+                        ('event_date', models.DateField()),
+                        ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                        ('status', models.CharField(choices=[('pending_vendor', 'Pending Vendor Confirmation'), ('confirmed', 'Confirmed'), ('cancelled', 'Cancelled'), ('completed', 'Completed')], default='pending_vendor', max_length=20)),
+                        ('description', models.TextField(blank=True)),
+                        ('location', models.CharField(blank=True, max_length=500)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                        ('vendor_quote_data', models.JSONField(blank=True, default=dict)),
+                        ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='customer_bookings', to=settings.AUTH_USER_MODEL)),
+                        ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='events.event')),
+                        ('quote_request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to='events.quoterequest')),
+                        ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_bookings', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'booking_details',
+                        'ordering': ['-created_at'],
+                        'indexes': [
+                            models.Index(fields=['status', 'vendor'], name='booking_det_status_6cd5da_idx'),
+                            models.Index(fields=['status', 'customer'], name='booking_det_status_d87446_idx'),
+                            models.Index(fields=['event_date'], name='booking_det_event_d_68e731_idx'),
+                        ],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='CalendarEvent',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('event_date', models.DateTimeField()),
+                        ('title', models.CharField(max_length=255)),
+                        ('description', models.TextField(blank=True)),
+                        ('location', models.CharField(blank=True, max_length=255)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('vendor', models.ForeignKey(db_column='vendor_id', on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'vendors_calendarevent',
+                        'ordering': ['event_date'],
+                        'indexes': [
+                            models.Index(fields=['vendor', 'event_date'], name='vendors_cal_vendor__1165b0_idx'),
+                            models.Index(fields=['event_date'], name='vendors_cal_event_d_ed97dd_idx'),
+                        ],
+                    },
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.RunPython(create_missing_tables, migrations.RunPython.noop),
+    ]
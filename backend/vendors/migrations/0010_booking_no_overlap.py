@@ -0,0 +1,62 @@
+from django.db import migrations
+from django.db.models import Count
+
+CONSTRAINT = 'booking_no_overlap'
+BLOCKING_STATUSES = ('confirmed', 'completed')
+
+
+def cancel_overlapping_bookings(apps, schema_editor):
+    """Databases from before the constraint may hold two blocking bookings on one vendor day.
+
+    The earliest-created booking of each such day is kept, the others are
+    cancelled with a note in their description and listed in the migrate output.
+    """
+    Booking = apps.get_model('vendors', 'Booking')
+    clashes = Booking.objects.filter(status__in=BLOCKING_STATUSES).values('vendor_id', 'event_date').annotate(
+        total=Count('id')
+    ).filter(total__gt=1).order_by()
+    for clash in clashes:
+        keep, *extra = Booking.objects.filter(
+            vendor_id=clash['vendor_id'], event_date=clash['event_date'], status__in=BLOCKING_STATUSES
+        ).order_by('created_at', 'id')
+        for booking in extra:
+            booking.status = 'cancelled'
+            booking.description = (
+                f"{booking.description}\n\nCancelled by migration: overlaps booking {keep.id}"
+            ).strip()
+            booking.save(update_fields=['status', 'description'])
+        print(
+            f"\n  booking_no_overlap: vendor {clash['vendor_id']} on {clash['event_date']}: kept booking "
+            f"{keep.id}, cancelled {', '.join(str(booking.id) for booking in extra)}"
+        )
+
+
+def add_exclusion_constraint(apps, schema_editor):
+    # Range exclusion needs GiST; other backends rely on the
+    # sorted-interval check in vendors.booking_conflicts.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    cancel_overlapping_bookings(apps, schema_editor)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f"ALTER TABLE booking_details ADD CONSTRAINT {CONSTRAINT} "
+        "EXCLUDE USING gist (vendor_id WITH =, daterange(event_date, event_date + 1, '[)') WITH &&) "
+        "WHERE (status IN ('confirmed', 'completed'))"
+    )
+
+
+def drop_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'ALTER TABLE booking_details DROP CONSTRAINT IF EXISTS {CONSTRAINT}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vendors', '0009_calendarevent_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_exclusion_constraint, drop_exclusion_constraint),
+    ]
@@ -0,0 +1,56 @@
+# vendors_calendarevent may already carry a legacy booking_id column, so the
+# foreign key is added to the table only where it is missing. The legacy column
+# is a plain integer without a foreign key to booking_details; reversing drops
+# the column only when it has that foreign key, i.e. when this migration added it.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_booking_column(apps, schema_editor):
+    model = apps.get_model('vendors', 'CalendarEvent')
+    with schema_editor.connection.cursor() as cursor:
+        columns = {
+            column.name for column in
+            schema_editor.connection.introspection.get_table_description(cursor, model._meta.db_table)
+        }
+    if 'booking_id' not in columns:
+        schema_editor.add_field(model, model._meta.get_field('booking'))
+
+
+def remove_booking_column(apps, schema_editor):
+    model = apps.get_model('vendors', 'CalendarEvent')
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection.get_constraints(cursor, model._meta.db_table)
+    added_here = any(
+        constraint['columns'] == ['booking_id'] and (constraint['foreign_key'] or ('',))[0] == 'booking_details'
+        for constraint in constraints.values()
+    )
+    if added_here:
+        schema_editor.remove_field(model, model._meta.get_field('booking'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vendors', '0010_booking_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='calendarevent',
+                    name='booking',
+                    field=models.ForeignKey(blank=True, db_column='booking_id', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='calendar_events', to='vendors.booking'),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.RunPython(add_booking_column, remove_booking_column),
+    ]
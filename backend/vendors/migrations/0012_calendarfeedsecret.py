@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('vendors', '0011_booking_version_calendarevent_booking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeedSecret',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('secret', models.CharField(max_length=64, unique=True)),
+                ('rotated_at', models.DateTimeField(auto_now=True)),
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feed_secret', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -111,13 +111,14 @@ class VendorProfile(models.Model):
         return f"Profile for {self.user.email if self.user else 'Unknown'}"
 
 class CalendarEvent(models.Model):
-    # booking = models.ForeignKey('booking_models.Booking', on_delete=models.CASCADE, null=True, blank=True, db_column='booking_id')
+    booking = models.ForeignKey('vendors.Booking', on_delete=models.CASCADE, null=True, blank=True, db_column='booking_id', related_name='calendar_events')
     vendor = models.ForeignKey('authentication.CustomUser', on_delete=models.CASCADE, db_column='vendor_id')
     event_date = models.DateTimeField()
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     location = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'vendors_calendarevent'
@@ -128,4 +129,13 @@ class CalendarEvent(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.title} - {self.event_date.date()}"
\ No newline at end of file
+        return f"{self.title} - {self.event_date.date()}"
+
+class CalendarFeedSecret(models.Model):
+    """Random secret in a vendor's calendar feed URL; replacing it revokes the old URL"""
+    vendor = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='calendar_feed_secret')
+    secret = models.CharField(max_length=64, unique=True)
+    rotated_at = models.DateTimeField(auto_now=True)  # when the current secret was issued
+
+    def __str__(self):
+        return f"Calendar feed of vendor {self.vendor_id}"
@@ -35,6 +35,11 @@ urlpatterns = [
     path('calendar/events/<int:event_id>/', calendar_views.update_calendar_event, name='update-calendar-event'),
     path('calendar/events/<int:event_id>/delete/', calendar_views.delete_calendar_event, name='delete-calendar-event'),
     path('calendar/availability/', calendar_views.vendor_availability, name='vendor-availability'),
+    path('calendar/availability/range/', calendar_views.vendor_availability_range, name='vendor-availability-range'),
+    path('calendar/availability/bulk/', calendar_views.bulk_vendor_availability, name='vendor-availability-bulk'),
+    path('calendar/feed-url/', calendar_views.vendor_calendar_feed_url, name='vendor-calendar-feed-url'),
+    path('calendar/feed-url/regenerate/', calendar_views.regenerate_calendar_feed_url, name='vendor-calendar-feed-url-regenerate'),
+    path('calendar/feed/<str:token>.ics', calendar_views.vendor_calendar_feed, name='vendor-calendar-feed'),
     
     # Booking Management
     path('bookings/', include('vendors.booking_urls')),